@@ -1,8 +1,14 @@
 import sys
 
-HANDLE = None
-if len(sys.argv) > 1:
+
+def get_handle():
+    '''Handle of the current plugin invocation.
+
+    Read from ``sys.argv`` on every call as the interpreter (and with it
+    this module) is reused across invocations if Kodi's
+    ``reuselanguageinvoker`` is enabled.
+    '''
     try:
-        HANDLE = int(sys.argv[1])
-    except ValueError:
-        pass
+        return int(sys.argv[1])
+    except (IndexError, ValueError):
+        return None
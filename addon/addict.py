@@ -1,14 +1,20 @@
+import bisect
 import collections
-import json
+import functools
 import os
+import threading
 import time
-from datetime import datetime
-from urllib.parse import quote_plus, urlencode
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qsl, quote_plus, urlencode, urlparse
 
-import requests
+from addon import rpc, snapshot
+from addon.cache import SQLiteBackend
+from addon.queues import QueueStore
+from addon.stats import (ApiStats, connect_time, endpoint_template,
+                         pool_classes, reset_connect_time)
 
-from dateutil.parser import parse
-from dateutil.tz import tzlocal
+# `requests`, `urllib3` and `dateutil` are imported where they are needed as
+# most plugin invocations are answered from the cache and never need them
 
 NETWORKS = collections.OrderedDict([
     ('difm', {
@@ -104,17 +110,165 @@ NETWORKS = collections.OrderedDict([
 ])
 
 
-def datetime_now():
-    return datetime.now(tzlocal())
+# (connect, read) timeouts in seconds.
+# "interactive" calls block the Kodi UI, "background" ones run in the service
+TIMEOUTS = {
+    'interactive': (3.05, 10),
+    'background': (10, 30),
+}
+
+# Only idempotent methods are retried on read errors and 5xx responses,
+# POST is only retried if the connection could not be established.
+RETRIES = 2
+RETRY_BACKOFF = 0.5
+
+# Grace period (in minutes) during which expired data is returned right
+# away while being refreshed in the background. Expired data is also
+# returned if refreshing fails.
+STALE_TIMES = {
+    'channel_filters': 7 * 24 * 60,
+    'favorites': 24 * 60,
+    'shows_upcoming': 60,
+    'shows_followed': 24 * 60,
+}
+
+# Cache entries the catalog snapshots are compiled from
+SNAPSHOT_SOURCES = ('channel_filters', 'favorites')
+
+# Channel fields kept when caching `channel_filters`, the listings don't
+# read anything else
+CHANNEL_FIELDS = ('id', 'key', 'name', 'images')
+
+# Queued tracks are dropped this many seconds before their asset urls expire
+QUEUE_URL_MARGIN = 5 * 60
+
+# Upper bound of networks being worked on concurrently
+MAX_WORKERS = 4
+
+# Exists while a member is logged in, so plugin invocations can check the
+# login without opening the cache
+SESSION_MARKER = 'session'
+
+_session = None
+
+_revalidations = {}
+_revalidations_lock = threading.Lock()
+
+
+def get_session():
+    '''All networks share the same host, so a single pooled session
+    is shared across every `AudioAddict` instance.'''
+    global _session
+    if _session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=RETRIES, backoff_factor=RETRY_BACKOFF,
+                      status_forcelist=(500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_maxsize=len(NETWORKS), max_retries=retry)
+        # Time DNS lookups and connects for the api stats
+        adapter.poolmanager.pool_classes_by_scheme = pool_classes()
+
+        _session = requests.Session()
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+
+    return _session
+
+
+def get_pool_stats():
+    stats = {'connections': 0, 'requests': 0}
+    if _session is None:
+        return dict(stats, reused=0)
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats['connections'] += pool.num_connections
+            stats['requests'] += pool.num_requests
+
+    stats['reused'] = stats['requests'] - stats['connections']
+    return stats
+
+
+def map_networks(func, networks=None, callback=None):
+    '''Runs ``func(network)`` for all ``networks`` concurrently.
+
+    Returns a ``(results, errors)`` tuple, both keyed by network, so a
+    failing network does not abort the others.
+    ``callback(network, done, total)`` is called from the calling thread
+    whenever a network completed.
+    '''
+    if networks is None:
+        networks = NETWORKS.keys()
+    networks = list(networks)
+
+    results, errors = {}, {}
+    if not networks:
+        return results, errors
+
+    with ThreadPoolExecutor(min(MAX_WORKERS, len(networks))) as executor:
+        futures = {executor.submit(func, n): n for n in networks}
+
+        for done, future in enumerate(as_completed(futures), 1):
+            network = futures[future]
+            try:
+                results[network] = future.result()
+            except Exception as e:
+                errors[network] = e
+
+            if callback:
+                callback(network, done, len(networks))
+
+    return results, errors
+
+
+def wait_for_revalidations():
+    for thread in list(_revalidations.values()):
+        thread.join()
+
+
+def has_session(cache_dir):
+    return os.path.exists(os.path.join(cache_dir, SESSION_MARKER))
 
 
 def parse_datetime(val):
+    from dateutil.parser import parse
+    from dateutil.tz import tzlocal
     try:
         return parse(val).astimezone(tzlocal())
     except Exception:
         return None
 
 
+def parse_timestamp(val):
+    '''Seconds since the epoch of an api date, None if it can't be parsed.
+    '''
+    date = parse_datetime(val)
+    return date.timestamp() if date else None
+
+
+def asset_expires_on(track):
+    '''Timestamp at which the signed asset url of ``track`` expires.'''
+    assets = track.get('content', {}).get('assets') or []
+    if not assets:
+        return None
+
+    url = (assets[0].get('url') or '').split('{?')[0]
+    exp = dict(parse_qsl(urlparse(url).query)).get('exp')
+    if not exp:
+        return None
+
+    if exp.isdigit():
+        return int(exp)
+
+    exp = parse_datetime(exp)
+    return exp.timestamp() if exp else None
+
+
 def convert_url(url, **kwargs):
     if not url:
         return None
@@ -131,28 +285,218 @@ def convert_url(url, **kwargs):
     return url
 
 
+def art_urls(elem, thumb_key='compact', fanart_key='default'):
+    '''Thumbnail and fanart url of an api object (e.g. a channel).'''
+    images = elem.get('images', {})
+    thumb = images.get(thumb_key)
+    fanart = images.get(fanart_key, thumb)
+
+    return convert_url(thumb, width=512), convert_url(fanart, height=720)
+
+
 def log(*args):
     print('[plugin.audio.audioaddict]', [str(a) for a in args])
 
 
+def remote(func):
+    '''Forwards calls of a read-only method to the service's daemon (see
+    `addon.rpc`) if `AudioAddict.rpc_client` is set, falling back to calling
+    it directly if the daemon can't answer.
+
+    Return values have to be JSON serializable.
+    '''
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        # The daemon doesn't see writes this process didn't flush yet
+        if self.rpc_client is not None and not self._backend.dirty:
+            try:
+                result, stale = self.rpc_client.call(
+                    self._namespace, func.__name__, *args, **kwargs)
+                self._served_stale |= stale
+                return result
+            except rpc.RPCError as e:
+                log('Remote call of {} failed: {}'.format(func.__name__, e))
+                # Don't try again during this invocation
+                AudioAddict.rpc_client = None
+
+        return func(self, *args, **kwargs)
+
+    wrapper.remote = True
+    return wrapper
+
+
+def pack_channel_filters(filters):
+    '''Normalizes a `channel_filters` response for caching.
+
+    Every channel is stored once (with `CHANNEL_FIELDS` only), filters
+    reference them by id::
+
+        {'channels': [channel, ...],
+         'filters': [{..., 'channel_ids': [id, ...]}, ...]}
+    '''
+    channels = collections.OrderedDict()
+    packed = []
+    for f in filters:
+        ids = []
+        for c in f.get('channels', []):
+            channels.setdefault(
+                c.get('id'), {k: c[k] for k in CHANNEL_FIELDS if k in c})
+            ids.append(c.get('id'))
+
+        f = {k: v for k, v in f.items() if k != 'channels'}
+        f['channel_ids'] = ids
+        packed.append(f)
+
+    return {'channels': list(channels.values()), 'filters': packed}
+
+
+def unpack_channel_filters(packed):
+    '''Rehydrates `pack_channel_filters` into the shape of the response,
+    the channel dicts are shared between filters.'''
+    if isinstance(packed, list):
+        # Cached before `channel_filters` got normalized
+        return packed
+    if not packed:
+        return []
+
+    channels = {c.get('id'): c for c in packed.get('channels', [])}
+
+    filters = []
+    for f in packed.get('filters', []):
+        f = dict(f)
+        f['channels'] = [
+            channels[i] for i in f.pop('channel_ids', []) if i in channels
+        ]
+        filters.append(f)
+    return filters
+
+
+def pack_upcoming(events):
+    '''Adds the epoch intervals of an `events/upcoming` response for
+    caching, so the dates are parsed once when they are stored::
+
+        {'events': [event, ...],
+         'intervals': [[start, end, event index], ...]}
+
+    Intervals are sorted by start, events without valid dates have none.
+    '''
+    intervals = []
+    for i, event in enumerate(events):
+        start = parse_timestamp(event.get('start_at'))
+        end = parse_timestamp(event.get('end_at'))
+        if start is not None and end is not None:
+            intervals.append([start, end, i])
+
+    intervals.sort()
+    return {'events': events, 'intervals': intervals}
+
+
+class ScheduleIndex:
+    '''Lookups on `pack_upcoming` by time, all times are seconds since the
+    epoch.'''
+    def __init__(self, packed):
+        if isinstance(packed, list):
+            # Cached before `events/upcoming` got packed
+            packed = pack_upcoming(packed)
+        packed = packed or {}
+
+        self.events = packed.get('events', [])
+        self.intervals = [(start, end, self.events[i])
+                          for start, end, i in packed.get('intervals', [])]
+        self.starts = [i[0] for i in self.intervals]
+        self.ends = sorted(i[1] for i in self.intervals)
+
+        self.channels = {}
+        for interval in self.intervals:
+            show = interval[2].get('show', {})
+            for c in show.get('channels', []):
+                self.channels.setdefault(c.get('key'), []).append(interval)
+        self.channel_starts = {
+            k: [i[0] for i in intervals]
+            for k, intervals in self.channels.items()
+        }
+
+    def started(self, now):
+        '''``(start, end, event)`` of the events started by ``now``
+        (including ones which ended already).'''
+        return self.intervals[:bisect.bisect_right(self.starts, now)]
+
+    def upcoming(self, now):
+        '''``(start, end, event)`` of the events not ended by ``now``.'''
+        return [i for i in self.intervals if i[1] > now]
+
+    def live(self, channel, now):
+        '''``(start, end, event)`` of the event live on ``channel``, None if
+        there is none.'''
+        starts = self.channel_starts.get(channel, [])
+        pos = bisect.bisect_right(starts, now) - 1
+        if pos < 0:
+            return None
+
+        # Events of a channel don't overlap
+        interval = self.channels[channel][pos]
+        return interval if interval[1] > now else None
+
+    def next_start(self, now):
+        '''Start of the next event starting after ``now``, None if there is
+        none.'''
+        pos = bisect.bisect_right(self.starts, now)
+        return self.starts[pos] if pos < len(self.starts) else None
+
+    def next_change(self, now):
+        '''Next start or end of an event after ``now``, None if there is
+        none.'''
+        pos = bisect.bisect_right(self.ends, now)
+        changes = [self.next_start(now)]
+        if pos < len(self.ends):
+            changes.append(self.ends[pos])
+        return min([c for c in changes if c is not None], default=None)
+
+
+class CatalogIndex:
+    def __init__(self, filters):
+        self.filters = {}
+        for f in filters:
+            self.filters.setdefault(f.get('key'), f)
+
+        default = self.filters.get('default', {}).get('channels', [])
+        self.channels = {c.get('key'): c for c in default}
+        self.channel_ids = {c.get('id'): c for c in default}
+
+
 class AudioAddict:
     __instances = {}
+    __instances_lock = threading.Lock()
+
+    COMMON = 'common'
 
     data = None
 
     name = None
 
     _cache_dir = None
-    _cache_file = None
-    _ccache_file = None
+    _namespace = None
+    _backend = None
+    _queues = None
 
     _network = None
 
-    _response = None
-    __cache = None
+    _local = None
+    _indexes = None
+    _served_stale = False
+    _refresh_stats = None
+
+    call_class = 'interactive'
 
-    def __init__(self, cache_dir, network):
-        self.__cache = {}
+    # `rpc.Client` the `remote` methods are forwarded to
+    rpc_client = None
+
+    def __init__(self, cache_dir, network, backend=None):
+        # Instances are shared between threads, each one gets its own
+        # `response`
+        self._local = threading.local()
+        self._indexes = {}
+        self._refresh_stats = {'not_modified': 0, 'downloaded': 0}
 
         self.name = NETWORKS[network]['name']
 
@@ -160,17 +504,30 @@ class AudioAddict:
             os.makedirs(cache_dir)
 
         self._cache_dir = cache_dir
-        self._cache_file = os.path.join(cache_dir, network + '.json')
-        self._ccache_file = os.path.join(cache_dir, 'common.json')
+        self._namespace = network
+        self._backend = backend or SQLiteBackend.get(cache_dir)
+        self._queues = QueueStore(self._backend)
 
         self._network = NETWORKS[network]
 
     @classmethod
     def get(cls, cache_dir, network):
         key = cache_dir + network
-        if key not in cls.__instances:
-            cls.__instances[key] = cls(cache_dir, network)
-        return cls.__instances[key]
+        with cls.__instances_lock:
+            if key not in cls.__instances:
+                cls.__instances[key] = cls(cache_dir, network)
+            return cls.__instances[key]
+
+    @classmethod
+    def instances(cls):
+        with cls.__instances_lock:
+            return list(cls.__instances.values())
+
+    def reset_state(self):
+        '''Resets the state tied to a single plugin invocation.'''
+        self._local.response = None
+        self._served_stale = False
+        self._refresh_stats = {'not_modified': 0, 'downloaded': 0}
 
     @property
     def network(self):
@@ -178,72 +535,90 @@ class AudioAddict:
 
     @property
     def response(self):
-        return self._response
+        return getattr(self._local, 'response', None)
 
     @property
-    def cache_file(self):
-        return self._cache_file
+    def backend(self):
+        return self._backend
 
     @property
-    def _cache(self):
-        return (self.__cache.get(self._cache_file)
-                or self._read_cache(self._cache_file))
+    def served_stale(self):
+        return self._served_stale
 
     @property
-    def _ccache(self):
-        return (self.__cache.get(self._ccache_file)
-                or self._read_cache(self._ccache_file))
-
-    def _read_cache(self, cache_file):
-        cls_cache = self.__cache.get(cache_file, {})
-        if cls_cache:
-            return cls_cache
-
-        if not os.path.exists(cache_file):
-            return {}
-
-        with open(cache_file, 'r') as f:
-            try:
-                self.__cache[cache_file] = json.loads(f.read())
-            except ValueError:
-                return {}
-
-        return self.__cache[cache_file]
+    def refresh_stats(self):
+        return self._refresh_stats
 
-    def _write_cache(self, cache_file, cache):
-        self.__cache[cache_file] = cache
-        with open(cache_file, 'w') as f:
-            f.write(json.dumps(cache, indent=2))
+    @property
+    def stats(self):
+        return ApiStats.get(self._backend)
 
-    def _update_cache(self, cache_file, key, data=None, cache_time=None):
-        cache = self.__cache.get(cache_file, {})
-        cache.setdefault(key, {})
+    def _read_cache(self, namespace, key, decode=True):
+        return self._backend.get_entry(namespace, key, decode)
 
-        if data is not None:
-            cache[key]['data'] = data
+    def cache_version(self, key):
+        '''Version (``expires_on``) of a cache entry of this network, None
+        if it isn't cached.'''
+        return self._read_cache(self._namespace, key,
+                                decode=False).get('expires_on')
 
+    def _update_cache(self, namespace, key, data=None, cache_time=None,
+                      validators=None, raw=None):
+        expires_on = None
         if cache_time:
-            cache[key]['expires_on'] = int(time.time() + (cache_time * 60))
+            expires_on = int(time.time() + (cache_time * 60))
 
-        self._write_cache(cache_file, cache)
+        self._backend.set_entry(namespace, key, data, expires_on, validators,
+                                raw)
 
     def _api_call(self, method, paths, auth=None, payload=None, is_json=True,
                   cache='default', cache_key=None, cache_time=0, refresh=False,
-                  **query):
+                  conditional=False, pack=None, decode=True, **query):
+        '''Returns the decoded response, from the cache if possible.
+
+        ``pack`` transforms responses before they are cached, cached and
+        fresh data are returned transformed alike.
 
-        self._response = None
+        Without ``decode`` (nobody reads the result, e.g. background
+        revalidations) cached responses are stored as received and only
+        decoded once read, None is returned.
+        '''
+
+        self._local.response = None
         paths = [str(p) for p in paths]
 
         if cache == 'default':
-            cache = self._cache_file
+            cache = self._namespace
 
         if not cache_key:
             cache_key = '_'.join(paths)
 
-        if not refresh and cache and os.path.exists(cache):
-            _cache = self._read_cache(cache).get(cache_key, {})
+        stale_time = STALE_TIMES.get(cache_key, 0) if cache else 0
+        endpoint = endpoint_template(paths)
+
+        if not refresh and cache:
+            _cache = self._read_cache(cache, cache_key, decode=False)
             expires_on = _cache.get('expires_on')
+
+            status = None
             if _cache and (not expires_on or expires_on > time.time()):
+                status = 'hit'
+            elif (_cache and stale_time
+                    and expires_on + stale_time * 60 > time.time()):
+                status = 'stale'
+
+            # Only decoded if usable, unreadable entries are fetched again
+            if status:
+                _cache = self._read_cache(cache, cache_key)
+
+            if status and _cache:
+                self.stats.record(endpoint, self._namespace, cache=status)
+                if status == 'stale':
+                    self._revalidate(
+                        method, paths, auth=auth, payload=payload,
+                        is_json=is_json, cache=cache, cache_key=cache_key,
+                        cache_time=cache_time, conditional=conditional,
+                        pack=pack, **query)
                 return _cache.get('data')
 
         paths = '/'.join([quote_plus(p) for p in paths])
@@ -256,53 +631,140 @@ class AudioAddict:
         if query:
             url += '?{}'.format(query)
 
+        # Let the server tell us if the cached data is still up to date
+        headers = {}
+        _cache = {}
+        if cache:
+            _cache = self._read_cache(cache, cache_key, decode=False)
+        validators = _cache.get('validators') or {}
+        if conditional and ('data' in _cache or 'raw' in _cache):
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        event = {'cache': 'miss' if cache else 'bypass'}
+        reset_connect_time()
+        start = time.perf_counter()
         try:
             data = {'data': payload}
             if is_json:
                 data = {'json': payload}
 
-            self._response = method(url, auth=auth, **data)
+            response = self._local.response = getattr(get_session(), method)(
+                url, auth=auth, headers=headers,
+                timeout=TIMEOUTS[self.call_class], **data)
+            event.update(status=response.status_code,
+                         size=len(response.content),
+                         latency=time.perf_counter() - start,
+                         connect=connect_time())
+
+            if headers and response.status_code == 304:
+                self._refresh_stats['not_modified'] += 1
+                self._update_cache(cache, cache_key, cache_time=cache_time)
+                if decode:
+                    return self._read_cache(cache, cache_key).get('data')
+                return None
+
+            # Errors never replace entries which can be served stale, the
+            # stale one is served instead (see below). Others are replaced
+            # as before, e.g. a rejected session marks the user inactive.
+            if stale_time and not response.ok:
+                response.raise_for_status()
+
+            # Packed data has to be encoded again, so it's decoded anyway
+            cache_data = None
+            if decode or pack or not cache:
+                decode_start = time.perf_counter()
+                cache_data = response.json()
+                event['decode'] = time.perf_counter() - decode_start
+
+            if pack:
+                cache_data = pack(cache_data)
 
-            cache_data = self._response.json()
             if cache:
-                self._update_cache(cache, cache_key, cache_data, cache_time)
+                self._refresh_stats['downloaded'] += 1
+                resp_headers = response.headers
+                validators = {
+                    'etag': resp_headers.get('ETag'),
+                    'last_modified': resp_headers.get('Last-Modified'),
+                }
+                self._update_cache(
+                    cache, cache_key, cache_data, cache_time, validators,
+                    raw=None if pack else response.content)
 
             return cache_data
 
-        except Exception:
+        except Exception as e:
+            log('API call to {} failed: {!r}'.format(endpoint, e))
+            event.setdefault('latency', time.perf_counter() - start)
+            event.setdefault('connect', connect_time())
+            event['error'] = type(e).__name__
+
+            if stale_time:
+                _cache = self._read_cache(cache, cache_key)
+                if _cache:
+                    self._served_stale = True
+                    return _cache.get('data')
+
             return {}
 
+        finally:
+            self.stats.record(endpoint, self._namespace, **event)
+
+    def _revalidate(self, method, paths, **kwargs):
+        key = (kwargs['cache'], kwargs['cache_key'])
+
+        with _revalidations_lock:
+            thread = _revalidations.get(key)
+            if thread and thread.is_alive():
+                return
+
+            # Separate instance for its own `call_class`
+            aa = AudioAddict(self._cache_dir, self._namespace, self._backend)
+            aa.call_class = 'background'
+
+            thread = threading.Thread(
+                target=aa._api_call, args=(method, paths),
+                kwargs=dict(kwargs, refresh=True, decode=False))
+            _revalidations[key] = thread
+            thread.start()
+
     def _get(self, *paths, **kwargs):
-        return self._api_call(requests.get, paths, auth=('mobile', 'apps'),
+        return self._api_call('get', paths,
+                              auth=('mobile', 'apps'), conditional=True,
                               **kwargs)
 
     def _post(self, *paths, **kwargs):
         cache = kwargs.get('cache', None)
         if 'cache' in kwargs:
             kwargs.pop('cache')
-        return self._api_call(requests.post, paths, auth=('mobile', 'apps'),
+        return self._api_call('post', paths,
+                              auth=('mobile', 'apps'),
                               cache=cache, **kwargs)
 
     def _delete(self, *paths, **kwargs):
         cache = kwargs.get('cache', None)
         if cache:
             kwargs.pop('cache')
-        return self._api_call(requests.delete, paths, auth=('mobile', 'apps'),
+        return self._api_call('delete', paths,
+                              auth=('mobile', 'apps'),
                               cache=cache, **kwargs)
 
     def invalidate_cache(self):
-        cache = self._read_cache(self._cache_file)
-        for key, val in list(cache.items()):
-            expires_on = val.get('expires_on')
-            if expires_on and expires_on < time.time():
-                del cache[key]
+        # Entries which can still be served stale are kept for that long
+        self._backend.purge(self._namespace, grace={
+            key: stale_time * 60 for key, stale_time in STALE_TIMES.items()
+        })
 
-        with open(self._cache_file, 'w') as f:
-            f.write(json.dumps(cache, indent=2))
+    def clear_cache(self):
+        self._backend.clear(self._namespace)
+        self._queues.clear()
+        snapshot.remove(self._cache_dir, self._namespace)
 
     @property
     def user(self):
-        return self._ccache.get('user', {}).get('data', {})
+        return self._read_cache(self.COMMON, 'user').get('data') or {}
 
     @property
     def member_id(self):
@@ -332,103 +794,215 @@ class AudioAddict:
     def is_premium(self):
         return self.member.get('user_type') == 'premium'
 
+    def _index(self, name, source, build):
+        # Indexes are rebuilt whenever the cached payload they were built
+        # from got replaced (e.g. after a refresh)
+        index = self._indexes.get(name)
+        if index is None or index[0] is not source:
+            index = (source, build(source))
+            self._indexes[name] = index
+        return index[1]
+
+    def _catalog(self, refresh=False):
+        return self._index('catalog', self.get_channel_filters(refresh),
+                           CatalogIndex)
+
+    @remote
+    def get_channel(self, channel):
+        return self._catalog().channels.get(channel)
+
     def get_channel_id(self, channel):
-        for c in self.get_channels():
-            if c['key'] == channel:
-                return c['id']
-        return None
+        return (self.get_channel(channel) or {}).get('id')
 
+    @remote
     def get_channel_name(self, channel):
-        for c in self.get_channels():
-            if c['key'] == channel:
-                return c['name']
-        return None
+        return (self.get_channel(channel) or {}).get('name')
+
+    def get_favorite_ids(self, refresh=False):
+        return self._index(
+            'favorites', self.get_favorites(refresh),
+            lambda favorites: {f.get('channel_id') for f in favorites})
 
     def logout(self):
-        if os.path.exists(self._ccache_file):
-            os.remove(self._ccache_file)
-        if os.path.exists(self._cache_file):
-            os.remove(self._cache_file)
+        self._backend.clear(self.COMMON)
+        self._backend.clear(self._namespace)
+        snapshot.remove(self._cache_dir, self._namespace)
+        self.update_session_marker()
+
+    def update_snapshot(self):
+        '''Compiles the catalog snapshot listings are served from (see
+        `addon.snapshot`) unless it's up to date.
+
+        Returns whether it was compiled.
+        '''
+        filters = self.get_channel_filters()
+        favorite_ids = self.get_favorite_ids()
+
+        sources = tuple(self.cache_version(key) or 0
+                        for key in SNAPSHOT_SOURCES)
+
+        path = snapshot.path(self._cache_dir, self._namespace)
+        current = snapshot.Snapshot.open(self._cache_dir, self._namespace,
+                                         expired=True)
+        if current:
+            with current:
+                if current.sources == sources:
+                    return False
+
+        rows, indexes = [], {}
+        for f in filters:
+            for c in f.get('channels', []):
+                if c.get('id') in indexes:
+                    continue
+                indexes[c.get('id')] = len(rows)
+                rows.append(snapshot.Row(
+                    c.get('key'), c.get('name'),
+                    *art_urls(c, 'default', 'compact'),
+                    favorite=c.get('id') in favorite_ids))
+
+        styles = [(f.get('key'), f.get('name'),
+                   [indexes[c.get('id')] for c in f.get('channels', [])])
+                  for f in filters]
+
+        favorites = [indexes[c.get('id')]
+                     for c in self.get_favorite_channels() if c]
+        if favorites:
+            styles.insert(0, (snapshot.FAVORITES, None, favorites))
+
+        # Usable until the entries it was compiled from expire, listings
+        # go through the api calls from there so they get revalidated
+        valid_until = min(sources)
+
+        snapshot.write(path, rows, styles, valid_until, sources)
+        return True
+
+    def update_session_marker(self):
+        path = os.path.join(self._cache_dir, SESSION_MARKER)
+        if self.is_active:
+            open(path, 'w').close()
+        elif os.path.exists(path):
+            os.remove(path)
 
     def next_channel_track(self, channel, tune_in=True, refresh=False,
-                           pop=False, live=True):
+                           pop=False, live=True, reload=False):
         is_live = False
         track = None
 
         if live:
-            now = datetime_now()
-            for show in self.get_live_shows():
-                channels = [
-                    c for c in show.get('show', {}).get('channels', [])
-                    if c.get('key') == channel
-                ]
-
-                if len(channels) == 0:
-                    continue
+            now = time.time()
+            interval = self.get_schedule().live(channel, now)
 
-                end_at = parse_datetime(show.get('end_at'))
-
-                if not end_at:
-                    continue
-
-                if end_at < now:
-                    continue
+            if interval:
+                _, end_at, show = interval
 
                 track = show.get('tracks')[0]
                 if not track.get('content', {}).get('assets', {}):
                     track = self.get_track(track.get('id'))
 
-                time_left = (end_at - now).seconds
-                if time_left < 2:
-                    break
-
-                track['content']['offset'] = track.get('length') - time_left
-
-                is_live = True
-                break
+                time_left = int(end_at - now)
+                if time_left >= 2:
+                    track['content']['offset'] = (track.get('length') -
+                                                  time_left)
+                    is_live = True
 
         if not track:
-            cache_file = os.path.join(self._cache_dir, 'channel_tracks.json')
-
-            channel_id = self.get_channel_id(channel)
-            track_list = self.get_track_list(channel, refresh=refresh,
-                                             cache=cache_file)
+            if not refresh:
+                track = self._next_queued('channel', channel, pop, reload)
 
-            is_new = False
-            if (track_list.get('channel_id') != channel_id
-                    or len(track_list.get('tracks', [])) < 1):
-                is_new = True
+            if not track:
                 track_list = self.get_track_list(channel, tune_in,
-                                                 refresh=True,
-                                                 cache=cache_file)
+                                                 refresh=True) or {}
+                track = self._fill_queue('channel', channel,
+                                         track_list.get('tracks', []), pop)
 
-            track = (track_list['tracks'].pop(0)
-                     if pop else track_list['tracks'][0])
+        return (is_live, track)
 
-            if is_new or pop:
-                self._update_cache(cache_file, 'channel_tracks', track_list)
+    def refill_channel_tracks(self, channel, min_tracks=3, url_margin=900):
+        '''Tops up the queued tracks of ``channel`` once less than
+        ``min_tracks`` are left or their urls expire within ``url_margin``
+        seconds.
+
+        Returns `True` if the queue has been updated.
+        '''
+        # Plugin invocations advance the queue in the meantime
+        tracks = self._queues.get(self._namespace, 'channel', channel,
+                                  reload=True)
+        if not tracks:
+            return False
+
+        def is_expiring(track):
+            expires_on = asset_expires_on(track)
+            return bool(expires_on and expires_on < time.time() + url_margin)
+
+        if len(tracks) >= min_tracks and not any(map(is_expiring, tracks)):
+            return False
+
+        # The first track is already queued in Kodi, so keep it and only
+        # renew its url
+        renewed = {}
+        if is_expiring(tracks[0]):
+            track = self.get_track(tracks[0].get('id'))
+            if track:
+                renewed[track.get('id')] = track
+
+        routine = self.get_track_list(channel, tune_in=False) or {}
+
+        # Plugin invocations might have advanced the queue while fetching
+        with self._queues.locked():
+            tracks = self._queues.get(self._namespace, 'channel', channel,
+                                      reload=True)
+            if not tracks:
+                return False
+
+            head = [renewed.get(tracks[0].get('id'), tracks[0])]
+            tracks = head + [t for t in tracks[1:] if not is_expiring(t)]
+
+            known = {t.get('id') for t in tracks}
+            tracks.extend(t for t in routine.get('tracks', [])
+                          if t.get('id') not in known)
+
+            self._put_queue('channel', channel, tracks)
+        return True
+
+    def next_playlist_track(self, playlist_id, refresh=False, pop=True,
+                            reload=False):
+        track = None
+        if not refresh:
+            track = self._next_queued('playlist', playlist_id, pop, reload)
 
-        return (is_live, track)
+        if not track:
+            track_list = self.get_playlist_tracks(playlist_id) or {}
+            track = self._fill_queue('playlist', playlist_id,
+                                     track_list.get('tracks', []), pop)
 
-    def next_playlist_track(self, playlist_id, refresh=False, pop=True):
-        cache_file = os.path.join(self._cache_dir, 'playlist_tracks.json')
+        return track
 
-        track_list = self.get_playlist_tracks(playlist_id, refresh=refresh,
-                                              cache=cache_file)
+    def _next_queued(self, kind, id_, pop, reload):
+        # Concurrent invocations (e.g. widgets or remotes resolving tracks)
+        # must never pop the same track
+        with self._queues.locked(exclusive=pop):
+            tracks = self._queues.get(self._namespace, kind, id_, reload)
+            if tracks and pop:
+                self._queues.advance(self._namespace, kind, id_)
 
-        is_new = False
+        return tracks[0] if tracks else None
 
-        if (track_list.get('id') != playlist_id
-                or len(track_list.get('tracks', [])) == 0):
-            is_new = True
-            track_list = self.get_playlist_tracks(playlist_id, refresh=True)
+    def _fill_queue(self, kind, id_, tracks, pop):
+        with self._queues.locked():
+            self._put_queue(kind, id_, tracks)
+            if pop:
+                self._queues.advance(self._namespace, kind, id_)
 
-        track = track_list['tracks'].pop(0) if pop else track_list['tracks'][0]
+        return tracks[0]
 
-        if is_new or refresh or pop:
-            self._update_cache(cache_file, 'playlist_tracks', track_list)
+    def _put_queue(self, kind, id_, tracks):
+        # A queue is only usable as long as its asset urls are valid
+        expires_on = [asset_expires_on(t) for t in tracks]
+        expires_on = [e for e in expires_on if e]
+        if expires_on:
+            expires_on = int(min(expires_on)) - QUEUE_URL_MARGIN
 
-        return track
+        self._queues.put(self._namespace, kind, id_, tracks, expires_on)
 
     #
     # --- Wrapper ---
@@ -436,18 +1010,22 @@ class AudioAddict:
     def get_channels(self, styles=None, refresh=False):
         if not styles:
             styles = ['default']
+        elif isinstance(styles, str):
+            styles = [styles]
 
-        for s in self.get_channel_filters():
-            if s['key'] in styles:
-                return s['channels']
+        filters = self._catalog(refresh).filters
+        for style in styles:
+            if style in filters:
+                return filters[style].get('channels', [])
         return []
 
+    @remote
     def get_favorite_channels(self, refresh=False):
-        ids = [
-            f.get('channel_id') for f in self.get_favorites(refresh=refresh)
+        channels = self._catalog().channel_ids
+        return [
+            channels.get(f.get('channel_id'))
+            for f in self.get_favorites(refresh=refresh)
         ]
-        channels = {c.get('id'): c for c in self.get_channels()}
-        return [channels.get(i) for i in ids]
 
     def add_favorite(self, channel):
         channel_id = self.get_channel_id(channel)
@@ -457,38 +1035,38 @@ class AudioAddict:
         channel_id = self.get_channel_id(channel)
         return self.favorites(remove=[channel_id])
 
+    @remote
     def get_live_shows(self, refresh=False):
-        now = datetime_now()
-
-        shows = []
-        for up in self.get_upcoming(refresh=refresh):
-            start_at = parse_datetime(up.get('start_at'))
-            if not start_at:
-                continue
+        schedule = self.get_schedule(refresh=refresh)
+        return [show for _, __, show in schedule.started(time.time())]
 
-            if start_at > now:
-                continue
-
-            shows.append(up)
-
-        return shows
+    def get_schedule(self, limit=24, refresh=False):
+        '''`ScheduleIndex` of the upcoming events.'''
+        packed = self._get('events', 'upcoming', limit=limit,
+                           cache_key='shows_upcoming', cache_time=10,
+                           refresh=refresh, pack=pack_upcoming)
+        return self._index('schedule', packed, ScheduleIndex)
 
     #
     # --- Get ---
     #
     def get_member_session(self):
-        return self._get('member_sessions', self.user.get('key'),
-                         cache=self._ccache_file, cache_key='user',
-                         refresh=True)
+        session = self._get('member_sessions', self.user.get('key'),
+                            cache=self.COMMON, cache_key='user',
+                            refresh=True)
+        self.update_session_marker()
+        return session
 
     def get_subscriptions(self):
         return self._get('members', self.member_id, 'subscriptions', 'active',
                          cache=None)
 
     def get_channel_filters(self, refresh=False):
-        return self._get('channel_filters', cache_time=24 * 60,
-                         refresh=refresh)
+        packed = self._get('channel_filters', cache_time=24 * 60,
+                           refresh=refresh, pack=pack_channel_filters)
+        return self._index('channel_filters', packed, unpack_channel_filters)
 
+    @remote
     def get_favorites(self, refresh=False):
         return self._get('members', self.member_id, 'favorites', 'channels',
                          cache_key='favorites', cache_time=10, refresh=refresh)
@@ -508,17 +1086,19 @@ class AudioAddict:
     def get_track(self, track_id):
         return self._get('tracks', track_id, cache=None)
 
+    @remote
     def get_show_facets(self, refresh=False):
         res = self._get('shows', cache_key='show_facets', cache_time=24 * 60,
                         refresh=refresh, page=1, per_page=0)
         return res.get('metadata', {}).get('facets', [])
 
+    @remote
     def get_shows(self, channel, page=1, per_page=25, refresh=False):
-        for facet in self.get_show_facets():
-            if facet.get('name') == channel:
-                field = facet.get('field')
-                break
+        facets = self._index(
+            'facets', self.get_show_facets(),
+            lambda facets: {f.get('name'): f for f in reversed(facets)})
 
+        field = facets.get(channel, {}).get('field')
         if not field:
             raise ValueError(
                 'Unable to determin a valid field for channel "{}"'.format(
@@ -533,22 +1113,23 @@ class AudioAddict:
         return self._get('shows', cache_key=cache_key, cache_time=60,
                          refresh=refresh, **query).get('results', [])
 
+    @remote
     def get_shows_followed(self, page=1, per_page=25, refresh=False):
         return self._get('members', self.member_id, 'followed_items', 'show',
                          page=page, per_page=per_page,
                          cache_key='shows_followed', cache_time=10,
                          refresh=refresh)
 
+    @remote
     def get_show_episodes(self, slug, page=1, per_page=25, refresh=False):
         cache_key = 'show_episodes_{}_{}'.format(slug, page)
         return self._get('shows', slug, 'episodes', page=page,
                          per_page=per_page, cache_key=cache_key, cache_time=10,
                          refresh=refresh)
 
+    @remote
     def get_upcoming(self, limit=24, refresh=False):
-        return self._get('events', 'upcoming', limit=limit,
-                         cache_key='shows_upcoming', cache_time=10,
-                         refresh=refresh)
+        return self.get_schedule(limit, refresh).events
 
     def get_track_list(self, channel, tune_in=True, refresh=True, cache=None):
         channel_id = self.get_channel_id(channel)
@@ -566,18 +1147,21 @@ class AudioAddict:
             return None
         return self._get('listen_history', channel_id=channel_id, cache=None)
 
+    @remote
     def search(self, query, page=1, per_page=25):
         cache_key = 'search_{}'.format(query.lower())
         query = {'q': query, 'page': page, 'per_page': per_page}
 
         return self._get('search', cache_key=cache_key, cache_time=10, **query)
 
+    @remote
     def search_shows(self, query, page=1, per_page=25):
         cache_key = 'search_shows_{}'.format(query.lower())
         query = {'q': query, 'page': page, 'per_page': per_page}
 
         return self._get('shows', cache_key=cache_key, cache_time=10, **query)
 
+    @remote
     def search_channels(self, query, page=1, per_page=25):
         cache_key = 'search_channels_{}'.format(query.lower())
         query = {'q': query, 'page': page, 'per_page': per_page}
@@ -585,6 +1169,7 @@ class AudioAddict:
         return self._get('channels', cache_key=cache_key, cache_time=10,
                          **query)
 
+    @remote
     def get_playlists(self, order_by, page=1, per_page=25):
         cache_key = 'search_playlists_{}'.format(order_by.lower())
         query = {'order_by': order_by, 'page': page, 'per_page': per_page}
@@ -598,6 +1183,7 @@ class AudioAddict:
     def get_playlists_newest(self, page=1, per_page=25):
         return self.get_playlists('newest_sort desc', page, per_page)
 
+    @remote
     def get_playlists_followed(self, page=1, per_page=25):
         query = {'order_by': 'follow_date', 'page': page, 'per_page': per_page}
         return {
@@ -620,7 +1206,8 @@ class AudioAddict:
             'member_session[password]': password,
         }
         self._post('member_sessions', payload=payload, is_json=False,
-                   cache=self._ccache_file, cache_key='user', refresh=True)
+                   cache=self.COMMON, cache_key='user', refresh=True)
+        self.update_session_marker()
         return self.is_active
 
     def add_listen_history(self, channel, track_id):
@@ -636,12 +1223,7 @@ class AudioAddict:
                           show)
 
         # Invalidate all show cache
-        cache = self._cache
-        for key, val in self._cache.items():
-            if key.startswith('shows_'):
-                del cache[key]
-
-        self._write_cache(self._cache_file, cache)
+        self._backend.delete(self._namespace, prefix='shows_')
         return resp
 
     def favorites(self, add=None, remove=None):
@@ -666,7 +1248,10 @@ class AudioAddict:
         resp = self._post('members', self.member_id, 'favorites', 'channels',
                           payload={'favorites': favorites})
 
-        self._update_cache(self._cache_file, 'favorites', favorites)
+        self._update_cache(self._namespace, 'favorites', favorites)
+
+        # Listed from the cache until the service compiled it again
+        snapshot.remove(self._cache_dir, self._namespace)
         return resp
 
     def preferred_quality(self, quality_id):
@@ -686,10 +1271,5 @@ class AudioAddict:
                             'show', show)
 
         # Invalidate all show cache
-        cache = self._cache
-        for key, val in self._cache.items():
-            if key.startswith('shows_'):
-                del cache[key]
-
-        self._write_cache(self._cache_file, cache)
+        self._backend.delete(self._namespace, prefix='shows_')
         return resp
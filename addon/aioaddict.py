@@ -0,0 +1,68 @@
+import asyncio
+import functools
+
+from addon.addict import NETWORKS, AudioAddict
+
+
+class AsyncAudioAddict:
+    '''Asyncio variant of `AudioAddict`.
+
+    Every public method of `AudioAddict` is available as a coroutine
+    function sharing the same endpoints, cache keys and cache backend.
+    Calls run on the event loop's executor so requests made through
+    `asyncio.gather` are issued concurrently over the shared connection
+    pool.
+    '''
+    __instances = {}
+
+    def __init__(self, cache_dir, network):
+        self._aa = AudioAddict.get(cache_dir, network)
+
+    @classmethod
+    def get(cls, cache_dir, network):
+        key = cache_dir + network
+        if key not in cls.__instances:
+            cls.__instances[key] = cls(cache_dir, network)
+        return cls.__instances[key]
+
+    @property
+    def sync(self):
+        return self._aa
+
+    def __getattr__(self, name):
+        attr = getattr(self._aa, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(attr, *args, **kwargs))
+
+        return wrapper
+
+
+async def gather_networks(cache_dir, method, *args, networks=None, **kwargs):
+    '''Calls ``method`` on every network concurrently.
+
+    Returns a dict keyed by network. Failing networks map to the raised
+    exception instead of aborting the others.
+    '''
+    if networks is None:
+        networks = NETWORKS.keys()
+    networks = list(networks)
+
+    results = await asyncio.gather(*[
+        getattr(AsyncAudioAddict.get(cache_dir, n), method)(*args, **kwargs)
+        for n in networks
+    ], return_exceptions=True)
+
+    return dict(zip(networks, results))
+
+
+async def gather_pages(method, pages, *args, **kwargs):
+    '''Fetches all ``pages`` of a paginated coroutine method concurrently
+    and returns the results in page order.'''
+    return await asyncio.gather(
+        *[method(*args, page=page, **kwargs) for page in pages])
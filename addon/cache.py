@@ -0,0 +1,503 @@
+import abc
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, sections are only exclusive between the
+    # threads of a process there
+    fcntl = None
+
+SHARED = 'shared'
+EXCLUSIVE = 'exclusive'
+
+
+def synchronized(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
+class CacheBackend(abc.ABC):
+    '''Stores cache entries (``{'data': ..., 'expires_on': ...,
+    'validators': ...}``) by namespace and key.
+
+    Entries can be set from the ``raw`` response instead of the decoded
+    ``data``. Backends keeping those bytes as they are decode them only
+    once ``data`` is read (``get_entry`` with ``decode``) and keep the
+    result for the rest of the process.
+
+    A namespace is either a network key (e.g. ``difm``) or one of the shared
+    namespaces like ``common`` or ``queues``.
+
+    With ``write_behind`` enabled, writes only update the in-memory state and
+    mark it dirty until ``flush`` is called.
+
+    Backends are shared between threads (e.g. background refreshes), every
+    public method holds the backend's lock. Read-modify-write sequences
+    spanning processes (plugin invocations and the service) go through
+    `locked`.
+    '''
+    __instances = {}
+    __instances_lock = threading.Lock()
+
+    LOCK_NAME = 'cache.lock'
+
+    write_behind = False
+
+    # Disables the advisory lock between processes (e.g. to reproduce lost
+    # updates in ``bench.stress``)
+    locking = True
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        self._lock = threading.RLock()
+        self._dirty = set()
+
+        self._lock_file = None
+        self._lock_mode = None
+
+        self._writes = 0
+        self._physical_writes = 0
+
+    @classmethod
+    def get(cls, cache_dir):
+        key = cls.__name__ + cache_dir
+        with CacheBackend.__instances_lock:
+            if key not in CacheBackend.__instances:
+                CacheBackend.__instances[key] = cls(cache_dir)
+            return CacheBackend.__instances[key]
+
+    @classmethod
+    def instances(cls):
+        '''Backends opened by this process so far.'''
+        with CacheBackend.__instances_lock:
+            return list(CacheBackend.__instances.values())
+
+    def _flock(self, mode):
+        if fcntl is None or not self.locking:
+            return
+
+        if self._lock_file is None:
+            self._lock_file = open(
+                os.path.join(self._cache_dir, self.LOCK_NAME), 'a')
+
+        fcntl.flock(self._lock_file, {
+            None: fcntl.LOCK_UN,
+            SHARED: fcntl.LOCK_SH,
+            EXCLUSIVE: fcntl.LOCK_EX,
+        }[mode])
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        '''Holds the advisory lock of the cache dir (`SHARED` or
+        `EXCLUSIVE`) which all processes using it share.
+
+        Changes of other processes are picked up when entering. Writes made
+        while holding the lock exclusively are flushed before releasing it,
+        so read-modify-write sequences don't lose updates. Sections can be
+        nested and should be kept short (no api calls).
+        '''
+        with self._lock:
+            outer = self._lock_mode
+            mode = EXCLUSIVE if exclusive or outer == EXCLUSIVE else SHARED
+            if mode != outer:
+                self._flock(mode)
+            self._lock_mode = mode
+
+            try:
+                if outer is None:
+                    self.revalidate()
+                yield
+                if mode == EXCLUSIVE and outer != EXCLUSIVE:
+                    self.flush()
+            finally:
+                if mode != outer:
+                    self._flock(outer)
+                self._lock_mode = outer
+
+    @abc.abstractmethod
+    def get_entry(self, namespace, key, decode=True):
+        '''Without ``decode``, ``data`` may be missing from the entry if it
+        wasn't decoded yet (its ``raw`` bytes are there instead).
+        '''
+
+    @abc.abstractmethod
+    def reload(self, namespace, key):
+        '''Like ``get_entry`` but picks up changes made by other processes.
+        '''
+
+    @abc.abstractmethod
+    def revalidate(self):
+        '''Drops in-memory state other processes changed on disk since.
+
+        Backends outlive a single plugin invocation if the interpreter is
+        reused, so this is called at the start of every invocation.
+        '''
+
+    @abc.abstractmethod
+    def set_entry(self, namespace, key, data=None, expires_on=None,
+                  validators=None, raw=None):
+        pass
+
+    @abc.abstractmethod
+    def delete(self, namespace, key=None, prefix=None):
+        pass
+
+    @abc.abstractmethod
+    def purge(self, namespace, now=None, grace=None):
+        '''Deletes the expired entries of a namespace. Entries of the keys
+        in ``grace`` are kept for that many more seconds.'''
+
+    def clear(self, namespace):
+        self.delete(namespace)
+
+    @abc.abstractmethod
+    def flush(self):
+        pass
+
+    def reset_counters(self):
+        '''Resets `writes` and `physical_writes`, e.g. per invocation.'''
+        self._writes = 0
+        self._physical_writes = 0
+
+    @property
+    def dirty(self):
+        '''Whether there are writes not flushed yet.'''
+        return bool(self._dirty)
+
+    @property
+    def writes(self):
+        return self._writes
+
+    @property
+    def physical_writes(self):
+        return self._physical_writes
+
+    @property
+    def writes_saved(self):
+        return self._writes - self._physical_writes
+
+
+class SQLiteBackend(CacheBackend):
+    '''All namespaces in a single ``cache.db`` with one row per
+    (namespace, key).
+
+    Raw responses are stored as they are (``data`` of the row) and only
+    decoded when read.
+
+    Every commit bumps the ``generation`` in the ``meta`` table and stamps
+    the rows it wrote with it, so `revalidate` only drops the entries other
+    processes changed. Deleting rows drops all entries instead.
+
+    The ``<namespace>.json`` files of the previous cache format are
+    imported the first time the database is opened.
+    '''
+    DB_NAME = 'cache.db'
+
+    # Track lists of the previous cache format, replaced by the queues
+    OBSOLETE_JSON = ['channel_tracks', 'playlist_tracks']
+    SCHEMA_VERSION = 2
+
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir)
+        self._entries = {}
+
+        self._db = sqlite3.connect(os.path.join(cache_dir, self.DB_NAME),
+                                   timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                         '  namespace TEXT NOT NULL,'
+                         '  key TEXT NOT NULL,'
+                         '  data TEXT,'
+                         '  expires_on INTEGER,'
+                         '  validators TEXT,'
+                         '  generation INTEGER NOT NULL DEFAULT 0,'
+                         '  PRIMARY KEY (namespace, key))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_expires_on '
+                         'ON cache (expires_on)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                         '  key TEXT PRIMARY KEY,'
+                         '  value INTEGER NOT NULL)')
+        self._db.execute('INSERT OR IGNORE INTO meta (key, value) '
+                         "VALUES ('generation', 0), ('deleted', 0)")
+        self._db.commit()
+
+        self._migrate_schema()
+        self._db.execute('CREATE INDEX IF NOT EXISTS cache_generation '
+                         'ON cache (generation)')
+        self._db.commit()
+        self._migrate_json()
+
+        # Changes whenever another connection commits
+        self._data_version = self._get_data_version()
+        self._generation = self._get_meta()['generation']
+
+    def _get_data_version(self):
+        return self._db.execute('PRAGMA data_version').fetchone()[0]
+
+    def _get_meta(self):
+        return dict(self._db.execute('SELECT key, value FROM meta'))
+
+    def _next_generation(self, deleted=False):
+        '''Bumps the generation, has to be called within the transaction
+        writing the rows.'''
+        self._db.execute("UPDATE meta SET value = value + 1 "
+                         "WHERE key = 'generation'")
+        generation = self._get_meta()['generation']
+        if deleted:
+            self._db.execute("UPDATE meta SET value = ? "
+                             "WHERE key = 'deleted'", (generation, ))
+        return generation
+
+    def _migrate_schema(self):
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+
+        columns = [r[1] for r in self._db.execute('PRAGMA table_info(cache)')]
+
+        with self._db:
+            if 'validators' not in columns:
+                self._db.execute(
+                    'ALTER TABLE cache ADD COLUMN validators TEXT')
+
+            if 'generation' not in columns:
+                self._db.execute('ALTER TABLE cache ADD COLUMN generation '
+                                 'INTEGER NOT NULL DEFAULT 0')
+
+            self._db.execute('PRAGMA user_version = {}'.format(
+                self.SCHEMA_VERSION))
+
+    def _migrate_json(self):
+        from addon.addict import NETWORKS
+
+        for name in self.OBSOLETE_JSON:
+            try:
+                os.remove(os.path.join(self._cache_dir, name + '.json'))
+            except OSError:
+                pass
+
+        for namespace in list(NETWORKS.keys()) + ['common']:
+            path = os.path.join(self._cache_dir, namespace + '.json')
+            if not os.path.exists(path):
+                continue
+
+            try:
+                with open(path, 'r') as f:
+                    cache = json.loads(f.read())
+            except OSError:
+                continue
+            except ValueError:
+                cache = {}
+
+            with self._db:
+                for key, val in cache.items():
+                    if not isinstance(val, dict):
+                        continue
+                    self._db.execute(
+                        'INSERT OR IGNORE INTO cache '
+                        '(namespace, key, data, expires_on) '
+                        'VALUES (?, ?, ?, ?)',
+                        (namespace, key, json.dumps(val.get('data')),
+                         val.get('expires_on')))
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _load(self, namespace, key):
+        row = self._db.execute(
+            'SELECT data, expires_on, validators FROM cache '
+            'WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+
+        entry = {}
+        if row:
+            try:
+                entry = {
+                    'raw': row[0],
+                    'expires_on': row[1],
+                    'validators': json.loads(row[2] or 'null'),
+                }
+            except (TypeError, ValueError):
+                pass
+
+        self._entries[(namespace, key)] = entry
+        return entry
+
+    @synchronized
+    def get_entry(self, namespace, key, decode=True):
+        entry = self._entries.get((namespace, key))
+        if entry is None:
+            entry = self._load(namespace, key)
+
+        if decode and 'data' not in entry and 'raw' in entry:
+            try:
+                # Kept next to the raw bytes, writing the entry again (e.g.
+                # a new expiry) doesn't need to encode it
+                entry['data'] = json.loads(entry['raw'])
+            except (TypeError, ValueError):
+                entry = {}
+                self._entries[(namespace, key)] = entry
+
+        return entry
+
+    @synchronized
+    def reload(self, namespace, key):
+        if (namespace, key) not in self._dirty:
+            self._entries.pop((namespace, key), None)
+        return self.get_entry(namespace, key)
+
+    @synchronized
+    def revalidate(self):
+        data_version = self._get_data_version()
+        if data_version == self._data_version:
+            return
+
+        self._data_version = data_version
+        meta = self._get_meta()
+
+        if meta['deleted'] > self._generation:
+            changed = set(self._entries)
+        else:
+            changed = set(self._db.execute(
+                'SELECT namespace, key FROM cache WHERE generation > ?',
+                (self._generation, )))
+
+        self._generation = meta['generation']
+        for k in changed - self._dirty:
+            self._entries.pop(k, None)
+
+    @synchronized
+    def set_entry(self, namespace, key, data=None, expires_on=None,
+                  validators=None, raw=None):
+        entry = dict(self.get_entry(namespace, key, decode=False))
+
+        if raw is not None:
+            entry['raw'] = raw
+            entry.pop('data', None)
+
+        if data is not None:
+            # Callers passing both promise ``data`` is ``raw`` decoded
+            entry['data'] = data
+            if raw is None:
+                entry.pop('raw', None)
+
+        if expires_on is not None:
+            entry['expires_on'] = expires_on
+
+        if validators is not None:
+            entry['validators'] = validators
+
+        self._entries[(namespace, key)] = entry
+        self._writes += 1
+
+        if self.write_behind:
+            self._dirty.add((namespace, key))
+        else:
+            self._write_rows([(namespace, key)])
+
+    def _write_rows(self, keys):
+        rows = []
+        for namespace, key in keys:
+            entry = self._entries[(namespace, key)]
+            data = entry.get('raw')
+            if data is None:
+                # Kept so writing the entry again doesn't encode it again
+                data = entry['raw'] = json.dumps(entry.get('data'))
+
+            rows.append([namespace, key, data, entry.get('expires_on'),
+                         json.dumps(entry.get('validators'))])
+
+        with self._db:
+            generation = self._next_generation()
+            self._db.executemany(
+                'INSERT OR REPLACE INTO cache '
+                '(namespace, key, data, expires_on, validators, generation) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [row + [generation] for row in rows])
+        self._physical_writes += 1
+
+        # Unless another process committed in between, there is nothing
+        # this process hasn't seen yet
+        if generation == self._generation + 1:
+            self._generation = generation
+
+    @synchronized
+    def flush(self):
+        if self._dirty:
+            self._write_rows(self._dirty)
+        self._dirty.clear()
+
+    @synchronized
+    def delete(self, namespace, key=None, prefix=None):
+        for ns, k in list(self._dirty):
+            if ns != namespace:
+                continue
+            if ((key is None and prefix is None) or k == key
+                    or (prefix is not None and k.startswith(prefix))):
+                self._dirty.discard((ns, k))
+
+        with self._db:
+            if key is not None:
+                cursor = self._db.execute(
+                    'DELETE FROM cache WHERE namespace = ? AND key = ?',
+                    (namespace, key))
+            elif prefix is not None:
+                cursor = self._db.execute(
+                    'DELETE FROM cache '
+                    'WHERE namespace = ? AND substr(key, 1, ?) = ?',
+                    (namespace, len(prefix), prefix))
+            else:
+                cursor = self._db.execute(
+                    'DELETE FROM cache WHERE namespace = ?', (namespace, ))
+
+            if cursor.rowcount:
+                self._next_generation(deleted=True)
+
+        for ns, k in list(self._entries.keys()):
+            if ns != namespace:
+                continue
+            if key is None and prefix is None:
+                del self._entries[(ns, k)]
+            elif k == key or (prefix is not None and k.startswith(prefix)):
+                del self._entries[(ns, k)]
+
+    @synchronized
+    def purge(self, namespace, now=None, grace=None):
+        if now is None:
+            now = time.time()
+        grace = grace or {}
+
+        extra = '0'
+        params = [namespace]
+        if grace:
+            extra = 'CASE key {} ELSE 0 END'.format(
+                ' '.join(['WHEN ? THEN ?'] * len(grace)))
+            for item in grace.items():
+                params.extend(item)
+
+        with self._db:
+            cursor = self._db.execute(
+                'DELETE FROM cache '
+                'WHERE namespace = ? AND expires_on + {} < ?'.format(extra),
+                params + [now])
+            if cursor.rowcount:
+                self._next_generation(deleted=True)
+
+        for (ns, k), entry in list(self._entries.items()):
+            expires_on = entry.get('expires_on')
+            if (ns == namespace and expires_on
+                    and expires_on + grace.get(k, 0) < now):
+                del self._entries[(ns, k)]
+                self._dirty.discard((ns, k))
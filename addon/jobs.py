@@ -0,0 +1,304 @@
+import heapq
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from addon.addict import log
+
+NAMESPACE = 'jobs'
+
+# Jobs running concurrently
+WORKERS = 2
+
+# Seconds a job is pushed back while the user is browsing
+DEFER_DELAY = 30
+
+# Seconds to wait for a worker to return when all of them are busy
+BUSY_WAIT = 1
+
+# Failed jobs are retried after their interval times 2 ** failures, capped
+BACKOFF_MAX = 6 * 60 * 60
+
+
+class Job:
+    '''A periodic background task of the service.
+
+    ``interval`` and ``max_runtime`` are in seconds. Runs are spread by
+    +/- ``jitter`` (a fraction of the interval) so jobs started together
+    don't keep running together. Jobs with a lower ``priority`` run first
+    when several are due, ``defer`` ones wait while the user is browsing.
+
+    Due jobs are skipped (until their next interval) while ``when`` returns
+    false. Jobs which don't ``wake`` the service run once it woke up for
+    another reason. ``paused`` jobs don't run before they are resumed (see
+    `Scheduler.resume`).
+    '''
+    def __init__(self, name, func, interval, priority=10, jitter=0.1,
+                 max_runtime=60, defer=True, delay=0, when=None, wake=True,
+                 paused=False):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.priority = priority
+        self.jitter = jitter
+        self.max_runtime = max_runtime
+        self.defer = defer
+        self.when = when
+        self.wake = wake
+        self.paused = paused
+
+        # Sequence number of the job's current queue entry
+        self.seq = None
+
+        self.next_run = time.time() + delay
+        self.started = None
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.failures = 0
+        self.runs = 0
+        self.deferrals = 0
+        self.skips = 0
+        self.overruns = 0
+
+    @property
+    def running(self):
+        return self.started is not None
+
+    def schedule(self, now, failed=False):
+        delay = self.interval
+        if failed:
+            delay = min(BACKOFF_MAX, delay * 2 ** self.failures)
+
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.next_run = now + delay
+
+    def state(self):
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'priority': self.priority,
+            'running': self.running,
+            'paused': self.paused,
+            'next_run': self.next_run,
+            'last_run': self.last_run,
+            'last_duration': self.last_duration,
+            'last_error': self.last_error,
+            'failures': self.failures,
+            'runs': self.runs,
+            'deferrals': self.deferrals,
+            'skips': self.skips,
+            'overruns': self.overruns,
+        }
+
+
+class Scheduler:
+    '''Runs `Job` s on a bounded pool of worker threads.
+
+    Due jobs are taken off a priority queue by (due time, priority). A job
+    missed while the service slept runs once as soon as it wakes up. The
+    state of all jobs is stored in the cache (`NAMESPACE`) after every run
+    so plugin invocations can show it (see `load_state`).
+
+    Threads can't be stopped, jobs exceeding their ``max_runtime`` are
+    counted as failed (and backed off) and not started again before they
+    returned.
+
+    The service sleeps until `due_in`. Jobs queued to run before that (e.g.
+    resumed ones) are started by a timer instead of waiting for it.
+    '''
+    def __init__(self, backend, jobs, is_browsing=None, workers=WORKERS):
+        self._backend = backend
+        self._jobs = list(jobs)
+        self._is_browsing = is_browsing or (lambda: False)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers)
+        self._workers = workers
+        self._saved = None
+
+        # When the service wakes up next (see `due_in`) and the timer
+        # waking it earlier
+        self._wake_at = 0
+        self._timer = None
+        self._timer_at = None
+
+        self._queue = []
+        self._seq = 0
+        for job in self._jobs:
+            if not job.paused:
+                self._push(job)
+
+    def _push(self, job):
+        self._seq += 1
+        job.seq = self._seq
+        heapq.heappush(self._queue,
+                       (job.next_run, job.priority, self._seq, job))
+
+        if job.wake:
+            self._arm(job.next_run)
+
+    def _arm(self, next_run):
+        if next_run >= min(self._wake_at, self._timer_at or float('inf')):
+            return
+
+        if self._timer:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(0, next_run - time.time()),
+                                      self._wake)
+        self._timer.daemon = True
+        self._timer_at = next_run
+        self._timer.start()
+
+    def _wake(self):
+        with self._lock:
+            self._timer = None
+            self._timer_at = None
+        self.run_pending()
+
+    def _pop(self):
+        return heapq.heappop(self._queue)[3]
+
+    def _drop_stale(self):
+        # Entries of paused (or since rescheduled) jobs stay in the queue
+        # until they reach its head
+        while self._queue and self._queue[0][2] != self._queue[0][3].seq:
+            heapq.heappop(self._queue)
+
+    def _job(self, name):
+        return next(job for job in self._jobs if job.name == name)
+
+    def pause(self, name):
+        with self._lock:
+            job = self._job(name)
+            job.paused = True
+            job.seq = None
+
+    def resume(self, name):
+        '''Schedules a paused job to run after its interval.'''
+        with self._lock:
+            job = self._job(name)
+            if not job.paused:
+                return
+
+            job.paused = False
+            if not job.running:
+                job.schedule(time.time())
+                self._push(job)
+
+    def due_in(self):
+        '''Seconds until the next job waking the service is due (0 if one
+        is), None if there are none.'''
+        with self._lock:
+            now = time.time()
+            due = [next_run for next_run, _, seq, job in self._queue
+                   if seq == job.seq and job.wake]
+            if not due:
+                self._wake_at = float('inf')
+                return None
+
+            due = max(0, min(due) - now)
+            if sum(job.running for job in self._jobs) >= self._workers:
+                # Nothing can start before a worker returns
+                due = max(due, BUSY_WAIT)
+            self._wake_at = now + due
+            return due
+
+    def run_pending(self):
+        '''Starts the jobs which are due by priority, as many as there are
+        idle workers.'''
+        now = time.time()
+        browsing = None
+
+        with self._lock:
+            self._check_overruns(now)
+            idle = self._workers - sum(job.running for job in self._jobs)
+
+            due = []
+            self._drop_stale()
+            while self._queue and self._queue[0][0] <= now:
+                due.append(self._pop())
+                self._drop_stale()
+            due.sort(key=lambda job: (job.priority, job.next_run))
+
+            for job in due:
+                if job.when and not job.when():
+                    job.skips += 1
+                    job.schedule(now)
+                    self._push(job)
+                    continue
+
+                if job.defer and idle > 0:
+                    if browsing is None:
+                        browsing = self._is_browsing()
+                    if browsing:
+                        job.deferrals += 1
+                        job.next_run = now + DEFER_DELAY
+
+                if idle <= 0 or job.next_run > now:
+                    self._push(job)
+                    continue
+
+                job.started = now
+                idle -= 1
+                self._executor.submit(self._run, job)
+
+    def _check_overruns(self, now):
+        for job in self._jobs:
+            if (job.running and job.max_runtime
+                    and now - job.started > job.max_runtime
+                    and job.last_error != 'overrun'):
+                log('Job {} exceeded {}s'.format(job.name, job.max_runtime))
+                job.overruns += 1
+                job.last_error = 'overrun'
+
+    def _run(self, job):
+        start = time.time()
+        error = None
+        try:
+            job.func()
+        except Exception as e:
+            log('Job {} failed: {!r}'.format(job.name, e))
+            error = repr(e)
+
+        with self._lock:
+            now = time.time()
+            overrun = job.max_runtime and now - start > job.max_runtime
+            if overrun and not error:
+                error = 'overrun'
+
+            job.started = None
+            job.last_run = start
+            job.last_duration = now - start
+            job.last_error = error
+            job.runs += 1
+            job.failures = job.failures + 1 if error else 0
+            job.schedule(now, failed=bool(error))
+            if not job.paused:
+                self._push(job)
+
+        self.save()
+
+    def save(self):
+        '''Stores the state of the jobs unless it didn't change since.'''
+        with self._lock:
+            state = [job.state() for job in self._jobs]
+            if state == self._saved:
+                return
+            self._saved = state
+
+        self._backend.set_entry(NAMESPACE, 'state', state)
+        self._backend.flush()
+
+    def shutdown(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+
+        # Running jobs are left to finish on their own
+        self._executor.shutdown(wait=False)
+
+
+def load_state(backend):
+    '''State of the service's jobs, as stored by `Scheduler.save`.'''
+    return backend.reload(NAMESPACE, 'state').get('data') or []
@@ -1,3 +1,4 @@
+import collections
 import os
 import sys
 import time
@@ -7,7 +8,8 @@ import xbmcvfs
 import xbmcaddon
 import xbmcgui
 import xbmcplugin
-from addon import HANDLE, addict, utils
+from addon import (addict, cache, get_handle, jobs, rpc, snapshot, stats,
+                   utils)
 from addon.utils import _enc
 from mapper import Mapper
 
@@ -20,6 +22,13 @@ PROFILE_DIR = xbmcvfs.translatePath(os.path.join(
 
 TEST_LOGIN_NETWORK = 'difm'
 
+# Seconds a resolved track not started from a playlist gets to start playing
+# before it's played explicitly
+EXPLICIT_PLAY_DELAY = 1
+
+# Routes which work without being logged in
+NO_LOGIN_ROUTES = ['setup', 'logout', 'clear_cache', 'stats', 'jobs']
+
 
 @MPR.s_url('/')
 @MPR.s_url('/networks/')
@@ -48,8 +57,8 @@ def list_network(network):
     items = []
 
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
-    xbmcplugin.setContent(HANDLE, 'files')
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
+    xbmcplugin.setContent(get_handle(), 'files')
 
     # Channels
     items.append((utils.build_path('channels', network),
@@ -77,46 +86,67 @@ def list_network(network):
 
 @MPR.s_url('/channels/<network>/')
 def list_styles(network):
-    aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
-    xbmcplugin.setContent(HANDLE, 'albums')
+    xbmcplugin.setPluginCategory(get_handle(),
+                                 addict.NETWORKS[network]['name'])
+    xbmcplugin.setContent(get_handle(), 'albums')
 
     items = []
 
-    filters = aa.get_channel_filters()
-    favorites = aa.get_favorite_channels()
-    if favorites:
-        filters.insert(
-            0, {
-                'key': 'favorites',
-                'name': utils.translate(30308),
-                'channels': favorites,
-            })
-
-    for style in filters:
-        item = xbmcgui.ListItem('{} ({})'.format(
-            _enc(style.get('name')), len(style.get('channels', []))))
-        items.append((utils.build_path('channels', network,
-                                       style.get('key')), item, True))
+    snap = snapshot.Snapshot.open(PROFILE_DIR, network)
+    if snap:
+        with snap:
+            styles = snap.styles()
+
+    else:
+        aa = addict.AudioAddict.get(PROFILE_DIR, network)
+        styles = [(f.get('key'), f.get('name'), len(f.get('channels', [])))
+                  for f in aa.get_channel_filters()]
+
+        favorites = aa.get_favorite_channels()
+        if favorites:
+            styles.insert(0, (snapshot.FAVORITES, None, len(favorites)))
+
+    for key, name, count in styles:
+        if key == snapshot.FAVORITES:
+            name = utils.translate(30308)
+
+        item = xbmcgui.ListItem('{} ({})'.format(_enc(name), count))
+        items.append((utils.build_path('channels', network, key), item, True))
 
     utils.list_items(items)
 
 
 @MPR.s_url('/channels/<network>/<style>/')
 def list_channels(network, style=None, channels=None, do_list=True):
-    aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
-    xbmcplugin.setContent(HANDLE, 'songs')
+    xbmcplugin.setPluginCategory(get_handle(),
+                                 addict.NETWORKS[network]['name'])
+    xbmcplugin.setContent(get_handle(), 'songs')
 
     items = []
 
+    rows = None
     if not channels:
-        if style == 'favorites':
-            channels = aa.get_favorite_channels()
-        else:
-            channels = aa.get_channels(style)
+        snap = snapshot.Snapshot.open(PROFILE_DIR, network)
+        if snap:
+            with snap:
+                rows = snap.channels(style or 'default')
+
+    if rows is None:
+        aa = addict.AudioAddict.get(PROFILE_DIR, network)
+        if not channels:
+            if style == snapshot.FAVORITES:
+                channels = aa.get_favorite_channels()
+            else:
+                channels = aa.get_channels(style)
+
+        favorites = aa.get_favorite_ids()
+        rows = [
+            snapshot.Row(c.get('key'), c.get('name'),
+                         *addict.art_urls(c, 'default', 'compact'),
+                         favorite=c.get('id') in favorites)
+            for c in channels
+        ]
 
-    favorites = [f['channel_id'] for f in aa.get_favorites()]
     # If I ever manage to get label2 to show, that's what we're going to
     # put there...
     # playing = {
@@ -126,35 +156,33 @@ def list_channels(network, style=None, channels=None, do_list=True):
     # }
 
     active = utils.get_playing() or {}
-    for channel in channels:
-        item_url = utils.build_path('play', 'channel', network,
-                                    channel.get('key'))
+    for row in rows:
+        item_url = utils.build_path('play', 'channel', network, row.key)
 
-        item = xbmcgui.ListItem(_enc(channel.get('name')))
+        item = xbmcgui.ListItem(_enc(row.name))
         item.setPath(item_url)
         # item.setLabel2(playing[channel.get('id')])
         item.setProperty('IsPlayable', 'false')
-        item = utils.add_aa_art(item, channel, 'default', 'compact')
+        item = utils.set_art(item, row.thumb, row.fanart)
 
-        if active.get('channel') == channel.get('key'):
+        if active.get('channel') == row.key:
             item.select(True)
 
         cmenu = []
-        if channel.get('id') not in favorites:
+        if not row.favorite:
             # Add to favorites
             cmenu.append((utils.translate(30326), 'RunPlugin({})'.format(
-                utils.build_path('favorite', network, channel.get('key'),
-                                 channel_name=_enc(channel.get('name'))))))
+                utils.build_path('favorite', network, row.key,
+                                 channel_name=_enc(row.name)))))
         else:
             # Remove from favorites
             cmenu.append((utils.translate(30327), 'RunPlugin({})'.format(
-                utils.build_path('unfavorite', network, channel.get('key'),
-                                 channel_name=_enc(channel.get('name'))))))
+                utils.build_path('unfavorite', network, row.key,
+                                 channel_name=_enc(row.name)))))
 
         cmenu.append(
             (utils.translate(30330), 'Container.Update({}, return)'.format(
-                utils.build_path('listen_history', network,
-                                 channel.get('key')))))
+                utils.build_path('listen_history', network, row.key))))
 
         item.addContextMenuItems(cmenu, True)
         items.append((item_url, item, False))
@@ -167,8 +195,8 @@ def list_channels(network, style=None, channels=None, do_list=True):
 @MPR.s_url('/listen_history/<network>/<channel>/')
 def list_listen_history(network, channel):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
-    xbmcplugin.setContent(HANDLE, 'songs')
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
+    xbmcplugin.setContent(get_handle(), 'songs')
 
     items = []
     for track in aa.get_listen_history(channel):
@@ -183,7 +211,7 @@ def list_listen_history(network, channel):
 @MPR.s_url('/shows/<network>/')
 def list_shows_menu(network):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     items = []
 
@@ -210,7 +238,7 @@ def list_shows_menu(network):
 @MPR.s_url('/shows/<network>/followed/')
 def list_shows_followed(network, page=1):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     per_page = ADDON.getSettingInt('aa.shows_per_page')
 
@@ -234,7 +262,7 @@ def list_shows_followed(network, page=1):
 @MPR.s_url('/shows/<network>/fields/<field>/')
 def list_shows_styles(network, field):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     facets = aa.get_show_facets()
     facets = sorted(facets, key=lambda f: f['name'])
@@ -255,7 +283,7 @@ def list_shows_styles(network, field):
 @MPR.s_url('/shows/<network>/facets/<facet>/')
 def list_shows(network, facet='All', page=1):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     per_page = ADDON.getSettingInt('aa.shows_per_page')
     shows = aa.get_shows(facet, page=page, per_page=per_page)
@@ -278,28 +306,28 @@ def list_shows(network, facet='All', page=1):
 @MPR.s_url('/shows/<network>/schedule/')
 def list_shows_schedule(network, page=1):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
-
-    shows = aa.get_upcoming()
-    shows = sorted(shows, key=lambda s: s['start_at'])
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     # Shows for "get_upcoming" have "following" always set to False
     # Have to work around this for now :/
-    followed_shows = aa.get_shows_followed()
+    # Only this route uses asyncio which is expensive to import
+    import asyncio
+    from addon import aioaddict
+
+    aio = aioaddict.AsyncAudioAddict.get(PROFILE_DIR, network)
+
+    async def fetch():
+        return await asyncio.gather(aio.get_schedule(),
+                                    aio.get_shows_followed())
+
+    schedule, followed_shows = asyncio.run(fetch())
+
     followed_slugs = [s.get('slug') for s in followed_shows]
 
-    now = addict.datetime_now()
     active = utils.get_playing() or {}
     utils.log('active item', active)
     items = []
-    for show in shows:
-        end_at = addict.parse_datetime(show.get('end_at'))
-
-        if end_at < now:
-            continue
-
-        start_at = addict.parse_datetime(show.get('start_at'))
-
+    for start_at, end_at, show in schedule.upcoming(time.time()):
         show = show.get('show', {})
         channel = show.get('channels', [])[0]
 
@@ -317,8 +345,9 @@ def list_shows_schedule(network, page=1):
                     and active.get('channel') == channel.get('key')):
                 item.select(True)
         else:
-            label_prefix = '{} - {}'.format(start_at.strftime('%H:%M'),
-                                            end_at.strftime('%H:%M'))
+            label_prefix = '{} - {}'.format(
+                time.strftime('%H:%M', time.localtime(start_at)),
+                time.strftime('%H:%M', time.localtime(end_at)))
 
         item.setLabel('[B]{}[/B] - {} [I]({})[/I]'.format(
             label_prefix, _enc(show.get('name')), _enc(channel.get('name'))))
@@ -331,7 +360,7 @@ def list_shows_schedule(network, page=1):
 @MPR.s_url('/playlists/<network>/')
 def list_playlist_menu(network):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     items = []
 
@@ -353,8 +382,8 @@ def list_playlist_menu(network):
 @MPR.s_url('/playlists/<network>/<sort>')
 def list_playlists(network, sort, page=1):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setContent(HANDLE, 'songs')
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setContent(get_handle(), 'songs')
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     # ToDo shows/playlists per page
     per_page = ADDON.getSettingInt('aa.shows_per_page')
@@ -392,8 +421,8 @@ def list_playlists(network, sort, page=1):
 @MPR.s_url('/episodes/<network>/<slug>/', type_cast={'page': int})
 def list_episodes(network, slug, page=1):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setContent(HANDLE, 'songs')
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setContent(get_handle(), 'songs')
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     per_page = ADDON.getSettingInt('aa.shows_per_page')
 
@@ -466,7 +495,7 @@ def unfollow(network, slug, show_name=''):
 @MPR.s_url('/search/<network>/<filter_>/<query>/', type_cast={'page': int})
 def search(network, filter_=None, query=None, page=1):
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
-    xbmcplugin.setPluginCategory(HANDLE, aa.name)
+    xbmcplugin.setPluginCategory(get_handle(), aa.name)
 
     per_page = ADDON.getSettingInt('aa.shows_per_page')
 
@@ -515,12 +544,13 @@ def search(network, filter_=None, query=None, page=1):
 
 @MPR.s_url('/play/channel/<network>/<channel>/', type_cast={'live': bool})
 def play_channel(network, channel, live=False):
-    utils.logd('Fetching tracklist from server...')
+    utils.logd('Fetching tracklist...')
     aa = addict.AudioAddict.get(PROFILE_DIR, network)
 
     with utils.busy_dialog():
+        # Recently played channels still have their queue
         is_live, track = aa.next_channel_track(channel, tune_in=True,
-                                               refresh=True, pop=False,
+                                               refresh=False, pop=False,
                                                live=live)
 
         utils.logd('Activating first track: {}, is-live: {}'.format(
@@ -539,10 +569,14 @@ def play_channel(network, channel, live=False):
         # `item_url` points to an addon internal url, not a resolved one.
         #
         item = utils.build_track_item(track, item_url)
-        xbmcplugin.setResolvedUrl(HANDLE, True, item)
+
+        # Kodi resolves `item_url` in a new invocation which has to see the
+        # fetched tracklist
+        aa.backend.flush()
+        xbmcplugin.setResolvedUrl(get_handle(), True, item)
 
         # Activated through Kodi UI, needs explicit play
-        if HANDLE == -1:
+        if get_handle() == -1:
             utils.logd('Triggering explicit play')
             playlist.add(item.getPath(), item)
             xbmc.Player().play(playlist)
@@ -570,50 +604,33 @@ def resolve_channel_track(network, channel, track_id, is_live=False):
     album = '{} / {}'.format(aa.name, _enc(aa.get_channel_name(channel)))
     item = utils.build_track_item(track, album=album)
 
-    xbmcplugin.setResolvedUrl(HANDLE, True, item)
-
-    offset = track.get('content', {}).get('offset', 0)
-    if ADDON.getSettingBool('addon.seek_offset') and offset:
-        # Have at least 30 sec. left to prevent the track ending before
-        # the next one has been queued
-        length = track.get('length')
-        offset = min(length - 30, offset)
-
-        utils.logd('Seeking to:', offset)
-        if not utils.seek_offset(offset):
-            utils.logd('Seeking failed!')
-
-    aa.add_listen_history(channel, track_id)
-
-    # Queue another track if it's the last one playing
-    playlist = xbmc.PlayList(xbmc.PLAYLIST_MUSIC)
-    if playlist.getposition() + 2 < playlist.size():
-        return
-
-    # e.g "Yatse" clears the playlist, removing this entry.
-    # As such we wait a little before queuing another track
-    time.sleep(1)
-    utils.logd('Adding another track to the playlist...')
-    is_live, track = aa.next_channel_track(channel, tune_in=False,
-                                           refresh=False, pop=False,
-                                           live=not current_is_live)
-
-    item = utils.build_track_item(
-        track,
-        utils.build_path('channel', 'track', network, channel, track.get('id'),
-                         is_live=is_live), album=album)
-
-    utils.logd('Queuing track: {}, is-live: {}'.format(track.get('id'),
-                                                       is_live))
-    playlist.add(item.getPath(), item)
+    # Seeking into live shows, adding to the listen history and queuing the
+    # next track is done by the service once playback actually started
+    aa.backend.flush()
+    xbmcplugin.setResolvedUrl(get_handle(), True, item)
 
     # If activated through JSON-RPCs `Player.Open`, we have to trigger the
     # explicit play here where `item` has an actual resolved url.
-    if not xbmc.Player().isPlaying():
+    # `play_channel` only queued the track if it triggered playback itself.
+    playlist = xbmc.PlayList(xbmc.PLAYLIST_MUSIC)
+    if playlist.size() == 0 and not wait_for_playback(EXPLICIT_PLAY_DELAY):
         utils.logd('Triggering explicit play...')
+        playlist.add(item.getPath(), item)
         xbmc.Player().play(playlist)
 
 
+def wait_for_playback(timeout):
+    '''Whether playback started within ``timeout`` seconds.'''
+    monitor = xbmc.Monitor()
+    player = xbmc.Player()
+    deadline = time.time() + timeout
+
+    while not player.isPlaying():
+        if time.time() >= deadline or monitor.waitForAbort(0.1):
+            return False
+    return True
+
+
 @MPR.s_url('/play/playlist/<network>/<playlist_id>/',
            type_cast={'playlist_id': int})
 def play_playlist(network, playlist_id, playlist_name=''):
@@ -634,10 +651,11 @@ def play_playlist(network, playlist_id, playlist_name=''):
         playlist.add(item.getPath(), item)
         playlist.getposition
 
-        xbmcplugin.setResolvedUrl(HANDLE, True, item)
+        aa.backend.flush()
+        xbmcplugin.setResolvedUrl(get_handle(), True, item)
 
         # Activated through UI, needs explicit play
-        if HANDLE == -1:
+        if get_handle() == -1:
             utils.logd('Triggering explicit play')
             xbmc.Player().play()
 
@@ -661,27 +679,10 @@ def resolve_playlist_track(network, playlist_id, track_id, playlist_name=''):
     album = '{} / {}'.format(aa.name, _enc(playlist_name))
     item = utils.build_track_item(track, album=album)
 
-    xbmcplugin.setResolvedUrl(HANDLE, True, item)
-
-    # Queue another track if it's the last one playing
-    playlist = xbmc.PlayList(xbmc.PLAYLIST_MUSIC)
-    if playlist.getposition() + 2 < playlist.size():
-        return
-
-    # e.g "Yatse" clears the playlist, removing this entry.
-    # As such we wait a little before queuing another track
-    time.sleep(1)
-    utils.logd('Adding another track to the playlist...')
-    track = aa.next_playlist_track(playlist_id, refresh=False, pop=False)
-
-    item = utils.build_track_item(
-        track,
-        utils.build_path('playlist', 'track', network, playlist_id,
-                         track.get('id'), playlist_name=playlist_name),
-        album=album)
-
-    utils.logd('Queuing track: {}'.format(track.get('id')))
-    playlist.add(item.getPath(), item)
+    # Queuing the next track is done by the service once playback
+    # actually started
+    aa.backend.flush()
+    xbmcplugin.setResolvedUrl(get_handle(), True, item)
 
 
 @MPR.s_url('/refresh/')
@@ -699,28 +700,50 @@ def update_networks(network=None):
     quality_id = utils.get_quality_id(TEST_LOGIN_NETWORK)
     utils.logd('Got quality-id:', quality_id)
 
-    for i, network in enumerate(networks):
+    def update(network):
         utils.logd('Updating network', network)
         aa = addict.AudioAddict.get(PROFILE_DIR, network)
 
-        progress = i * 100 // len(networks)
-        diag.update(progress, utils.translate(30313).format(aa.name))
-
         aa.get_channels(refresh=True)
         aa.get_favorite_channels(refresh=True)
+        aa.update_snapshot()
 
         if aa.is_premium:
-            utils.logd('Setting preferred quality')
+            utils.logd('Setting preferred quality for', network)
             aa.preferred_quality(quality_id)
 
+        return aa.refresh_stats
+
+    def progress(network, done, total):
+        diag.update(done * 100 // total, utils.translate(30313).format(
+            addict.NETWORKS[network]['name']))
+
+    results, errors = addict.map_networks(update, networks, progress)
+    for network, error in errors.items():
+        utils.logw('Updating {} failed: {}'.format(network, error))
+
     diag.update(100, utils.translate(30314))
     diag.close()
 
+    refresh_stats = collections.Counter()
+    for network_stats in results.values():
+        refresh_stats.update(network_stats)
+
+    utils.logd('Refreshed, not modified: {}, downloaded: {}'.format(
+        refresh_stats['not_modified'], refresh_stats['downloaded']))
+    utils.logd('Connection pool:', addict.get_pool_stats())
+
+
+def logout_networks():
+    _, errors = addict.map_networks(
+        lambda n: addict.AudioAddict.get(PROFILE_DIR, n).logout())
+    for network, error in errors.items():
+        utils.logw('Logging out of {} failed: {}'.format(network, error))
+
 
 @MPR.s_url('/setup/', type_cast={'notice': bool, 'update_cache': bool})
 def setup(notice=True, update_cache=False):
-    for network in addict.NETWORKS.keys():
-        addict.AudioAddict.get(PROFILE_DIR, network).logout()
+    logout_networks()
 
     aa = addict.AudioAddict.get(PROFILE_DIR, TEST_LOGIN_NETWORK)
 
@@ -763,34 +786,148 @@ def setup(notice=True, update_cache=False):
 
 @MPR.s_url('/logout/')
 def logout():
-    for network in addict.NETWORKS.keys():
-        addict.AudioAddict.get(PROFILE_DIR, network).logout()
+    logout_networks()
 
     utils.clear_cache()
 
     ADDON.setSetting('aa.email', '')
     utils.notify(utils.translate(30306))
-    sys.exit(0)
 
 
 @MPR.s_url('/clear_cache/')
 def clear_cache():
     utils.clear_cache()
     utils.notify(utils.translate(30315))
-    sys.exit(0)
+
+
+@MPR.s_url('/stats/')
+def list_stats():
+    aa = addict.AudioAddict.get(PROFILE_DIR, TEST_LOGIN_NETWORK)
+    xbmcplugin.setPluginCategory(get_handle(), utils.translate(30343))
+
+    def fmt_ms(val):
+        return '-' if val is None else '{:.0f}ms'.format(val)
+
+    items = []
+    for endpoint in aa.stats.summary():
+        hit_ratio = endpoint['hit_ratio']
+        label = '[B]{}[/B] - {} {}, {} {}, p50 {}, p95 {}, p99 {}'.format(
+            endpoint['endpoint'], endpoint['calls'], utils.translate(30344),
+            '-' if hit_ratio is None else '{:.0%}'.format(hit_ratio),
+            utils.translate(30345), fmt_ms(endpoint['p50']),
+            fmt_ms(endpoint['p95']), fmt_ms(endpoint['p99']))
+
+        if endpoint['errors']:
+            label += ' [COLOR red]{} {}[/COLOR]'.format(
+                endpoint['errors'], utils.translate(30346))
+
+        items.append((None, xbmcgui.ListItem(label), False))
+
+    slowest = aa.stats.slowest()
+    if slowest:
+        items.append((None,
+                      xbmcgui.ListItem('[B]{}[/B]'.format(
+                          utils.translate(30347))), False))
+
+    for call in slowest:
+        label = '{} - {} ({}) {}'.format(
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(call['time'])),
+            call['endpoint'], call['network'], fmt_ms(call['latency']))
+        if call['error'] or call['status']:
+            label += ' [{}]'.format(call['error'] or call['status'])
+
+        items.append((None, xbmcgui.ListItem(label), False))
+
+    utils.list_items(items, [xbmcplugin.SORT_METHOD_UNSORTED])
+
+
+@MPR.s_url('/jobs/')
+def list_jobs():
+    backend = addict.AudioAddict.get(PROFILE_DIR, TEST_LOGIN_NETWORK).backend
+    xbmcplugin.setPluginCategory(get_handle(), utils.translate(30348))
+
+    def fmt_time(val):
+        return '-' if val is None else time.strftime('%H:%M:%S',
+                                                     time.localtime(val))
+
+    items = []
+    for job in jobs.load_state(backend):
+        label = '[B]{}[/B] - {} {}, {} {}, {} {}'.format(
+            job['name'], job['runs'], utils.translate(30349),
+            utils.translate(30350), fmt_time(job['last_run']),
+            utils.translate(30351), fmt_time(job['next_run']))
+
+        if job['last_duration'] is not None:
+            label += ' ({:.0f}ms)'.format(job['last_duration'] * 1000)
+        if job['running']:
+            label += ' [{}]'.format(utils.translate(30352))
+        elif job.get('paused'):
+            label += ' [{}]'.format(utils.translate(30354))
+        if job['deferrals']:
+            label += ', {} {}'.format(job['deferrals'],
+                                      utils.translate(30353))
+        if job['last_error']:
+            label += ' [COLOR red]{} {}: {}[/COLOR]'.format(
+                job['failures'], utils.translate(30346), job['last_error'])
+
+        items.append((None, xbmcgui.ListItem(label), False))
+
+    utils.list_items(items, [xbmcplugin.SORT_METHOD_UNSORTED])
+
+
+def flush_cache(backend):
+    stats.ApiStats.get(backend).flush()
+    backend.flush()
+    utils.logd('Cache writes: {}, physical: {}, saved: {}'.format(
+        backend.writes, backend.physical_writes, backend.writes_saved))
+
+
+def is_logged_in():
+    # The marker is missing for sessions created before it was introduced
+    if addict.has_session(PROFILE_DIR):
+        return True
+
+    aa = addict.AudioAddict.get(PROFILE_DIR, TEST_LOGIN_NETWORK)
+    aa.update_session_marker()
+    return aa.is_active
 
 
 def run():
     url = sys.argv[0] + sys.argv[2]
-    utils.logd(HANDLE, url)
+    utils.logd(get_handle(), url)
 
-    aa = addict.AudioAddict.get(PROFILE_DIR, TEST_LOGIN_NETWORK)
+    # All networks share the same backend. Writes are coalesced and flushed
+    # once at the end of this invocation.
+    cache.CacheBackend.write_behind = True
+    stats.ApiStats.enabled = ADDON.getSettingBool('addon.stats')
+
+    # With `reuselanguageinvoker` modules, backends and instances survive
+    # from previous invocations while the service kept writing to the cache
+    for backend in cache.CacheBackend.instances():
+        backend.revalidate()
+        backend.reset_counters()
+    for aa in addict.AudioAddict.instances():
+        aa.reset_state()
+
+    # Reads are answered by the service if it's running
+    addict.AudioAddict.rpc_client = rpc.Client.connect(PROFILE_DIR)
+
+    try:
+        url_parsed = utils.parse_url(url)
+        path_ = next(iter(url_parsed.path), '')
+
+        if path_ not in NO_LOGIN_ROUTES and not is_logged_in():
+            if not setup(True, True):
+                return
+
+        MPR.call(url)
 
-    url_parsed = utils.parse_url(url)
-    path_ = next(iter(url_parsed.path), '')
+        if any(aa.served_stale for aa in addict.AudioAddict.instances()):
+            utils.notify(utils.translate(30342))
 
-    if not aa.is_active and path_ not in ['setup', 'logout', 'clear_cache']:
-        if not setup(True, True):
-            sys.exit(0)
+    finally:
+        addict.wait_for_revalidations()
 
-    MPR.call(url)
+        # Routes not touching the cache never open it
+        for backend in cache.CacheBackend.instances():
+            flush_cache(backend)
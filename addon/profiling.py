@@ -0,0 +1,162 @@
+import os
+import sys
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import xbmc
+import xbmcaddon
+import xbmcvfs
+
+# Kept light on purpose: it's imported before anything else so the import
+# time of the addon itself can be profiled. The profiling modules are only
+# imported once a profile is taken.
+
+ADDON = xbmcaddon.Addon()
+PROFILE_DIR = xbmcvfs.translatePath(os.path.join(
+    ADDON.getAddonInfo('profile')))
+PROFILES_DIR = os.path.join(PROFILE_DIR, 'profiles')
+
+# Query parameter enabling profiling for a single plugin invocation
+URL_FLAG = '_profile'
+
+# Only the most recent profiles are kept
+MAX_PROFILES = 40
+
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+
+def is_enabled():
+    return ADDON.getSettingBool('addon.profile')
+
+
+def pop_url_flag(argv):
+    '''Removes `URL_FLAG` from the query string in ``argv`` (``sys.argv`` of
+    a plugin invocation) and returns whether it was set.'''
+    if len(argv) < 3:
+        return False
+
+    query = parse_qsl(argv[2].lstrip('?'), keep_blank_values=True)
+    flag = [v for k, v in query if k == URL_FLAG]
+    if not flag:
+        return False
+
+    query = urlencode([(k, v) for k, v in query if k != URL_FLAG])
+    argv[2] = '?' + query if query else ''
+    return flag[-1].lower() not in ('0', 'false')
+
+
+def route_name(url):
+    '''``plugin://<id>/channels/difm/default/`` -> ``channels_difm_default``
+    '''
+    path = urlparse(url).path.strip('/')
+    name = ''.join(c if c.isalnum() else '_' for c in path)
+    return name or 'root'
+
+
+class Profiler:
+    '''Collects a cProfile profile and tracemalloc allocations between
+    `start` and `stop` and writes them to `PROFILES_DIR`:
+
+    * ``<timestamp>_<name>.prof``: the pstats dump (e.g. for snakeviz)
+    * ``<timestamp>_<name>.txt``: timings, top functions and allocation
+      sites
+    '''
+    def __init__(self, name):
+        import cProfile
+
+        self.name = name
+        self._profile = cProfile.Profile()
+        self._marks = []
+        self._started = None
+        self._stamp = None
+
+    def start(self):
+        import tracemalloc
+
+        self._stamp = time.strftime('%Y%m%d-%H%M%S')
+        tracemalloc.start()
+        self._started = time.perf_counter()
+        self._profile.enable()
+
+    def mark(self, label):
+        '''Records the time passed since `start` (e.g. ``import``).'''
+        self._marks.append((label, time.perf_counter() - self._started))
+
+    def stop(self):
+        import io
+        import pstats
+        import tracemalloc
+
+        self._profile.disable()
+        elapsed = time.perf_counter() - self._started
+
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        if not os.path.exists(PROFILES_DIR):
+            os.makedirs(PROFILES_DIR)
+
+        path = os.path.join(PROFILES_DIR, '{}_{}'.format(
+            self._stamp, self.name))
+        self._profile.dump_stats(path + '.prof')
+
+        with open(path + '.txt', 'w') as f:
+            f.write('{}\n'.format(self.name))
+            f.write('argv: {}\n'.format(sys.argv))
+            f.write('total: {:.3f}s\n'.format(elapsed))
+            for label, at in self._marks:
+                f.write('{}: {:.3f}s\n'.format(label, at))
+            f.write('peak memory: {:.1f} KiB\n\n'.format(peak / 1024))
+
+            stats = io.StringIO()
+            pstats.Stats(self._profile, stream=stats).sort_stats(
+                'cumulative').print_stats(TOP_FUNCTIONS)
+            f.write(stats.getvalue())
+
+            f.write('\nTop allocation sites:\n')
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            for stat in snapshot.filter_traces(filters).statistics(
+                    'lineno')[:TOP_ALLOCATIONS]:
+                f.write('{}\n'.format(stat))
+
+        xbmc.log('[{}] Profile written to: {}.txt'.format(
+            ADDON.getAddonInfo('id'), path), xbmc.LOGINFO)
+        prune()
+
+
+def prune():
+    try:
+        names = sorted(os.listdir(PROFILES_DIR))
+    except OSError:
+        return
+
+    # Names start with a timestamp, so sorting them sorts by age
+    profiles = sorted({os.path.splitext(n)[0] for n in names})
+    for base in profiles[:-MAX_PROFILES]:
+        for ext in ('.prof', '.txt'):
+            try:
+                os.remove(os.path.join(PROFILES_DIR, base + ext))
+            except OSError:
+                pass
+
+
+@contextmanager
+def profile(name, enabled=True):
+    '''Profiles the wrapped block if ``enabled``.
+
+    Yields the `Profiler` (or `None` if disabled) so the block can `mark`
+    intermediate timings.
+    '''
+    if not enabled:
+        yield None
+        return
+
+    profiler = Profiler(name)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
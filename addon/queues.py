@@ -0,0 +1,81 @@
+import time
+
+
+class QueueStore:
+    '''Playback queues (e.g. a channel's routine or a playlist's tracks)
+    keyed by network, kind and id.
+
+    The tracks of a queue are only written when the queue is (re)filled,
+    playing a track just advances a separate cursor entry.
+    Only the ``max_queues`` most recently used queues are kept.
+
+    Plugin invocations and the service update queues concurrently, every
+    operation holds the backend's lock between processes. Sequences like
+    "get, then advance" have to be wrapped in `locked` themselves.
+    '''
+    NAMESPACE = 'queues'
+
+    def __init__(self, backend, max_queues=10):
+        self._backend = backend
+        self._max_queues = max_queues
+
+    @staticmethod
+    def _key(network, kind, id_):
+        return '{}_{}_{}'.format(network, kind, id_)
+
+    def locked(self, exclusive=True):
+        return self._backend.locked(exclusive)
+
+    def get(self, network, kind, id_, reload=False):
+        '''Returns the remaining tracks of a queue or `None` if the queue is
+        unknown or expired.
+
+        Set ``reload`` to pick up changes made by other processes.
+        '''
+        read = self._backend.reload if reload else self._backend.get_entry
+        key = self._key(network, kind, id_)
+
+        # Tracks and cursor have to be read from the same state
+        with self.locked(exclusive=False):
+            entry = read(self.NAMESPACE, key)
+            expires_on = entry.get('expires_on')
+            if not entry or (expires_on and expires_on < time.time()):
+                return None
+
+            cursor = read(self.NAMESPACE, key + '_cursor').get('data') or 0
+            return (entry.get('data') or [])[cursor:]
+
+    def put(self, network, kind, id_, tracks, expires_on=None):
+        key = self._key(network, kind, id_)
+
+        with self.locked():
+            self._backend.set_entry(self.NAMESPACE, key, tracks,
+                                    expires_on or 0)
+            self._backend.set_entry(self.NAMESPACE, key + '_cursor', 0)
+            self._touch(key)
+
+    def advance(self, network, kind, id_):
+        key = self._key(network, kind, id_)
+
+        with self.locked():
+            cursor = self._backend.get_entry(self.NAMESPACE,
+                                             key + '_cursor').get('data') or 0
+            self._backend.set_entry(self.NAMESPACE, key + '_cursor',
+                                    cursor + 1)
+            self._touch(key)
+
+    def clear(self):
+        self._backend.clear(self.NAMESPACE)
+
+    def _touch(self, key):
+        lru = self._backend.get_entry(self.NAMESPACE, 'lru').get('data') or []
+        if lru[:1] == [key]:
+            return
+
+        lru = [key] + [k for k in lru if k != key]
+        for evicted in lru[self._max_queues:]:
+            self._backend.delete(self.NAMESPACE, key=evicted)
+            self._backend.delete(self.NAMESPACE, key=evicted + '_cursor')
+
+        self._backend.set_entry(self.NAMESPACE, 'lru',
+                                lru[:self._max_queues])
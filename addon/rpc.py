@@ -0,0 +1,213 @@
+import json
+import os
+import socket
+import threading
+
+# Describes how to reach the running daemon, only readable by the user
+ADDRESS_FILE = 'service.addr'
+SOCKET_NAME = 'service.sock'
+
+# Connecting to a daemon which is not running fails right away, a daemon
+# which doesn't accept connections anymore must not stall the plugin.
+CONNECT_TIMEOUT = 0.5
+
+# The daemon might have to fetch from the API first
+READ_TIMEOUT = 60
+
+
+class RPCError(Exception):
+    pass
+
+
+class Client:
+    '''Calls `addict.remote` methods of the `AudioAddict` instances living in
+    the service process.
+
+    Every call uses its own connection, failures raise `RPCError` so callers
+    can fall back to calling the method directly.
+    '''
+    def __init__(self, family, address, token):
+        self._family = family
+        self._address = address
+        self._token = token
+
+    @classmethod
+    def connect(cls, cache_dir):
+        '''Returns a client if the daemon is running, `None` otherwise.'''
+        try:
+            with open(os.path.join(cache_dir, ADDRESS_FILE), 'r') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if info.get('family') == 'unix':
+            family, address = socket.AF_UNIX, info['address']
+        else:
+            family, address = socket.AF_INET, tuple(info['address'])
+
+        return cls(family, address, info.get('token'))
+
+    def call(self, network, method, *args, **kwargs):
+        '''Returns a ``(result, served_stale)`` tuple.'''
+        request = json.dumps({
+            'token': self._token,
+            'network': network,
+            'method': method,
+            'args': args,
+            'kwargs': kwargs,
+        }).encode('utf-8') + b'\n'
+
+        try:
+            with socket.socket(self._family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(CONNECT_TIMEOUT)
+                sock.connect(self._address)
+
+                sock.settimeout(READ_TIMEOUT)
+                sock.sendall(request)
+                with sock.makefile('rb') as f:
+                    response = json.loads(f.readline())
+
+        except (OSError, ValueError) as e:
+            raise RPCError(e)
+
+        if 'error' in response:
+            raise RPCError(response['error'])
+        return response['result'], response.get('served_stale', False)
+
+
+def _server_classes():
+    '''Returns the ``(handler, unix server, tcp server)`` classes.
+
+    Created on first use so plugin invocations, which only need the
+    `Client`, don't import `socketserver`.
+    '''
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline())
+                response = self.server.daemon.dispatch(request)
+            except Exception as e:
+                response = {'error': repr(e)}
+
+            try:
+                self.wfile.write(
+                    json.dumps(response).encode('utf-8') + b'\n')
+            except OSError:
+                # The client gave up waiting
+                pass
+
+    class UnixServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    return Handler, UnixServer, TCPServer
+
+
+class Daemon:
+    '''Serves the `addict.remote` methods of `AudioAddict` to plugin
+    invocations from the service, so they share its warm in-memory cache and
+    pooled connections.
+
+    Listens on a unix domain socket in ``cache_dir`` or, where those are not
+    available, on a loopback port. Requests have to carry the token from the
+    address file.
+    '''
+    def __init__(self, cache_dir):
+        import secrets
+
+        self._cache_dir = cache_dir
+        self._token = secrets.token_hex(16)
+        self._instances = {}
+        self._instances_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def _instance(self, network):
+        from addon import addict
+
+        with self._instances_lock:
+            if network not in self._instances:
+                # Not the service's own instances: a plugin is waiting for
+                # the result
+                aa = addict.AudioAddict(self._cache_dir, network)
+                aa.call_class = 'interactive'
+                aa.rpc_client = None
+                self._instances[network] = (aa, threading.Lock())
+            return self._instances[network]
+
+    def dispatch(self, request):
+        from addon import addict, cache
+
+        if request.get('token') != self._token:
+            return {'error': 'Invalid token'}
+
+        network = request.get('network')
+        if network not in addict.NETWORKS:
+            return {'error': 'Unknown network: {}'.format(network)}
+
+        aa, lock = self._instance(network)
+        method = getattr(aa, request.get('method', ''), None)
+        if not getattr(method, 'remote', False):
+            return {'error': 'Not a remote method: {}'.format(
+                request.get('method'))}
+
+        # The plugin might have written to the cache since the last request
+        for backend in cache.CacheBackend.instances():
+            backend.revalidate()
+
+        # Calls are serialized per network to tell whether stale data was
+        # served
+        with lock:
+            aa.reset_state()
+            result = method(*request.get('args', []),
+                            **request.get('kwargs', {}))
+            return {'result': result, 'served_stale': aa.served_stale}
+
+    def start(self):
+        address_file = os.path.join(self._cache_dir, ADDRESS_FILE)
+        handler, unix_server, tcp_server = _server_classes()
+
+        if hasattr(socket, 'AF_UNIX'):
+            path = os.path.join(self._cache_dir, SOCKET_NAME)
+            if os.path.exists(path):
+                os.remove(path)
+
+            self._server = unix_server(path, handler)
+            info = {'family': 'unix', 'address': path}
+        else:
+            self._server = tcp_server(('127.0.0.1', 0), handler)
+            info = {'family': 'tcp', 'address': self._server.server_address}
+
+        self._server.daemon = self
+        info['token'] = self._token
+
+        fd = os.open(address_file + '.tmp',
+                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(info, f)
+        os.replace(address_file + '.tmp', address_file)
+
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if not self._server:
+            return
+
+        for name in (ADDRESS_FILE, SOCKET_NAME):
+            try:
+                os.remove(os.path.join(self._cache_dir, name))
+            except OSError:
+                pass
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
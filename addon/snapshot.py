@@ -0,0 +1,188 @@
+'''Read-only catalog snapshots plugin invocations list channels from.
+
+The service compiles one file per network (see
+`AudioAddict.update_snapshot`) holding everything the style and channel
+listings show: the channels with their precomputed art urls and favorite
+flag and the channels of every style. Listings map the file and only
+decode the rows they show, without opening (and parsing) the cache.
+
+Layout (little endian)::
+
+    header   magic, version, valid until, sources, row and style counts
+    rows     row_count + 1 offsets into the strings
+    styles   style_count + 1 offsets into the strings
+    members  style_count + 1 offsets into the member ids
+    ids      row index of every style member
+    strings  rows (`Row`) and styles (key, name) joined by `SEPARATOR`
+
+Snapshots are replaced atomically, processes which mapped the previous one
+keep reading it.
+'''
+import collections
+import mmap
+import os
+import struct
+import time
+
+FILE_NAME = 'catalog-{}.snapshot'
+
+MAGIC = b'AACS'
+VERSION = 1
+
+# Key of the style listing the favorite channels
+FAVORITES = 'favorites'
+
+SEPARATOR = '\x1f'
+
+HEADER = struct.Struct('<4sHxxdqqII')
+OFFSET = struct.Struct('<I')
+
+Row = collections.namedtuple('Row', 'key name thumb fanart favorite')
+
+
+def path(cache_dir, network):
+    return os.path.join(cache_dir, FILE_NAME.format(network))
+
+
+def remove(cache_dir, network):
+    try:
+        os.remove(path(cache_dir, network))
+    except OSError:
+        pass
+
+
+def _offsets(chunks):
+    offsets = [0]
+    for chunk in chunks:
+        offsets.append(offsets[-1] + len(chunk))
+    return offsets
+
+
+def _pack(values):
+    return struct.pack('<{}I'.format(len(values)), *values)
+
+
+def write(path_, rows, styles, valid_until, sources):
+    '''Replaces the snapshot at ``path_``.
+
+    ``rows`` are `Row` tuples, ``styles`` ``(key, name, row indexes)``
+    tuples. The snapshot is used until ``valid_until``, ``sources`` are the
+    versions (``expires_on``) of the ``channel_filters`` and ``favorites``
+    cache entries it was compiled from.
+    '''
+    def encode(*fields):
+        return SEPARATOR.join(f or '' for f in fields).encode('utf-8')
+
+    row_data = [
+        encode(r.key, r.name, r.thumb, r.fanart, '1' if r.favorite else '')
+        for r in rows
+    ]
+    style_data = [encode(key, name) for key, name, _ in styles]
+
+    row_offsets = _offsets(row_data)
+    style_offsets = [o + row_offsets[-1] for o in _offsets(style_data)]
+    member_offsets = _offsets([ids for _, _, ids in styles])
+    ids = [i for _, _, style_ids in styles for i in style_ids]
+
+    data = b''.join([
+        HEADER.pack(MAGIC, VERSION, valid_until, sources[0], sources[1],
+                    len(rows), len(styles)),
+        _pack(row_offsets),
+        _pack(style_offsets),
+        _pack(member_offsets),
+        _pack(ids),
+    ] + row_data + style_data)
+
+    # Readers must never see a partially written snapshot
+    with open(path_ + '.tmp', 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path_ + '.tmp', path_)
+
+
+class Snapshot:
+    def __init__(self, path_):
+        with open(path_, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            (magic, version, self.valid_until, filters, favorites,
+             self._row_count,
+             self._style_count) = HEADER.unpack_from(self._map)
+        except struct.error:
+            self.close()
+            raise ValueError('Truncated snapshot')
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('Unsupported snapshot')
+
+        self.sources = (filters, favorites)
+
+        self._rows = HEADER.size
+        self._styles = self._rows + (self._row_count + 1) * OFFSET.size
+        self._members = self._styles + (self._style_count + 1) * OFFSET.size
+        self._ids = self._members + (self._style_count + 1) * OFFSET.size
+        self._strings = self._ids + self._offset(self._members,
+                                                 self._style_count) * 4
+
+    @classmethod
+    def open(cls, cache_dir, network, expired=False):
+        '''Returns the network's snapshot, None if there is none (or it
+        expired, unless ``expired``).'''
+        try:
+            snapshot = cls(path(cache_dir, network))
+        except (OSError, ValueError):
+            return None
+
+        if not expired and snapshot.valid_until < time.time():
+            snapshot.close()
+            return None
+        return snapshot
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _offset(self, table, index):
+        return OFFSET.unpack_from(self._map, table + index * OFFSET.size)[0]
+
+    def _string(self, table, index):
+        start = self._strings + self._offset(table, index)
+        end = self._strings + self._offset(table, index + 1)
+        return self._map[start:end].decode('utf-8').split(SEPARATOR)
+
+    def _row(self, index):
+        key, name, thumb, fanart, favorite = self._string(self._rows, index)
+        return Row(key, name, thumb or None, fanart or None, bool(favorite))
+
+    def styles(self):
+        '''``(key, name, channel count)`` of every style.'''
+        styles = []
+        for i in range(self._style_count):
+            key, name = self._string(self._styles, i)
+            count = (self._offset(self._members, i + 1) -
+                     self._offset(self._members, i))
+            styles.append((key, name, count))
+        return styles
+
+    def channels(self, style):
+        '''`Row` of every channel of a style, None if there is no such
+        style.'''
+        for i in range(self._style_count):
+            if self._string(self._styles, i)[0] != style:
+                continue
+
+            start = self._offset(self._members, i)
+            count = self._offset(self._members, i + 1) - start
+            ids = struct.unpack_from('<{}I'.format(count), self._map,
+                                     self._ids + start * 4)
+            return [self._row(r) for r in ids]
+
+        return None
@@ -0,0 +1,294 @@
+import threading
+import time
+
+NAMESPACE = 'stats'
+
+# Upper bounds (in ms) of the latency histogram buckets
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf'))
+
+# Histograms are kept per window of this many seconds and dropped once
+# older than `WINDOWS` windows
+WINDOW = 60 * 60
+WINDOWS = 24
+
+# Number of slowest calls kept
+SLOWEST = 20
+
+# Path elements following these are ids, slugs or keys
+TEMPLATE_AFTER = {
+    'channel', 'member_sessions', 'members', 'playlists', 'show', 'shows',
+    'tracks'
+}
+
+_timing = threading.local()
+_pool_classes = None
+
+
+def _timed(connection_cls):
+    class TimedConnection(connection_cls):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                super().connect()
+            finally:
+                _timing.connect = (getattr(_timing, 'connect', 0) +
+                                   time.perf_counter() - start)
+
+    return TimedConnection
+
+
+def pool_classes():
+    '''urllib3 connection pool classes (by scheme) whose connections time
+    connecting.
+
+    Created on first use so importing this module doesn't import urllib3.
+    '''
+    global _pool_classes
+    if _pool_classes is None:
+        from urllib3.connection import HTTPConnection, HTTPSConnection
+        from urllib3.connectionpool import (HTTPConnectionPool,
+                                            HTTPSConnectionPool)
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = _timed(HTTPConnection)
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = _timed(HTTPSConnection)
+
+        _pool_classes = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+    return _pool_classes
+
+
+def reset_connect_time():
+    _timing.connect = 0
+
+
+def connect_time():
+    '''Seconds the current thread spent on DNS lookups, connecting and TLS
+    handshakes since the last `reset_connect_time`.'''
+    return getattr(_timing, 'connect', 0)
+
+
+def endpoint_template(paths):
+    '''``['members', '123', 'favorites']`` -> ``'members/{}/favorites'``'''
+    template = []
+    for i, path in enumerate(paths):
+        if i > 0 and paths[i - 1] in TEMPLATE_AFTER:
+            path = '{}'
+        template.append(path)
+    return '/'.join(template)
+
+
+def percentile(histogram, pct):
+    '''Approximates a percentile (in ms) from histogram bucket counts.'''
+    total = sum(histogram)
+    if not total:
+        return None
+
+    rank = total * pct / 100
+    seen = 0
+    for i, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            lower = BUCKETS[i - 1] if i > 0 else 0
+            upper = BUCKETS[i]
+            if upper == float('inf'):
+                return lower
+            return lower + (upper - lower) * (1 - (seen - rank) / count)
+    return BUCKETS[-2]
+
+
+def _new_aggregate():
+    return {
+        'calls': 0,
+        'hit': 0,
+        'stale': 0,
+        'miss': 0,
+        'bypass': 0,
+        'errors': 0,
+        'bytes': 0,
+        'connects': 0,
+        'connect_ms': 0,
+        'decode_ms': 0,
+        'latency': [0] * len(BUCKETS),
+        'status': {},
+    }
+
+
+def _merge(target, source):
+    for key, val in source.items():
+        if key == 'latency':
+            target[key] = [a + b for a, b in zip(target[key], val)]
+        elif key == 'status':
+            for status, count in val.items():
+                target[key][status] = target[key].get(status, 0) + count
+        else:
+            target[key] += val
+
+
+class ApiStats:
+    '''Aggregates the events of `AudioAddict._api_call` into rolling
+    per-endpoint histograms which are persisted in the cache backend.
+
+    Events are collected in memory and merged with the persisted state on
+    `flush` (holding the backend's lock), so concurrent processes (plugin
+    and service) don't overwrite each other's numbers.
+
+    Events are only recorded while `enabled` (``addon.stats``). Calls
+    answered from the cache are kept in memory until a request was sent
+    (or the flush is forced), so invocations served from the cache alone
+    don't write.
+    '''
+    __instances = {}
+    __instances_lock = threading.Lock()
+
+    enabled = False
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._slowest = []
+        self._requests = 0
+
+    @classmethod
+    def get(cls, backend):
+        with cls.__instances_lock:
+            if backend not in cls.__instances:
+                cls.__instances[backend] = cls(backend)
+            return cls.__instances[backend]
+
+    def record(self, endpoint, network, cache, status=None, size=0,
+               latency=None, connect=0, decode=0, error=None):
+        '''Records a single api request.
+
+        ``cache`` is ``hit``, ``stale`` (served from the cache), ``miss``
+        (cacheable) or ``bypass`` (not cacheable). ``latency``, ``connect``
+        and ``decode`` are in seconds, requests served from the cache have
+        none.
+        '''
+        if not self.enabled:
+            return
+
+        window = str(int(time.time() // WINDOW * WINDOW))
+
+        with self._lock:
+            agg = self._pending.setdefault(window, {}).setdefault(
+                endpoint, _new_aggregate())
+
+            agg['calls'] += 1
+            agg[cache] += 1
+            agg['bytes'] += size
+            agg['decode_ms'] += decode * 1000
+
+            if error:
+                agg['errors'] += 1
+
+            if status:
+                agg['status'][str(status)] = agg['status'].get(
+                    str(status), 0) + 1
+
+            if connect:
+                agg['connects'] += 1
+                agg['connect_ms'] += connect * 1000
+
+            if latency is None:
+                return
+
+            self._requests += 1
+            latency *= 1000
+            for i, bound in enumerate(BUCKETS):
+                if latency <= bound:
+                    agg['latency'][i] += 1
+                    break
+
+            self._slowest.append({
+                'endpoint': endpoint,
+                'network': network,
+                'latency': latency,
+                'status': status,
+                'error': error,
+                'time': int(time.time()),
+            })
+
+    @property
+    def pending(self):
+        '''Whether there are samples not flushed yet.'''
+        return bool(self._pending or self._slowest)
+
+    def flush(self, force=False):
+        '''Writes the pending samples, unless all of them were served from
+        the cache and the flush isn't forced.'''
+        with self._lock:
+            if not self._requests and not force:
+                return
+            pending, self._pending = self._pending, {}
+            slowest, self._slowest = self._slowest, []
+            self._requests = 0
+
+        if not pending and not slowest:
+            return
+
+        oldest = time.time() - WINDOW * WINDOWS
+
+        with self._backend.locked(exclusive=True):
+            windows = self._backend.reload(NAMESPACE,
+                                           'windows').get('data') or {}
+            for window, endpoints in pending.items():
+                target = windows.setdefault(window, {})
+                for endpoint, agg in endpoints.items():
+                    _merge(target.setdefault(endpoint, _new_aggregate()),
+                           agg)
+
+            windows = {w: e for w, e in windows.items() if int(w) >= oldest}
+            self._backend.set_entry(NAMESPACE, 'windows', windows)
+
+            slowest += self._backend.reload(NAMESPACE,
+                                            'slowest').get('data') or []
+            slowest = [s for s in slowest if s['time'] >= oldest]
+            slowest = sorted(slowest, key=lambda s: s['latency'],
+                             reverse=True)[:SLOWEST]
+            self._backend.set_entry(NAMESPACE, 'slowest', slowest)
+
+    def summary(self):
+        '''Per-endpoint totals over all kept windows, sorted by endpoint.
+
+        Every item has the summed counters plus ``hit_ratio`` (calls served
+        from the cache, stale or not) and the ``p50``, ``p95`` and ``p99``
+        latencies in ms.
+        '''
+        self.flush(force=True)
+
+        endpoints = {}
+        windows = self._backend.get_entry(NAMESPACE, 'windows').get('data')
+        for window in (windows or {}).values():
+            for endpoint, agg in window.items():
+                _merge(endpoints.setdefault(endpoint, _new_aggregate()), agg)
+
+        summary = []
+        for endpoint, agg in sorted(endpoints.items()):
+            summary.append(dict(
+                agg,
+                endpoint=endpoint,
+                hit_ratio=((agg['hit'] + agg['stale']) / agg['calls']
+                           if agg['calls'] else None),
+                p50=percentile(agg['latency'], 50),
+                p95=percentile(agg['latency'], 95),
+                p99=percentile(agg['latency'], 99),
+            ))
+        return summary
+
+    def slowest(self):
+        self.flush(force=True)
+        return self._backend.get_entry(NAMESPACE, 'slowest').get('data') or []
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+            self._slowest = []
+            self._requests = 0
+        self._backend.clear(NAMESPACE)
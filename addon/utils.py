@@ -7,7 +7,7 @@ import xbmcaddon
 import xbmcgui
 import xbmcplugin
 import xbmcvfs
-from addon import HANDLE, addict
+from addon import addict, get_handle
 
 DEFAULT_LOG_LEVEL = xbmc.LOGINFO
 
@@ -59,29 +59,6 @@ def busy_dialog():
         xbmc.executebuiltin('Dialog.Close(busydialognocancel)')
 
 
-def seek_offset(offset, timeout=5, interval=0.1):
-    player = xbmc.Player()
-    monitor = xbmc.Monitor()
-
-    waited = 0
-    while not monitor.abortRequested():
-        if player.isPlayingAudio():
-            # Initially we get times from the previous playback or something
-            if player.getTime() > 0 and player.getTime() < 1:
-                break
-
-        if monitor.waitForAbort(interval):
-            return False
-
-        if waited >= timeout:
-            return False
-
-        waited += interval
-
-    player.seekTime(offset)
-    return True
-
-
 def parse_url(url, base=None):
     url = urlparse(url)
 
@@ -124,6 +101,7 @@ def get_playing():
         'channel': channel,
         'track_id': track_id,
         'playlist_id': playlist_id,
+        'playlist_name': url.query.get('playlist_name', ''),
         'is_live': url.query.get('is_live', 'false').lower() == 'true'
     }
 
@@ -157,17 +135,18 @@ def get_quality_id(network):
 
 
 def add_aa_art(item, elem, thumb_key='compact', fanart_key='default'):
-    thumb = elem.get('images', {}).get(thumb_key)
-    fanart = elem.get('images', {}).get(fanart_key, thumb)
+    return set_art(item, *addict.art_urls(elem, thumb_key, fanart_key))
 
+
+def set_art(item, thumb, fanart=None):
     item.setArt({
-        'icon': addict.convert_url(thumb, width=512),
-        'thumb': addict.convert_url(thumb, width=512),
+        'icon': thumb,
+        'thumb': thumb,
     })
 
     art = os.path.join(ADDON_DIR, 'fanart.jpg')
     if ADDON.getSettingBool('view.fanart') and fanart:
-        art = addict.convert_url(fanart, height=720)
+        art = fanart
 
     item.setArt({'fanart': art})
 
@@ -289,13 +268,7 @@ def go_premium():
 
 def clear_cache():
     for network in addict.NETWORKS.keys():
-        aa = addict.AudioAddict.get(PROFILE_DIR, network)
-        if os.path.exists(aa.cache_file):
-            os.remove(aa.cache_file)
-
-    tracks = os.path.join(PROFILE_DIR, 'tracks.json')
-    if os.path.exists(tracks):
-        os.remove(tracks)
+        addict.AudioAddict.get(PROFILE_DIR, network).clear_cache()
 
 
 def list_items(items, sort_methods=None):
@@ -306,7 +279,7 @@ def list_items(items, sort_methods=None):
         ]
 
     for method in sort_methods:
-        xbmcplugin.addSortMethod(HANDLE, method)
+        xbmcplugin.addSortMethod(get_handle(), method)
 
     fanart = os.path.join(ADDON_DIR, 'fanart.jpg')
     for url, item, is_folder in items:
@@ -314,5 +287,5 @@ def list_items(items, sort_methods=None):
             continue
         item.setArt({'fanart': fanart})
 
-    xbmcplugin.addDirectoryItems(HANDLE, items, len(items))
-    xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
+    xbmcplugin.addDirectoryItems(get_handle(), items, len(items))
+    xbmcplugin.endOfDirectory(get_handle(), cacheToDisc=False)
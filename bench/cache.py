@@ -0,0 +1,266 @@
+'''Micro-benchmarks for the cache layer of ``addon.addict``.
+
+Times the cache related operations of `AudioAddict` on synthetic catalogs,
+caches and routines of various sizes and reports per operation:
+
+* mean/p95 time
+* bytes written (``wchar`` of ``/proc/self/io`` where available, growth of
+  the cache dir otherwise)
+* peak memory allocated (tracemalloc)
+
+Every case is measured ``cold`` (fresh backend and instance, i.e. a new
+plugin invocation with a populated cache on disk) and ``warm`` (in-memory
+state kept between calls)::
+
+    python -m bench.cache --channels 50 2000 --keys 10 50000 --save a.json
+    python -m bench.cache --channels 50 2000 --keys 10 50000 --compare a.json
+'''
+import argparse
+import itertools
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.fakeapi import Fixtures
+from bench.run import percentile
+
+NETWORK = 'difm'
+
+# Far enough in the future to never expire during a run
+NEVER = int(time.time()) + 365 * 24 * 60 * 60
+
+
+def bytes_written(cache_dir):
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return sum(
+        os.path.getsize(os.path.join(cache_dir, f))
+        for f in os.listdir(cache_dir))
+
+
+class Case:
+    '''A profile dir populated with ``channels`` channels, ``keys``
+    additional cache keys (half of them expired) and a routine of
+    ``routine`` tracks.'''
+    def __init__(self, channels, keys, routine):
+        from addon.addict import pack_channel_filters
+
+        self.channels = channels
+        self.keys = keys
+        self.routine = routine
+
+        self.fixtures = Fixtures(channels, tracks=routine)
+        self.cache_dir = tempfile.mkdtemp(prefix='aa-bench-cache-')
+        self.channel = self.fixtures.channels[-1]['key']
+
+        aa = self.instance()
+        backend = aa.backend
+
+        backend.set_entry(aa.COMMON, 'user', self.fixtures.session)
+        backend.set_entry(
+            NETWORK, 'channel_filters',
+            pack_channel_filters(self.fixtures.channel_filters()), NEVER)
+        backend.set_entry(NETWORK, 'favorites', self.fixtures.favorites(),
+                          NEVER)
+        self.add_keys(backend)
+        self.put_routine(aa)
+
+    def add_keys(self, backend, expired_only=False):
+        # Accumulated entries like the ones left behind by searching
+        now = int(time.time())
+        for i in range(self.keys):
+            expired = i % 2 == 0
+            if expired_only and not expired:
+                continue
+
+            backend.set_entry(NETWORK, 'search_query{}'.format(i), [{
+                'id': i,
+                'key': 'channel{}'.format(i),
+                'name': 'Channel {}'.format(i),
+            }], now - 60 if expired else NEVER)
+        backend.flush()
+
+    def put_routine(self, aa):
+        aa._put_queue('channel', self.channel,
+                      self.fixtures.tracks(self.fixtures.channels[-1]['id']))
+        aa.backend.flush()
+
+    def instance(self):
+        from addon.addict import AudioAddict
+        from addon.cache import SQLiteBackend
+
+        backend = SQLiteBackend(self.cache_dir)
+        backend.write_behind = True
+        return AudioAddict(self.cache_dir, NETWORK, backend)
+
+    def close(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+# name: (setup, operation), `setup` prepares a case before every sample and
+# is not timed
+def _no_setup(case, aa):
+    pass
+
+
+OPERATIONS = {
+    'read_cache': (
+        _no_setup,
+        lambda case, aa: aa._read_cache(NETWORK, 'channel_filters'),
+    ),
+    'update_cache': (
+        _no_setup,
+        lambda case, aa: aa._update_cache(NETWORK, 'search_bench', [1, 2],
+                                          10),
+    ),
+    'invalidate_cache': (
+        lambda case, aa: case.add_keys(aa.backend, expired_only=True),
+        lambda case, aa: aa.invalidate_cache(),
+    ),
+    'next_channel_track': (
+        lambda case, aa: case.put_routine(aa),
+        lambda case, aa: aa.next_channel_track(case.channel, pop=True,
+                                               live=False),
+    ),
+    'get_channel_id': (
+        _no_setup,
+        lambda case, aa: aa.get_channel_id(case.channel),
+    ),
+    'get_favorite_channels': (
+        _no_setup,
+        lambda case, aa: aa.get_favorite_channels(),
+    ),
+}
+
+
+def measure(case, name, mode, iterations):
+    setup, operation = OPERATIONS[name]
+
+    def call(aa):
+        operation(case, aa)
+        # Writes only hit the disk when an invocation flushes the cache
+        aa.backend.flush()
+
+    aa = case.instance()
+    if mode == 'warm':
+        # Populate the in-memory state before taking samples
+        setup(case, aa)
+        call(aa)
+
+    samples, written = [], []
+    for _ in range(iterations):
+        if mode == 'cold':
+            aa = case.instance()
+        setup(case, aa)
+
+        before = bytes_written(case.cache_dir)
+        start = time.perf_counter()
+        call(aa)
+        samples.append(time.perf_counter() - start)
+        written.append(bytes_written(case.cache_dir) - before)
+
+    # A separate pass as tracing slows down the timed calls considerably
+    if mode == 'cold':
+        aa = case.instance()
+    setup(case, aa)
+    tracemalloc.start()
+    call(aa)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'mean': statistics.mean(samples) * 1000000,
+        'p95': percentile(samples, 95) * 1000000,
+        'bytes': max(0, int(statistics.median(written))),
+        'peak': peak,
+    }
+
+
+def benchmark(args):
+    results = {}
+    for channels, keys, routine in itertools.product(args.channels, args.keys,
+                                                     args.routine):
+        case = Case(channels, keys, routine)
+        try:
+            for name in args.operations:
+                # Routine length only matters for the queue
+                if name != 'next_channel_track' and routine != args.routine[0]:
+                    continue
+
+                for mode in args.modes:
+                    key = '{}:{}:c{}:k{}:r{}'.format(mode, name, channels,
+                                                     keys, routine)
+                    results[key] = measure(case, name, mode, args.iterations)
+        finally:
+            case.close()
+
+    return {
+        'meta': {
+            'iterations': args.iterations,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+
+
+def report(result, baseline=None):
+    base_results = (baseline or {}).get('results', {})
+
+    print('{:<48} {:>10} {:>10} {:>10} {:>10}{}'.format(
+        'case', 'mean us', 'p95 us', 'written', 'peak KiB',
+        '  mean diff' if baseline else ''))
+
+    for key, stats in result['results'].items():
+        line = '{:<48} {:>10.1f} {:>10.1f} {:>10} {:>10.1f}'.format(
+            key, stats['mean'], stats['p95'], stats['bytes'],
+            stats['peak'] / 1024)
+
+        base = base_results.get(key)
+        if base and base['mean']:
+            line += '  {:>+9.1%}'.format(stats['mean'] / base['mean'] - 1)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, nargs='+',
+                        default=[50, 500, 2000])
+    parser.add_argument('--keys', type=int, nargs='+',
+                        default=[10, 1000, 50000])
+    parser.add_argument('--routine', type=int, nargs='+', default=[10, 200],
+                        help='tracks per routine')
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS),
+                        choices=list(OPERATIONS))
+    parser.add_argument('--modes', nargs='+', default=['cold', 'warm'],
+                        choices=['cold', 'warm'])
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--save', help='store the results as json')
+    parser.add_argument('--compare', help='compare against stored results')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    result = benchmark(args)
+    report(result, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+'''Size and read time of the cached channel catalog.
+
+Caches a synthetic ``channel_filters`` response for every network twice,
+as the raw response and normalized by `addict.pack_channel_filters`, and
+reports the bytes stored and the time of a cold ``_read_cache`` (a fresh
+backend, like a new plugin invocation; including the rehydration for the
+normalized payload)::
+
+    python -m bench.catalog
+    python -m bench.catalog --channels 500 --iterations 50
+'''
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from bench.fakeapi import Fixtures
+from bench.run import percentile
+
+# Synthetic catalog sizes, overridden by --channels
+CHANNELS = {
+    'difm': 100,
+    'radiotunes': 80,
+    'jazzradio': 50,
+    'rockradio': 40,
+    'classicalradio': 50,
+    'zenradio': 20,
+}
+
+NEVER = int(time.time()) + 365 * 24 * 60 * 60
+
+
+def stored_bytes(cache_dir, network):
+    import sqlite3
+    from addon.cache import SQLiteBackend
+
+    db = sqlite3.connect(os.path.join(cache_dir, SQLiteBackend.DB_NAME))
+    try:
+        return db.execute(
+            'SELECT length(data) FROM cache '
+            "WHERE namespace = ? AND key = 'channel_filters'",
+            (network, )).fetchone()[0]
+    finally:
+        db.close()
+
+
+def measure(cache_dir, network, unpack, iterations):
+    from addon.addict import AudioAddict
+    from addon.cache import SQLiteBackend
+
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        aa = AudioAddict(cache_dir, network, SQLiteBackend(cache_dir))
+        data = aa._read_cache(network, 'channel_filters').get('data')
+        if unpack:
+            unpack(data)
+        samples.append(time.perf_counter() - start)
+
+    return statistics.median(samples), percentile(samples, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int,
+                        help='channels of every network')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    from addon.addict import pack_channel_filters, unpack_channel_filters
+    from addon.cache import SQLiteBackend
+
+    raw_dir = tempfile.mkdtemp(prefix='aa-bench-catalog-raw-')
+    packed_dir = tempfile.mkdtemp(prefix='aa-bench-catalog-packed-')
+
+    print('{:<16} {:>8} {:>10} {:>10} {:>7} {:>10} {:>10}'.format(
+        'network', 'channels', 'raw B', 'packed B', 'ratio', 'raw ms',
+        'packed ms'))
+
+    try:
+        for seed, (network, channels) in enumerate(CHANNELS.items()):
+            channels = args.channels or channels
+            filters = Fixtures(channels, seed=seed).channel_filters()
+
+            SQLiteBackend(raw_dir).set_entry(network, 'channel_filters',
+                                             filters, NEVER)
+            SQLiteBackend(packed_dir).set_entry(
+                network, 'channel_filters', pack_channel_filters(filters),
+                NEVER)
+
+            raw = stored_bytes(raw_dir, network)
+            packed = stored_bytes(packed_dir, network)
+            raw_ms, _ = measure(raw_dir, network, None, args.iterations)
+            packed_ms, _ = measure(packed_dir, network,
+                                   unpack_channel_filters, args.iterations)
+
+            print('{:<16} {:>8} {:>10} {:>10} {:>7.1%} {:>10.2f} '
+                  '{:>10.2f}'.format(network, channels, raw, packed,
+                                     packed / raw, raw_ms * 1000,
+                                     packed_ms * 1000))
+            sys.stdout.flush()
+    finally:
+        shutil.rmtree(raw_dir, ignore_errors=True)
+        shutil.rmtree(packed_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
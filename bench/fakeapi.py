@@ -0,0 +1,439 @@
+'''Local stand-in for the AudioAddict API.
+
+Serves deterministic, synthetic payloads for every endpoint the addon
+uses with configurable latency, jitter and error injection so route
+timings can be compared between changes without touching the real API.
+
+Run standalone with::
+
+    python -m bench.fakeapi --port 8765 --latency 40 --jitter 20
+'''
+import argparse
+import collections
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+STYLES = [
+    'trance', 'house', 'techno', 'ambient', 'drum-and-bass', 'lounge',
+    'dubstep', 'progressive', 'chillout', 'breaks', 'electro', 'hardcore',
+]
+
+
+def _iso(dt):
+    return dt.replace(microsecond=0).isoformat()
+
+
+class Fixtures:
+    '''Synthetic payloads shaped like the real API responses.'''
+    def __init__(self, channels=100, tracks=10, shows=40, playlists=50,
+                 seed=0):
+        self._rand = random.Random(seed)
+        self._tracks = tracks
+        self._routines = itertools.count()
+
+        self.channels = [self._channel(i) for i in range(1, channels + 1)]
+        self.shows = [self._show(i) for i in range(1, shows + 1)]
+        self.playlists = [self._playlist(i) for i in range(1, playlists + 1)]
+
+        self.session = {
+            'key': 'bench-session',
+            'member_id': 1,
+            'audio_token': 'bench-audio-token',
+            'member': {
+                'active': True,
+                'user_type': 'premium',
+                'api_key': 'bench-api-key',
+                'listen_key': 'bench-listen-key',
+                'email': 'bench@example.com',
+            },
+        }
+
+    def _images(self, kind, id_):
+        url = '//cdn.example.com/{}/{}.png{{?size,height,width}}'.format(
+            kind, id_)
+        return {'default': url, 'compact': url, 'square': url}
+
+    def _channel(self, id_):
+        style = STYLES[id_ % len(STYLES)]
+        return {
+            'id': id_,
+            'key': '{}{}'.format(style.replace('-', ''), id_),
+            'name': '{} {}'.format(style.title(), id_),
+            'description_short': 'Synthetic channel {}'.format(id_),
+            'description_long': 'Synthetic channel {} '.format(id_) * 8,
+            'images': self._images('channels', id_),
+            'similar_channels': [{
+                'id': self._rand.randint(1, 1000),
+                'similar_channel_id': self._rand.randint(1, 1000),
+            } for _ in range(5)],
+            'channel_director': 'Bench',
+            'asset_id': id_,
+            'created_at': '2015-01-01T00:00:00-05:00',
+        }
+
+    def _show(self, id_):
+        channel = self.channels[id_ % len(self.channels)]
+        return {
+            'id': id_,
+            'name': 'Show {}'.format(id_),
+            'slug': 'show-{}'.format(id_),
+            'following': False,
+            'images': self._images('shows', id_),
+            'channels': [{
+                'id': channel['id'],
+                'key': channel['key'],
+                'name': channel['name'],
+            }],
+            'description': 'Synthetic show {}'.format(id_),
+        }
+
+    def _playlist(self, id_):
+        return {
+            'id': id_,
+            'name': 'Playlist {}'.format(id_),
+            'slug': 'playlist-{}'.format(id_),
+            'duration': '{}h {}m'.format(id_ % 4 + 1, id_ % 60),
+            'curator': {'name': 'Curator {}'.format(id_ % 7)},
+            'images': self._images('playlists', id_),
+        }
+
+    def track(self, id_):
+        exp = (datetime.now(timezone.utc) +
+               timedelta(hours=6)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return {
+            'id': id_,
+            'title': 'Track {}'.format(id_),
+            'display_title': 'Track {}'.format(id_),
+            'artist': {'name': 'Artist {}'.format(id_ % 97)},
+            'length': 180 + id_ % 240,
+            'images': self._images('tracks', id_),
+            'content': {
+                'offset': 0,
+                'assets': [{
+                    'url': ('//content.example.com/{}.mp4'
+                            '?exp={}&hash=bench').format(id_, exp),
+                    'size': 4000000,
+                }],
+            },
+        }
+
+    def tracks(self, seed_id):
+        # Every routine gets new track ids so tracks played twice can be
+        # told apart from tracks served twice (see ``bench.stress``)
+        base = (seed_id * 10000 + next(self._routines) % 10000) * 1000
+        return [self.track(base + i) for i in range(self._tracks)]
+
+    def channel_filters(self):
+        filters = [{
+            'id': 0,
+            'key': 'default',
+            'name': 'All',
+            'display': True,
+            'channels': self.channels,
+        }]
+        for i, style in enumerate(STYLES, 1):
+            filters.append({
+                'id': i,
+                'key': style,
+                'name': style.replace('-', ' ').title(),
+                'display': True,
+                'channels': [
+                    c for c in self.channels
+                    if c['key'].startswith(style.replace('-', ''))
+                ],
+            })
+        return filters
+
+    def favorites(self):
+        return [{
+            'channel_id': c['id'],
+            'position': i,
+        } for i, c in enumerate(self.channels[:10])]
+
+    def upcoming(self, limit=24):
+        now = datetime.now(timezone.utc)
+
+        events = []
+        for i, show in enumerate(self.shows[:limit]):
+            # The first show is live right now
+            start_at = now + timedelta(hours=i) - timedelta(minutes=30)
+            events.append({
+                'id': show['id'],
+                'start_at': _iso(start_at),
+                'end_at': _iso(start_at + timedelta(hours=1)),
+                'show': dict(show, now_playing=i == 0),
+                'tracks': [self.track(900000 + show['id'])],
+            })
+        return events
+
+    def show_facets(self):
+        facets = []
+        for style in STYLES:
+            facets.append({
+                'field': 'channel_filter_name',
+                'name': style,
+                'label': style.title(),
+            })
+        for c in self.channels[:30]:
+            facets.append({
+                'field': 'channel_name',
+                'name': c['key'],
+                'label': c['name'],
+            })
+        return facets
+
+    def episodes(self, slug, per_page=10):
+        show = next((s for s in self.shows if s['slug'] == slug),
+                    self.shows[0])
+        return [{
+            'id': show['id'] * 100 + i,
+            'show': show,
+            'tracks': [self.track(800000 + show['id'] * 100 + i)],
+        } for i in range(per_page)]
+
+    def qualities(self):
+        return [
+            {'id': 1, 'key': 'medium'},
+            {'id': 2, 'key': 'high'},
+            {'id': 3, 'key': 'ultra'},
+        ]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Send headers and body in one go, otherwise Nagle's algorithm and
+    # delayed acks add ~40ms to every keep-alive response
+    wbufsize = -1
+
+    # Route table: (method, path regex below /v1/<network>/, handler name)
+    ROUTES = [
+        ('POST', r'member_sessions', 'session'),
+        ('GET', r'member_sessions/[^/]+', 'session'),
+        ('GET', r'members/\d+/subscriptions/active', 'empty_list'),
+        ('GET', r'members/\d+/favorites/channels', 'favorites'),
+        ('POST', r'members/\d+/favorites/channels', 'empty'),
+        ('GET', r'members/\d+/followed_items/show', 'followed_shows'),
+        ('GET', r'members/\d+/followed_items/playlist', 'playlists'),
+        ('POST', r'members/\d+/followed_items/show/[^/]+', 'empty'),
+        ('DELETE', r'members/\d+/followed_items/show/[^/]+', 'empty'),
+        ('POST', r'members/\d+/preferred_quality', 'empty'),
+        ('GET', r'channel_filters', 'channel_filters'),
+        ('GET', r'channels', 'search_channels'),
+        ('GET', r'qualities', 'qualities'),
+        ('GET', r'routines/channel/(\d+)', 'routine'),
+        ('GET', r'tracks/(\d+)', 'track'),
+        ('GET', r'track_history/channel/\d+', 'empty_list'),
+        ('GET', r'currently_playing', 'empty_list'),
+        ('GET', r'events/upcoming', 'upcoming'),
+        ('GET', r'shows', 'shows'),
+        ('GET', r'shows/([^/]+)/episodes', 'episodes'),
+        ('GET', r'playlists', 'playlists'),
+        ('POST', r'playlists/(\d+)/play', 'playlist_tracks'),
+        ('GET', r'listen_history', 'listen_history'),
+        ('POST', r'listen_history', 'empty'),
+        ('GET', r'search', 'empty'),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        match = re.match(r'/v1/[^/]+/(.*)$', url.path)
+        path = match.group(1).rstrip('/') if match else ''
+
+        delay = server.latency + server.rand.uniform(-1, 1) * server.jitter
+        time.sleep(max(0, delay) / 1000)
+
+        if server.rand.random() < server.error_rate:
+            server.stats['errors'] += 1
+            return self._send(500, {'error': 'injected'})
+
+        for route_method, pattern, name in self.ROUTES:
+            if route_method != method:
+                continue
+            route = re.fullmatch(pattern, path)
+            if route:
+                server.stats['requests'] += 1
+                server.stats[name] += 1
+                body = getattr(self, 'r_' + name)(query, *route.groups())
+                return self._send(200, body)
+
+        self._send(404, {'error': 'unknown endpoint'})
+
+    def _send(self, status, body):
+        body = json.dumps(body).encode('utf-8')
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.server.stats['not_modified'] += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.server.stats['bytes'] += len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 200:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    @property
+    def fixtures(self):
+        return self.server.fixtures
+
+    def r_empty(self, query):
+        return {}
+
+    def r_empty_list(self, query):
+        return []
+
+    def r_session(self, query):
+        return self.fixtures.session
+
+    def r_favorites(self, query):
+        return self.fixtures.favorites()
+
+    def r_followed_shows(self, query):
+        return self.fixtures.shows[:int(query.get('per_page', 10))]
+
+    def r_channel_filters(self, query):
+        return self.fixtures.channel_filters()
+
+    def r_search_channels(self, query):
+        q = query.get('q', '').lower()
+        return [
+            c for c in self.fixtures.channels if q in c['name'].lower()
+        ][:int(query.get('per_page', 25))]
+
+    def r_qualities(self, query):
+        return self.fixtures.qualities()
+
+    def r_routine(self, query, channel_id):
+        return {'tracks': self.fixtures.tracks(int(channel_id))}
+
+    def r_track(self, query, track_id):
+        return self.fixtures.track(int(track_id))
+
+    def r_upcoming(self, query):
+        return self.fixtures.upcoming(int(query.get('limit', 24)))
+
+    def r_shows(self, query):
+        per_page = int(query.get('per_page', 10))
+        return {
+            'metadata': {'facets': self.fixtures.show_facets()},
+            'results': self.fixtures.shows[:per_page],
+        }
+
+    def r_episodes(self, query, slug):
+        return self.fixtures.episodes(slug, int(query.get('per_page', 10)))
+
+    def r_playlists(self, query):
+        return {
+            'results':
+            self.fixtures.playlists[:int(query.get('per_page', 25))]
+        }
+
+    def r_playlist_tracks(self, query, playlist_id):
+        return {'tracks': self.fixtures.tracks(int(playlist_id))}
+
+    def r_listen_history(self, query):
+        return [{'track': t} for t in self.fixtures.tracks(1)]
+
+
+class FakeAPI:
+    '''Runs the fake API on a background thread.
+
+    ``latency`` and ``jitter`` are in milliseconds, ``error_rate`` is the
+    fraction of requests answered with a 500.
+    '''
+    def __init__(self, port=0, latency=0, jitter=0, error_rate=0,
+                 fixtures=None, seed=0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+        self._server.fixtures = fixtures or Fixtures(seed=seed)
+        self._server.rand = random.Random(seed)
+        self._server.stats = collections.Counter()
+        self._thread = None
+
+        self.configure(latency, jitter, error_rate)
+
+    def configure(self, latency=0, jitter=0, error_rate=0):
+        self._server.latency = latency
+        self._server.jitter = jitter
+        self._server.error_rate = error_rate
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/v1'.format(self._server.server_port)
+
+    @property
+    def stats(self):
+        return self._server.stats
+
+    def api_url(self, network):
+        return '{}/{}'.format(self.url, network)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='response latency in ms')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='+/- random latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of requests failing with a 500')
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    api = FakeAPI(args.port, args.latency, args.jitter, args.error_rate,
+                  Fixtures(args.channels, seed=args.seed), args.seed)
+    print('Serving on', api.url)
+    try:
+        api.start()._thread.join()
+    except KeyboardInterrupt:
+        api.stop()
+
+
+if __name__ == '__main__':
+    main()
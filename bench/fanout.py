@@ -0,0 +1,113 @@
+'''Wall time of fanning requests out: one after the other, on the thread
+pool (`addict.map_networks`) and as coroutines (`aioaddict`).
+
+Runs against the fake API with ``--latency`` so the time spent waiting on
+the network dominates, like it does against the real API:
+
+* ``networks``: refreshing ``channel_filters`` of every network
+* ``schedule``: the upcoming events and followed shows of one network, the
+  two requests of the schedule listing
+
+::
+
+    python -m bench.fanout
+    python -m bench.fanout --latency 300 --iterations 3
+'''
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from bench import run
+
+
+def sequential_networks(aa_get, networks):
+    return [aa_get(n).get_channel_filters(refresh=True) for n in networks]
+
+
+def pooled_networks(aa_get, networks):
+    from addon import addict
+    results, _ = addict.map_networks(
+        lambda n: aa_get(n).get_channel_filters(refresh=True), networks)
+    return results
+
+
+def gathered_networks(cache_dir, networks):
+    from addon import aioaddict
+    return asyncio.run(aioaddict.gather_networks(
+        cache_dir, 'get_channel_filters', networks=networks, refresh=True))
+
+
+def sequential_schedule(aa):
+    return (aa.get_schedule(refresh=True),
+            aa.get_shows_followed(refresh=True))
+
+
+def gathered_schedule(aio):
+    async def fetch():
+        return await asyncio.gather(aio.get_schedule(refresh=True),
+                                    aio.get_shows_followed(refresh=True))
+
+    return asyncio.run(fetch())
+
+
+def measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), max(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=300,
+                        help='fake API latency in ms')
+    parser.add_argument('--iterations', type=int, default=3)
+    args = parser.parse_args()
+
+    profile_dir = tempfile.mkdtemp(prefix='aa-bench-fanout-')
+    os.environ['BENCH_PROFILE_DIR'] = profile_dir
+    run.setup_path()
+
+    from bench.fakeapi import FakeAPI, Fixtures
+    api = FakeAPI(0, 0, 0, 0, Fixtures()).start()
+    run.login(api.url)
+    api.configure(args.latency)
+
+    from addon import addict, aioaddict
+
+    def aa_get(network):
+        return addict.AudioAddict.get(profile_dir, network)
+
+    networks = list(addict.NETWORKS.keys())
+    aa = aa_get(run.NETWORK)
+    aio = aioaddict.AsyncAudioAddict.get(profile_dir, run.NETWORK)
+
+    cases = [
+        ('networks:sequential',
+         lambda: sequential_networks(aa_get, networks)),
+        ('networks:map_networks',
+         lambda: pooled_networks(aa_get, networks)),
+        ('networks:gather_networks',
+         lambda: gathered_networks(profile_dir, networks)),
+        ('schedule:sequential', lambda: sequential_schedule(aa)),
+        ('schedule:gather', lambda: gathered_schedule(aio)),
+    ]
+
+    print('{:<28} {:>10} {:>10}'.format('case', 'p50 ms', 'max ms'))
+    for name, func in cases:
+        p50, worst = measure(func, args.iterations)
+        print('{:<28} {:>10.0f} {:>10.0f}'.format(name, p50 * 1000,
+                                                  worst * 1000))
+        sys.stdout.flush()
+
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+'''Import-time benchmark.
+
+Runs plugin invocations in fresh interpreters with ``-X importtime`` (after
+priming the cache against the fake API, so cached routes stay cached) and
+reports per route the total import time, the most expensive top-level
+imports and whether heavy optional modules got loaded at all::
+
+    python -m bench.imports
+    python -m bench.imports --routes root styles play_channel --top 10
+'''
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from bench import run
+
+# Modules only some routes should need
+HEAVY_MODULES = ['requests', 'urllib3', 'dateutil', 'asyncio', 'cProfile',
+                 'pstats', 'tracemalloc']
+
+IMPORTTIME_RE = re.compile(
+    r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$')
+
+
+def parse_importtime(stderr):
+    '''Returns ``(total_us, [(cumulative_us, module), ...])`` with the
+    top-level imports only.'''
+    total, top_level = 0, []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+
+        self_us, cumulative, indent, module = match.groups()
+        total += int(self_us)
+        if len(indent) == 1:
+            top_level.append((int(cumulative), module))
+
+    return total, sorted(top_level, reverse=True)
+
+
+# Mirrors a Kodi plugin invocation as closely as possible, anything imported
+# here besides the addon itself would distort the numbers
+CHILD = '''
+import os, sys
+sys.argv = [{url!r}, '1', {query!r}]
+
+from addon import addict
+for key, network in addict.NETWORKS.items():
+    network['api_url'] = os.environ['BENCH_API_URL'] + '/' + key
+
+with open('default.py') as f:
+    code = compile(f.read(), 'default.py', 'exec')
+try:
+    exec(code, {{'__name__': '__main__'}})
+except SystemExit:
+    pass
+
+import json
+print(json.dumps(sorted(sys.modules)))
+'''
+
+
+def measure(path, env):
+    url, _, query = path.partition('?')
+    code = CHILD.format(url=run.PLUGIN_URL + url,
+                        query='?' + query if query else '')
+
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=run.ADDON_DIR, env=env, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
+    stderr = proc.stderr.decode()
+
+    try:
+        modules = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        sys.stderr.write(stderr)
+        raise RuntimeError('Invocation of {} failed'.format(path))
+
+    total, top_level = parse_importtime(stderr)
+    return total, top_level, set(modules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--routes', nargs='+',
+                        choices=[name for name, _ in run.ROUTES])
+    parser.add_argument('--top', type=int, default=5,
+                        help='top-level imports listed per route')
+    parser.add_argument('--save', help='store the results as json')
+    parser.add_argument('--compare', help='compare against stored results')
+    args = parser.parse_args()
+
+    profile_dir = tempfile.mkdtemp(prefix='aa-bench-imports-')
+    os.environ['BENCH_PROFILE_DIR'] = profile_dir
+    run.setup_path()
+
+    from bench.fakeapi import FakeAPI
+    api = FakeAPI().start()
+    run.login(api.url)
+
+    from addon import addict
+    channel = addict.AudioAddict.get(profile_dir,
+                                     run.NETWORK).get_channels()[0]['key']
+
+    env = dict(os.environ, BENCH_API_URL=api.url,
+               PYTHONPATH=os.pathsep.join([run.KODI_DIR, run.ADDON_DIR]))
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    for name, path in run.ROUTES:
+        if args.routes and name not in args.routes:
+            continue
+        path = path.format(network=run.NETWORK, channel=channel)
+
+        # Prime the cache the way a previous invocation would have
+        run.invoke(path)
+
+        total, top_level, modules = measure(path, env)
+        heavy = [m for m in HEAVY_MODULES if m in modules]
+        results[name] = {'import_ms': total / 1000, 'heavy': heavy}
+
+        line = '{:<18} {:>8.1f} ms  loads: {}'.format(
+            name, total / 1000, ', '.join(heavy) or '-')
+        if name in baseline:
+            line += '  ({:+.1f} ms)'.format(total / 1000 -
+                                             baseline[name]['import_ms'])
+        print(line)
+
+        for cumulative, module in top_level[:args.top]:
+            print('{:>28.1f} ms  {}'.format(cumulative / 1000, module))
+
+    api.stop()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+'''Shared state of the fake Kodi modules.
+
+Every call into one of the fake modules is appended to ``CALLS`` as a
+``(name, args, kwargs)`` tuple.
+'''
+import os
+import re
+import tempfile
+
+ADDON_ID = 'plugin.audio.audioaddict'
+ADDON_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+PROFILE_DIR = os.environ.get(
+    'BENCH_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'aa-bench'))
+
+CALLS = []
+
+# Print log messages instead of only recording them
+VERBOSE = False
+
+SETTINGS = {}
+INFO_LABELS = {}
+
+
+def record(name, *args, **kwargs):
+    CALLS.append((name, args, kwargs))
+
+
+def calls(name):
+    return [c for c in CALLS if c[0] == name]
+
+
+def reset():
+    del CALLS[:]
+    INFO_LABELS.clear()
+
+
+def load_settings():
+    path = os.path.join(ADDON_DIR, 'resources', 'settings.xml')
+    with open(path, 'r') as f:
+        for tag in re.findall(r'<setting\b[^>]*>', f.read()):
+            id_ = re.search(r'\bid="([^"]+)"', tag)
+            default = re.search(r'\bdefault="([^"]*)"', tag)
+            if id_:
+                SETTINGS.setdefault(id_.group(1),
+                                    default.group(1) if default else '')
+
+
+load_settings()
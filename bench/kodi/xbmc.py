@@ -0,0 +1,102 @@
+import kodistub
+from kodistub import INFO_LABELS, record
+
+LOGDEBUG = 0
+LOGINFO = 1
+LOGWARNING = 2
+LOGERROR = 3
+LOGFATAL = 4
+
+PLAYLIST_MUSIC = 0
+
+def log(msg, level=LOGDEBUG):
+    record('xbmc.log', msg, level)
+    if kodistub.VERBOSE:
+        print(msg)
+
+
+def executebuiltin(function, wait=False):
+    record('xbmc.executebuiltin', function)
+
+
+def getInfoLabel(label):
+    return INFO_LABELS.get(label, '')
+
+
+def getGlobalIdleTime():
+    return 0
+
+
+def sleep(ms):
+    record('xbmc.sleep', ms)
+
+
+class Monitor:
+    def abortRequested(self):
+        return False
+
+    def waitForAbort(self, timeout=0):
+        return False
+
+
+class Player:
+    def __init__(self):
+        pass
+
+    def play(self, item=None, listitem=None, windowed=False, startpos=-1):
+        record('xbmc.Player.play', item)
+
+    def stop(self):
+        record('xbmc.Player.stop')
+
+    def isPlaying(self):
+        # Kodi plays whatever a plugin resolved
+        return bool(kodistub.calls('xbmcplugin.setResolvedUrl')
+                    or kodistub.calls('xbmc.Player.play'))
+
+    def isPlayingAudio(self):
+        return False
+
+    def getTime(self):
+        return 0.0
+
+    def seekTime(self, seconds):
+        record('xbmc.Player.seekTime', seconds)
+
+
+class PlayList:
+    _items = {}
+
+    def __init__(self, playlist):
+        self._id = playlist
+        PlayList._items.setdefault(playlist, [])
+
+    def add(self, url, listitem=None, index=-1):
+        record('xbmc.PlayList.add', url)
+        PlayList._items[self._id].append((url, listitem))
+
+    def clear(self):
+        record('xbmc.PlayList.clear')
+        PlayList._items[self._id] = []
+
+    def size(self):
+        return len(PlayList._items[self._id])
+
+    def getposition(self):
+        return 0
+
+
+class Keyboard:
+    text = ''
+
+    def __init__(self, line='', heading='', hidden=False):
+        pass
+
+    def doModal(self, autoclose=0):
+        pass
+
+    def isConfirmed(self):
+        return bool(Keyboard.text)
+
+    def getText(self):
+        return Keyboard.text
@@ -0,0 +1,41 @@
+from kodistub import ADDON_DIR, ADDON_ID, PROFILE_DIR, SETTINGS, record
+
+
+class Addon:
+    def __init__(self, id=None):
+        pass
+
+    def getAddonInfo(self, id):
+        return {
+            'id': ADDON_ID,
+            'name': 'AudioAddict',
+            'path': ADDON_DIR,
+            'profile': PROFILE_DIR,
+            'icon': '',
+            'version': '0.0.0',
+        }.get(id, '')
+
+    def getLocalizedString(self, id):
+        return str(id)
+
+    def getSetting(self, id):
+        return SETTINGS.get(id, '')
+
+    def getSettingBool(self, id):
+        return SETTINGS.get(id, '') == 'true'
+
+    def getSettingInt(self, id):
+        try:
+            return int(SETTINGS.get(id) or 0)
+        except ValueError:
+            return 0
+
+    def setSetting(self, id, value):
+        record('xbmcaddon.Addon.setSetting', id, value)
+        SETTINGS[id] = value
+
+    def setSettingBool(self, id, value):
+        self.setSetting(id, 'true' if value else 'false')
+
+    def setSettingInt(self, id, value):
+        self.setSetting(id, str(value))
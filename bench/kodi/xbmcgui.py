@@ -0,0 +1,69 @@
+from kodistub import record
+
+
+class ListItem:
+    def __init__(self, label='', label2='', path='', offscreen=False):
+        self._label = label
+        self._path = path
+        self._art = {}
+        self._properties = {}
+
+    def getLabel(self):
+        return self._label
+
+    def setLabel(self, label):
+        self._label = label
+
+    def getPath(self):
+        return self._path
+
+    def setPath(self, path):
+        self._path = path
+
+    def setArt(self, values):
+        self._art.update(values)
+
+    def getArt(self, key):
+        return self._art.get(key, '')
+
+    def setProperty(self, key, value):
+        self._properties[key] = value
+
+    def getProperty(self, key):
+        return self._properties.get(key, '')
+
+    def setInfo(self, type, infoLabels):
+        pass
+
+    def select(self, selected):
+        pass
+
+    def addContextMenuItems(self, items, replaceItems=False):
+        pass
+
+
+class Dialog:
+    def notification(self, heading, message, icon='', time=5000,
+                     sound=True):
+        record('xbmcgui.Dialog.notification', heading, message)
+
+    def textviewer(self, heading, text, usemono=False):
+        record('xbmcgui.Dialog.textviewer', heading)
+
+    def yesno(self, heading, message, *args, **kwargs):
+        record('xbmcgui.Dialog.yesno', heading)
+        return False
+
+
+class DialogProgress:
+    def create(self, heading, message=''):
+        record('xbmcgui.DialogProgress.create', heading)
+
+    def update(self, percent, message=''):
+        record('xbmcgui.DialogProgress.update', percent, message)
+
+    def iscanceled(self):
+        return False
+
+    def close(self):
+        record('xbmcgui.DialogProgress.close')
@@ -0,0 +1,30 @@
+from kodistub import record
+
+SORT_METHOD_UNSORTED = 0
+SORT_METHOD_LABEL = 1
+
+
+def setPluginCategory(handle, category):
+    record('xbmcplugin.setPluginCategory', handle, category)
+
+
+def setContent(handle, content):
+    record('xbmcplugin.setContent', handle, content)
+
+
+def addSortMethod(handle, sortMethod):
+    record('xbmcplugin.addSortMethod', handle, sortMethod)
+
+
+def addDirectoryItems(handle, items, totalItems=0):
+    record('xbmcplugin.addDirectoryItems', handle, items)
+    return True
+
+
+def endOfDirectory(handle, succeeded=True, updateListing=False,
+                   cacheToDisc=True):
+    record('xbmcplugin.endOfDirectory', handle, succeeded)
+
+
+def setResolvedUrl(handle, succeeded, listitem):
+    record('xbmcplugin.setResolvedUrl', handle, succeeded, listitem)
@@ -0,0 +1,2 @@
+def translatePath(path):
+    return path
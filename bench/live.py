@@ -0,0 +1,144 @@
+'''Latency of tuning in to live shows and wake-ups of the service.
+
+Seeds the schedule with ``--shows`` shows starting ``--spacing`` seconds
+apart on the playing channel and runs the service's main loop
+(``service.run``) until the last one started. Reports per show the delay
+between its start and the service tuning in, next to the delay polling
+at the start of every minute had, and how often the loop woke up and ran
+``monitor_live``::
+
+    python -m bench.live
+    python -m bench.live --shows 5 --spacing 3
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from bench import run
+
+
+class Monitor:
+    '''`xbmc.Monitor` counting the wake-ups, aborting at ``stop_at``.'''
+    def __init__(self, stop_at):
+        self.wakeups = 0
+        self._abort = threading.Event()
+        threading.Timer(max(0, stop_at - time.time()),
+                        self._abort.set).start()
+
+    def abortRequested(self):
+        return self._abort.is_set()
+
+    def waitForAbort(self, timeout=None):
+        aborted = self._abort.wait(timeout)
+        self.wakeups += not aborted
+        return aborted
+
+
+def seed_schedule(aa, channel, shows, spacing):
+    from addon import addict
+    from bench.fakeapi import Fixtures, _iso
+    from datetime import datetime, timedelta, timezone
+
+    now = datetime.now(timezone.utc)
+    events = []
+    for i, show in enumerate(Fixtures(shows=shows).shows[:shows]):
+        start_at = now + timedelta(seconds=(i + 1) * spacing)
+        show['channels'][0]['key'] = channel
+        events.append({
+            'id': show['id'],
+            'start_at': _iso(start_at),
+            'end_at': _iso(start_at + timedelta(minutes=30)),
+            'show': show,
+            'tracks': [],
+        })
+
+    aa._update_cache(aa._namespace, 'shows_upcoming',
+                     addict.pack_upcoming(events), cache_time=10)
+    aa.backend.flush()
+    return [addict.parse_timestamp(e['start_at']) for e in events]
+
+
+def benchmark(args):
+    profile_dir = tempfile.mkdtemp(prefix='aa-bench-live-')
+    os.environ['BENCH_PROFILE_DIR'] = profile_dir
+    run.setup_path()
+
+    import kodistub
+    import xbmc
+    from bench.fakeapi import FakeAPI, Fixtures
+    api = FakeAPI(0, 0, 0, 0, Fixtures()).start()
+    run.login(api.url)
+
+    from addon import addict
+    import service
+
+    kodistub.SETTINGS.update({
+        'addon.daemon': 'false',
+        'addon.tune_in_live': 'true',
+    })
+
+    aa = addict.AudioAddict.get(profile_dir, run.NETWORK)
+    channel = aa.get_channels()[0].get('key')
+    kodistub.INFO_LABELS['Player.Filenameandpath'] = (
+        'plugin://{}/channel/track/{}/{}/1'.format(kodistub.ADDON_ID,
+                                                   run.NETWORK, channel))
+
+    tune_ins = []
+
+    def executebuiltin(function, wait=False):
+        if 'live=True' in function:
+            tune_ins.append(time.time())
+
+    runs = []
+    monitor_live = service.monitor_live
+
+    def counted_monitor_live(skip_shows=None):
+        runs.append(time.time())
+        return monitor_live(skip_shows)
+
+    xbmc.executebuiltin = executebuiltin
+    service.monitor_live = counted_monitor_live
+
+    starts = seed_schedule(aa, channel, args.shows, args.spacing)
+    monitor = Monitor(starts[-1] + args.spacing)
+    service.run(monitor)
+    api.stop()
+
+    delays = []
+    for start in starts:
+        after = [t for t in tune_ins if t >= start]
+        delays.append(after[0] - start if after else None)
+    polled = [60 - start % 60 for start in starts]
+
+    return delays, polled, monitor.wakeups, len(runs), starts[-1] - starts[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shows', type=int, default=3)
+    parser.add_argument('--spacing', type=float, default=2,
+                        help='seconds between the show starts')
+    args = parser.parse_args()
+
+    delays, polled, wakeups, runs, duration = benchmark(args)
+
+    print('{:<6} {:>12} {:>12}'.format('show', 'delay ms', 'polled ms'))
+    for i, (delay, poll) in enumerate(zip(delays, polled)):
+        print('{:<6} {:>12} {:>12.0f}'.format(
+            i, '-' if delay is None else '{:.0f}'.format(delay * 1000),
+            poll * 1000))
+
+    measured = [d for d in delays if d is not None]
+    if measured:
+        print('mean delay:    {:.0f} ms (polling {:.0f} ms)'.format(
+            statistics.mean(measured) * 1000,
+            statistics.mean(polled) * 1000))
+    print('wake-ups:      {} in {:.0f}s'.format(wakeups, duration))
+    print('monitor_live:  {} runs ({} shows)'.format(runs, len(delays)))
+
+
+if __name__ == '__main__':
+    main()
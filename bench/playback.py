@@ -0,0 +1,84 @@
+'''Time to first audio of playing a channel.
+
+Invokes the play route of a channel and then, like Kodi does, the route
+resolving the track it returned (warm, in this interpreter) against the
+fake API. Reports per step:
+
+* ``play``: the play route until it returned
+* ``resolved``: the resolve route until it called ``setResolvedUrl``, Kodi
+  starts streaming from there
+* ``returned``: the resolve route until it returned, the invocation blocks
+  Kodi's plugin invoker until then
+
+Time to first audio is ``play`` + ``resolved``::
+
+    python -m bench.playback
+    python -m bench.playback --latency 40 --iterations 10
+'''
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from bench import run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=40,
+                        help='fake API latency in ms')
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    profile_dir = tempfile.mkdtemp(prefix='aa-bench-playback-')
+    os.environ['BENCH_PROFILE_DIR'] = profile_dir
+    run.setup_path()
+
+    import kodistub
+    import xbmcplugin
+    from bench.fakeapi import FakeAPI, Fixtures
+    api = FakeAPI(0, 0, 0, 0, Fixtures()).start()
+    run.login(api.url)
+    api.configure(args.latency)
+
+    from addon import addict
+    aa = addict.AudioAddict.get(profile_dir, run.NETWORK)
+    channel = aa.get_channels()[0].get('key')
+
+    resolved_at = []
+    set_resolved_url = xbmcplugin.setResolvedUrl
+
+    def timed_set_resolved_url(handle, succeeded, listitem):
+        resolved_at.append(time.perf_counter())
+        set_resolved_url(handle, succeeded, listitem)
+
+    xbmcplugin.setResolvedUrl = timed_set_resolved_url
+
+    samples = {'play': [], 'resolved': [], 'returned': [], 'first audio': []}
+    for _ in range(args.iterations):
+        play, _ = run.invoke('/play/channel/{}/{}/'.format(run.NETWORK,
+                                                           channel))
+        item = kodistub.calls('xbmcplugin.setResolvedUrl')[-1][1][2]
+        path = item.getPath()[len(run.PLUGIN_URL):]
+
+        del resolved_at[:]
+        start = time.perf_counter()
+        returned, _ = run.invoke(path)
+        resolved = resolved_at[0] - start
+
+        samples['play'].append(play)
+        samples['resolved'].append(resolved)
+        samples['returned'].append(returned)
+        samples['first audio'].append(play + resolved)
+
+    api.stop()
+
+    print('{:<14} {:>10} {:>10}'.format('step', 'p50 ms', 'max ms'))
+    for name, values in samples.items():
+        print('{:<14} {:>10.1f} {:>10.1f}'.format(
+            name, statistics.median(values) * 1000, max(values) * 1000))
+
+
+if __name__ == '__main__':
+    main()
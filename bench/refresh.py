@@ -0,0 +1,191 @@
+'''Cost of refreshing cached API responses.
+
+Refreshes the cached entries which are revalidated in the background (see
+``addict.STALE_TIMES``) against the fake API (running in a separate
+process, so only the addon's work is measured) and reports per entry:
+
+* CPU time of this process (including the background thread)
+* peak memory allocated (tracemalloc), i.e. bytes copied around
+* bytes written to disk (``wchar`` of ``/proc/self/io`` where available)
+
+Two modes are measured:
+
+* ``refresh``: the public getter with ``refresh=True``, the caller uses
+  the result
+* ``background``: an expired entry is returned right away and revalidated
+  in the background, nobody reads the refreshed data in this process
+
+both for responses which changed (``200``) and for ones which didn't
+(``304``, answering the cached ETag)::
+
+    python -m bench.refresh --channels 2000 --save a.json
+    python -m bench.refresh --channels 2000 --compare a.json
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench import run
+from bench.cache import bytes_written
+
+# name: (cache key, getter)
+ENTRIES = {
+    'channel_filters': ('channel_filters',
+                        lambda aa, **kw: aa.get_channel_filters(**kw)),
+    'favorites': ('favorites', lambda aa, **kw: aa.get_favorites(**kw)),
+    'shows_upcoming': ('shows_upcoming',
+                       lambda aa, **kw: aa.get_upcoming(**kw)),
+    'shows_followed': ('shows_followed',
+                       lambda aa, **kw: aa.get_shows_followed(**kw)),
+}
+
+
+def start_api(channels):
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'bench.fakeapi', '--port', '0',
+         '--channels', str(channels)], cwd=run.ADDON_DIR,
+        stdout=subprocess.PIPE)
+    url = proc.stdout.readline().decode().split()[-1]
+    return proc, url
+
+
+def refresh(aa, key, getter):
+    getter(aa, refresh=True)
+
+
+def background(aa, key, getter):
+    from addon import addict
+
+    getter(aa)
+    addict.wait_for_revalidations()
+
+
+def expire(aa, key, status):
+    # Expired but within the stale time, already read by this process.
+    # Without validators the fake API sends the whole response again.
+    aa.backend.get_entry(aa._namespace, key)
+    aa.backend.set_entry(aa._namespace, key, expires_on=int(time.time()) - 1,
+                         validators={} if status == 200 else None)
+    aa.backend.flush()
+
+
+def measure(aa, name, mode, status, iterations):
+    key, getter = ENTRIES[name]
+    call = {'refresh': refresh, 'background': background}[mode]
+
+    cpu, written = [], []
+    for _ in range(iterations):
+        expire(aa, key, status)
+
+        before = bytes_written(aa.backend._cache_dir)
+        start = time.process_time()
+        call(aa, key, getter)
+        aa.backend.flush()
+        cpu.append(time.process_time() - start)
+        written.append(bytes_written(aa.backend._cache_dir) - before)
+
+    # A separate pass as tracing slows down the timed calls considerably
+    expire(aa, key, status)
+    tracemalloc.start()
+    call(aa, key, getter)
+    aa.backend.flush()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'cpu': statistics.mean(cpu) * 1000,
+        'p95': run.percentile(cpu, 95) * 1000,
+        'bytes': int(statistics.median(written)),
+        'peak': peak,
+    }
+
+
+def benchmark(args):
+    profile_dir = tempfile.mkdtemp(prefix='aa-bench-refresh-')
+    os.environ['BENCH_PROFILE_DIR'] = profile_dir
+    run.setup_path()
+
+    proc, url = start_api(args.channels)
+    try:
+        run.login(url)
+
+        from addon import addict, cache
+        cache.CacheBackend.write_behind = True
+
+        aa = addict.AudioAddict.get(profile_dir, run.NETWORK)
+        for key, getter in ENTRIES.values():
+            getter(aa)
+        aa.backend.flush()
+
+        results = {}
+        for name in ENTRIES:
+            for mode in args.modes:
+                for status in (200, 304):
+                    results['{}:{}:{}'.format(mode, status, name)] = measure(
+                        aa, name, mode, status, args.iterations)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return {
+        'meta': {
+            'channels': args.channels,
+            'iterations': args.iterations,
+            'python': sys.version.split()[0],
+        },
+        'results': results,
+    }
+
+
+def report(result, baseline=None):
+    base_results = (baseline or {}).get('results', {})
+
+    print('{:<32} {:>8} {:>8} {:>10} {:>10}{}'.format(
+        'entry', 'cpu ms', 'p95 ms', 'written', 'peak KiB',
+        '  cpu diff  peak diff' if baseline else ''))
+
+    for key, stats in result['results'].items():
+        line = '{:<32} {:>8.2f} {:>8.2f} {:>10} {:>10.1f}'.format(
+            key, stats['cpu'], stats['p95'], stats['bytes'],
+            stats['peak'] / 1024)
+
+        base = base_results.get(key)
+        if base and base['cpu'] and base['peak']:
+            line += '  {:>+8.1%}  {:>+9.1%}'.format(
+                stats['cpu'] / base['cpu'] - 1,
+                stats['peak'] / base['peak'] - 1)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--modes', nargs='+',
+                        default=['refresh', 'background'],
+                        choices=['refresh', 'background'])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--save', help='store the results as json')
+    parser.add_argument('--compare', help='compare against stored results')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    result = benchmark(args)
+    report(result, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+'''End-to-end route benchmark.
+
+Drives plugin urls through ``default.py`` against the fake API
+(``bench.fakeapi``) with the fake Kodi modules from ``bench/kodi`` and
+reports p50/p95 per route.
+
+Two modes are measured:
+
+* ``cold``: every invocation runs in a fresh interpreter, just like Kodi
+  starts the plugin by default (includes interpreter start and imports).
+* ``warm``: invocations reuse one interpreter and its in-memory state, like
+  Kodi does with ``reuselanguageinvoker`` enabled.
+
+The on-disk cache is shared between invocations in both modes. With
+``--via daemon`` both modes are measured again with the reads answered by
+the service's daemon (``addon.rpc``) running in a separate process, those
+results are reported as ``cold+daemon``/``warm+daemon``. With ``--via
+snapshot`` the listings are served from the catalog snapshot
+(``addon.snapshot``) the service compiles (``cold+snapshot``/
+``warm+snapshot``).
+
+Results can be stored with ``--save`` and compared against a previous run
+with ``--compare``::
+
+    python -m bench.run --latency 40 --jitter 20 --save before.json
+    python -m bench.run --latency 40 --jitter 20 --compare before.json
+    python -m bench.run --via direct daemon --routes channels favorites
+    python -m bench.run --via direct snapshot --modes cold --routes styles
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCH_DIR)
+KODI_DIR = os.path.join(BENCH_DIR, 'kodi')
+
+PLUGIN_URL = 'plugin://plugin.audio.audioaddict'
+NETWORK = 'difm'
+
+# (name, plugin path) of the benchmarked routes, `{channel}` is replaced by
+# the first channel of the fake catalog
+ROUTES = [
+    ('root', '/'),
+    ('network', '/networks/{network}/'),
+    ('styles', '/channels/{network}/'),
+    ('channels', '/channels/{network}/default/'),
+    ('favorites', '/channels/{network}/favorites/'),
+    ('shows_facets', '/shows/{network}/fields/channel_filter_name/'),
+    ('shows_followed', '/shows/{network}/followed/'),
+    ('shows_schedule', '/shows/{network}/schedule/'),
+    ('episodes', '/episodes/{network}/show-1/'),
+    ('playlists', '/playlists/{network}/popular'),
+    ('search', '/search/{network}/channels/trance/'),
+    ('listen_history', '/listen_history/{network}/{channel}/'),
+    ('play_channel', '/play/channel/{network}/{channel}/'),
+    ('resolve_channel', '/channel/track/{network}/{channel}/0/'),
+    ('play_playlist', '/play/playlist/{network}/1/'),
+    ('resolve_playlist', '/playlist/track/{network}/1/0'),
+    ('refresh', '/refresh/{network}/'),
+    ('stats', '/stats/'),
+    ('jobs', '/jobs/'),
+]
+
+
+def setup_path():
+    for path in (KODI_DIR, ADDON_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+
+def patch_networks(api_url):
+    from addon import addict
+    for key, network in addict.NETWORKS.items():
+        network['api_url'] = '{}/{}'.format(api_url, key)
+
+
+_default = None
+
+
+def invoke(path):
+    '''Runs a single plugin invocation in this interpreter.
+
+    Returns the elapsed seconds and whether the route finished without
+    raising.
+    '''
+    import kodistub
+
+    global _default
+    if _default is None:
+        path_ = os.path.join(ADDON_DIR, 'default.py')
+        with open(path_, 'r') as f:
+            _default = compile(f.read(), path_, 'exec')
+
+    url, _, query = path.partition('?')
+    sys.argv = [PLUGIN_URL + url, '1', '?' + query if query else '']
+
+    kodistub.reset()
+    start = time.perf_counter()
+    done = True
+    try:
+        # Kodi runs the script as `__main__` again on every invocation
+        exec(_default, {'__name__': '__main__'})
+    except SystemExit:
+        pass
+    except Exception:
+        traceback.print_exc()
+        done = False
+
+    return time.perf_counter() - start, done
+
+
+def login(api_url):
+    from addon import addict, main
+
+    patch_networks(api_url)
+    aa = addict.AudioAddict.get(main.PROFILE_DIR, main.TEST_LOGIN_NETWORK)
+    if not aa.login('bench@example.com', 'bench'):
+        raise RuntimeError('Login against the fake API failed')
+    aa.backend.flush()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0
+    index = (len(values) - 1) * pct / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def summarize(samples, failures):
+    return {
+        'n': len(samples),
+        'failures': failures,
+        'p50': percentile(samples, 50) * 1000,
+        'p95': percentile(samples, 95) * 1000,
+        'mean': statistics.mean(samples) * 1000 if samples else 0,
+    }
+
+
+def run_cold(path, env):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-m', 'bench.run', '--invoke', path], cwd=ADDON_DIR,
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+
+    try:
+        result = json.loads(proc.stdout.decode().strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        sys.stderr.write(proc.stderr.decode())
+        return elapsed, False
+    return elapsed, result['done']
+
+
+class DaemonProcess:
+    '''Runs `addon.rpc.Daemon` in a child process like the service does.'''
+    def __init__(self, profile_dir, env):
+        self._profile_dir = profile_dir
+        self._env = env
+        self._proc = None
+
+    def start(self):
+        from addon import rpc
+
+        self._proc = subprocess.Popen(
+            [sys.executable, '-m', 'bench.run', '--serve', self._profile_dir],
+            cwd=ADDON_DIR, env=self._env, stdin=subprocess.PIPE)
+
+        address_file = os.path.join(self._profile_dir, rpc.ADDRESS_FILE)
+        deadline = time.time() + 10
+        while not os.path.exists(address_file):
+            if time.time() > deadline or self._proc.poll() is not None:
+                self.stop()
+                raise RuntimeError('Daemon did not start')
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        # The child stops the daemon once its stdin is closed
+        self._proc.stdin.close()
+        self._proc.wait()
+
+
+def serve(profile_dir):
+    from addon import rpc
+
+    daemon = rpc.Daemon(profile_dir).start()
+    try:
+        sys.stdin.read()
+    finally:
+        daemon.stop()
+
+
+def measure(mode, path, env, iterations, warmup):
+    samples, failures = [], 0
+    for i in range(warmup + iterations):
+        if mode == 'cold':
+            elapsed, done = run_cold(path, env)
+        else:
+            elapsed, done = invoke(path)
+
+        if i < warmup:
+            continue
+        samples.append(elapsed)
+        failures += not done
+
+    return summarize(samples, failures)
+
+
+def benchmark(args):
+    profile_dir = args.profile_dir or tempfile.mkdtemp(prefix='aa-bench-')
+    os.environ['BENCH_PROFILE_DIR'] = profile_dir
+    setup_path()
+
+    from bench.fakeapi import FakeAPI, Fixtures
+    api = FakeAPI(0, args.latency, args.jitter, 0,
+                  Fixtures(args.channels, seed=args.seed), args.seed).start()
+
+    # Log in without delays or errors, those only apply to the routes
+    login(api.url)
+    api.configure(args.latency, args.jitter, args.error_rate)
+
+    from addon import addict
+    aa = addict.AudioAddict.get(profile_dir, NETWORK)
+    channel = aa.get_channels()[0].get('key')
+
+    routes = [(name, path.format(network=NETWORK, channel=channel))
+              for name, path in ROUTES
+              if not args.routes or name in args.routes]
+
+    env = dict(os.environ, BENCH_API_URL=api.url,
+               PYTHONPATH=os.pathsep.join([KODI_DIR, ADDON_DIR]))
+
+    from addon import snapshot
+
+    results = {}
+    for via in args.via:
+        daemon = None
+        if via == 'daemon':
+            daemon = DaemonProcess(profile_dir, env).start()
+
+        # Compiled like the service does, the refresh route compiles it too
+        snapshot.remove(profile_dir, NETWORK)
+        if via == 'snapshot':
+            aa.update_snapshot()
+
+        try:
+            for mode in args.modes:
+                label = mode if via == 'direct' else mode + '+' + via
+                for name, path in routes:
+                    results['{}:{}'.format(label, name)] = measure(
+                        mode, path, env, args.iterations, args.warmup)
+        finally:
+            if daemon:
+                daemon.stop()
+
+    api.stop()
+
+    return {
+        'meta': {
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'error_rate': args.error_rate,
+            'channels': args.channels,
+            'iterations': args.iterations,
+            'via': args.via,
+            'python': sys.version.split()[0],
+        },
+        'routes': results,
+        'api': dict(api.stats),
+    }
+
+
+def report(result, baseline=None):
+    base_routes = (baseline or {}).get('routes', {})
+
+    print('{:<28} {:>5} {:>9} {:>9} {:>9}{}'.format(
+        'route', 'n', 'p50 ms', 'p95 ms', 'mean ms',
+        '  p50 diff  p95 diff' if baseline else ''))
+
+    for name, stats in result['routes'].items():
+        line = '{:<28} {:>5} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name, stats['n'], stats['p50'], stats['p95'], stats['mean'])
+
+        base = base_routes.get(name)
+        if base:
+            line += '  {:>+7.1%}  {:>+7.1%}'.format(
+                stats['p50'] / base['p50'] - 1 if base['p50'] else 0,
+                stats['p95'] / base['p95'] - 1 if base['p95'] else 0)
+
+        if stats['failures']:
+            line += '  ({} failed)'.format(stats['failures'])
+        print(line)
+
+    if baseline and baseline.get('meta') != result['meta']:
+        print('\nWarning: baseline was recorded with different settings:',
+              baseline.get('meta'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--modes', nargs='+', default=['cold', 'warm'],
+                        choices=['cold', 'warm'])
+    parser.add_argument('--routes', nargs='+',
+                        choices=[name for name, _ in ROUTES])
+    parser.add_argument('--via', nargs='+', default=['direct'],
+                        choices=['direct', 'daemon', 'snapshot'],
+                        help='answer reads directly, through the daemon or '
+                        'list from the snapshot')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='fake API latency in ms')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='+/- random fake API latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='fraction of API requests failing with a 500')
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--profile-dir',
+                        help='addon profile dir (defaults to a temp dir)')
+    parser.add_argument('--save', help='store the results as json')
+    parser.add_argument('--compare', help='compare against stored results')
+    parser.add_argument('--invoke', help=argparse.SUPPRESS)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        # Daemon of a `--via daemon` run
+        setup_path()
+        patch_networks(os.environ['BENCH_API_URL'])
+        serve(args.serve)
+        return
+
+    if args.invoke:
+        # Child of a `cold` run
+        setup_path()
+        patch_networks(os.environ['BENCH_API_URL'])
+        elapsed, done = invoke(args.invoke)
+        print(json.dumps({'elapsed': elapsed, 'done': done}))
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    result = benchmark(args)
+    report(result, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''Live show lookups: parsing the dates on every call vs. the intervals
+parsed once when caching ``events/upcoming`` (`addict.ScheduleIndex`).
+
+``legacy`` is the lookup as it was done before, ``index`` the one on the
+interval index. ``pack`` (once per response) and ``build`` (once per
+process) are the cost of the index::
+
+    python -m bench.schedule
+    python -m bench.schedule --events 24 200 --iterations 2000
+'''
+import argparse
+import statistics
+import sys
+import time
+
+from bench.fakeapi import Fixtures
+from bench.run import percentile, setup_path
+
+
+def legacy_live_shows(events):
+    from dateutil.tz import tzlocal
+    from datetime import datetime
+    from addon.addict import parse_datetime
+
+    now = datetime.now(tzlocal())
+    shows = []
+    for up in events:
+        start_at = parse_datetime(up.get('start_at'))
+        if not start_at or start_at > now:
+            continue
+        shows.append(up)
+    return shows
+
+
+def legacy_live(events, channel):
+    from dateutil.tz import tzlocal
+    from datetime import datetime
+    from addon.addict import parse_datetime
+
+    now = datetime.now(tzlocal())
+    for show in legacy_live_shows(events):
+        channels = [
+            c for c in show.get('show', {}).get('channels', [])
+            if c.get('key') == channel
+        ]
+        if not channels:
+            continue
+
+        end_at = parse_datetime(show.get('end_at'))
+        if end_at and end_at >= now:
+            return show
+    return None
+
+
+def legacy_next_start(events):
+    from dateutil.tz import tzlocal
+    from datetime import datetime
+    from addon.addict import parse_datetime
+
+    now = datetime.now(tzlocal())
+    starts = [parse_datetime(e.get('start_at')) for e in events]
+    return min([s for s in starts if s and s > now], default=None)
+
+
+def measure(func, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), percentile(samples, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, nargs='+', default=[24, 200],
+                        help='upcoming events')
+    parser.add_argument('--iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_path()
+    from addon.addict import ScheduleIndex, pack_upcoming
+
+    print('{:<28} {:>10} {:>10}'.format('lookup', 'p50 us', 'p95 us'))
+
+    for count in args.events:
+        events = Fixtures(shows=count).upcoming(count)
+        packed = pack_upcoming(events)
+        index = ScheduleIndex(packed)
+
+        # Live channel, the first event is live right now
+        channel = events[0]['show']['channels'][0]['key']
+        assert legacy_live(events, channel) is index.live(
+            channel, time.time())[2]
+
+        cases = [
+            ('legacy:live', lambda: legacy_live(events, channel)),
+            ('index:live', lambda: index.live(channel, time.time())),
+            ('legacy:live_shows', lambda: legacy_live_shows(events)),
+            ('index:live_shows', lambda: index.started(time.time())),
+            ('legacy:next_start', lambda: legacy_next_start(events)),
+            ('index:next_start', lambda: index.next_start(time.time())),
+            ('pack', lambda: pack_upcoming(events)),
+            ('build', lambda: ScheduleIndex(packed)),
+        ]
+        for name, func in cases:
+            p50, p95 = measure(func, args.iterations)
+            print('{:<28} {:>10.1f} {:>10.1f}'.format(
+                '{}:e{}'.format(name, count), p50 * 1e6, p95 * 1e6))
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
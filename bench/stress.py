@@ -0,0 +1,207 @@
+'''Stress test for concurrent queue access between processes.
+
+Runs ``--resolvers`` processes popping tracks off the same channel queue
+the way plugin invocations resolving tracks do (pick up other processes'
+changes, pop, flush) while a ``service`` process keeps refilling that queue,
+all against the fake API.
+
+Every track must be served exactly once: a track served twice is a lost
+update (what the plugin logs as "Got unexpected track from cache!"). The
+exit status is non-zero if that happens::
+
+    python -m bench.stress --resolvers 8 --pops 50
+    python -m bench.stress --resolvers 8 --pops 50 --no-locking
+'''
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import run
+
+# Queue length, small so the service refills all the time
+TRACKS = 5
+
+
+def _setup_worker(args):
+    run.setup_path()
+    run.patch_networks(os.environ['BENCH_API_URL'])
+
+    from addon import cache
+    cache.CacheBackend.write_behind = True
+    cache.CacheBackend.locking = not args.no_locking
+
+    # Start all workers at once to maximize contention
+    time.sleep(max(0, args.start_at - time.time()))
+
+
+def resolver(args):
+    from addon import addict, cache
+
+    aa = addict.AudioAddict.get(args.profile_dir, run.NETWORK)
+
+    pops = []
+    for _ in range(args.pops):
+        for backend in cache.CacheBackend.instances():
+            backend.revalidate()
+        aa.reset_state()
+
+        start = time.perf_counter()
+        try:
+            _, track = aa.next_channel_track(args.channel, tune_in=False,
+                                             pop=True, live=False)
+            aa.stats.flush()
+            aa.backend.flush()
+            pops.append([track.get('id'), time.perf_counter() - start])
+        except Exception as e:
+            pops.append([None, repr(e)])
+
+        time.sleep(args.pop_interval / 1000)
+
+    print(json.dumps(pops))
+
+
+def service(args):
+    from addon import addict, cache
+
+    aa = addict.AudioAddict.get(args.profile_dir, run.NETWORK)
+    aa.call_class = 'background'
+
+    refills = 0
+    while sys.stdin.readline():
+        for backend in cache.CacheBackend.instances():
+            backend.revalidate()
+
+        refills += aa.refill_channel_tracks(args.channel,
+                                            min_tracks=TRACKS + 1)
+        aa.stats.flush()
+        aa.backend.flush()
+
+        sys.stdout.write('{}\n'.format(refills))
+        sys.stdout.flush()
+
+
+def spawn(args, worker, env, start_at, **kwargs):
+    cmd = [
+        sys.executable, '-m', 'bench.stress', '--worker', worker,
+        '--profile-dir', args.profile_dir, '--channel', args.channel,
+        '--pops', str(args.pops), '--pop-interval', str(args.pop_interval),
+        '--start-at', str(start_at)
+    ]
+    if args.no_locking:
+        cmd.append('--no-locking')
+
+    return subprocess.Popen(cmd, cwd=run.ADDON_DIR, env=env, **kwargs)
+
+
+def stress(args):
+    args.profile_dir = args.profile_dir or tempfile.mkdtemp(
+        prefix='aa-bench-stress-')
+    os.environ['BENCH_PROFILE_DIR'] = args.profile_dir
+    run.setup_path()
+
+    from bench.fakeapi import FakeAPI, Fixtures
+    api = FakeAPI(0, args.latency, args.jitter, 0,
+                  Fixtures(tracks=TRACKS)).start()
+    run.login(api.url)
+
+    from addon import addict
+    aa = addict.AudioAddict.get(args.profile_dir, run.NETWORK)
+    args.channel = aa.get_channels()[0].get('key')
+    aa.backend.flush()
+
+    env = dict(os.environ, BENCH_API_URL=api.url,
+               PYTHONPATH=os.pathsep.join([run.KODI_DIR, run.ADDON_DIR]))
+
+    start_at = time.time() + 2
+    service_proc = spawn(args, 'service', env, start_at,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    # Not pipes, nobody reads them before the resolvers are done
+    outputs = [tempfile.TemporaryFile() for _ in range(args.resolvers)]
+    resolvers = [spawn(args, 'resolver', env, start_at, stdout=out)
+                 for out in outputs]
+
+    # Keep the service refilling until all resolvers are done
+    refills = 0
+    while any(proc.poll() is None for proc in resolvers):
+        service_proc.stdin.write(b'\n')
+        service_proc.stdin.flush()
+        refills = int(service_proc.stdout.readline() or refills)
+        time.sleep(args.refill_interval / 1000)
+
+    service_proc.stdin.close()
+    service_proc.wait()
+
+    pops = []
+    for out in outputs:
+        out.seek(0)
+        lines = out.read().decode().strip().splitlines()
+        pops.extend(json.loads(lines[-1]) if lines else [])
+        out.close()
+
+    api.stop()
+    return pops, refills, dict(api.stats)
+
+
+def report(pops, refills, api_stats):
+    served = collections.Counter(track for track, _ in pops if track)
+    errors = [error for track, error in pops if track is None]
+    latencies = [elapsed for track, elapsed in pops if track]
+    twice = {track: n for track, n in served.items() if n > 1}
+
+    print('pops:            {}'.format(len(pops)))
+    print('errors:          {}'.format(len(errors)))
+    print('served twice:    {} tracks ({} extra pops)'.format(
+        len(twice), sum(twice.values()) - len(twice)))
+    print('service refills: {}'.format(refills))
+    print('routine fetches: {}'.format(api_stats.get('routine', 0)))
+    print('pop p50/p95:     {:.1f} / {:.1f} ms'.format(
+        run.percentile(latencies, 50) * 1000,
+        run.percentile(latencies, 95) * 1000))
+
+    for error in sorted(set(errors)):
+        print('  error: {}'.format(error))
+
+    return not errors and not twice
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--resolvers', type=int, default=8)
+    parser.add_argument('--pops', type=int, default=50,
+                        help='tracks popped per resolver')
+    parser.add_argument('--pop-interval', type=float, default=10,
+                        help='ms between pops of a resolver')
+    parser.add_argument('--refill-interval', type=float, default=5,
+                        help='ms between refills of the service')
+    parser.add_argument('--latency', type=float, default=10,
+                        help='fake API latency in ms')
+    parser.add_argument('--jitter', type=float, default=5,
+                        help='+/- random fake API latency in ms')
+    parser.add_argument('--no-locking', action='store_true',
+                        help='disable the lock between processes')
+    parser.add_argument('--profile-dir',
+                        help='addon profile dir (defaults to a temp dir)')
+    parser.add_argument('--worker', choices=['resolver', 'service'],
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--channel', help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, default=0,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _setup_worker(args)
+        {'resolver': resolver, 'service': service}[args.worker](args)
+        return
+
+    if not report(*stress(args)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,16 @@
-from addon import main
+import sys
+
+from addon import profiling
 
 if __name__ == '__main__':
-    main.run()
+    enabled = profiling.pop_url_flag(sys.argv) or profiling.is_enabled()
+
+    # Imported within the profiled block as importing the addon (requests,
+    # dateutil, routes) is a large part of every invocation
+    with profiling.profile(profiling.route_name(sys.argv[0]),
+                           enabled) as profiler:
+        from addon import main
+        if profiler:
+            profiler.mark('import')
+
+        main.run()
@@ -1,10 +1,12 @@
+import functools
 import os
-from datetime import datetime
+import threading
+import time
 
 import xbmc
 import xbmcvfs
 import xbmcaddon
-from addon import addict, main, utils
+from addon import addict, cache, jobs, main, profiling, rpc, stats, utils
 
 ADDON = xbmcaddon.Addon()
 
@@ -12,6 +14,15 @@ ADDON_ID = os.path.join(ADDON.getAddonInfo('id'))
 PROFILE_DIR = xbmcvfs.translatePath(os.path.join(
     ADDON.getAddonInfo('profile')))
 
+# Refill the cached tracks of the playing channel once less than this many
+# are left or their urls expire within the given amount of seconds
+PREFETCH_MIN_TRACKS = 3
+PREFETCH_URL_MARGIN = 15 * 60
+
+# The user counts as browsing the addon while one of its listings is shown
+# and Kodi had input within this many seconds
+BROWSING_IDLE = 60
+
 
 class Monitor(xbmc.Monitor):
     def __init__(self):
@@ -20,54 +31,172 @@ class Monitor(xbmc.Monitor):
 
     def onSettingsChanged(self):
         addon = xbmcaddon.Addon()
+        stats.ApiStats.enabled = addon.getSettingBool('addon.stats')
 
         if addon.getSettingInt('aa.quality') != self._quality:
             utils.logd('Quality setting changed.')
             quality_id = utils.get_quality_id(main.TEST_LOGIN_NETWORK)
-            for network in addict.NETWORKS.keys():
-                aa = addict.AudioAddict(PROFILE_DIR, network)
+
+            def update_quality(network):
+                aa = addict.AudioAddict.get(PROFILE_DIR, network)
                 if aa.is_premium:
                     utils.logd('Updating preferred quality for:', network)
                     aa.preferred_quality(quality_id)
 
+            _, errors = addict.map_networks(update_quality)
+            for network, error in errors.items():
+                utils.logw('Updating quality for {} failed: {}'.format(
+                    network, error))
+
             self._quality = addon.getSettingInt('aa.quality')
 
 
+class Player(xbmc.Player):
+    '''Does the work which has to wait for playback to actually start so
+    plugin invocations can return as soon as a track is resolved.'''
+    def __init__(self, scheduler=None):
+        super().__init__()
+        self._scheduler = scheduler
+        self._started = None
+
+    def update_prefetch(self, playing):
+        # Tracks are only prefetched while a channel plays
+        if not self._scheduler:
+            return
+
+        if playing and playing['channel'] and not playing['is_live']:
+            self._scheduler.resume('prefetch')
+        else:
+            self._scheduler.pause('prefetch')
+
+    def onPlayBackStarted(self):
+        self._started = time.time()
+
+    def onPlayBackStopped(self):
+        self.update_prefetch(None)
+
+    def onPlayBackEnded(self):
+        self.update_prefetch(None)
+
+    def onAVStarted(self):
+        playing = utils.get_playing()
+        self.update_prefetch(playing)
+        if not playing:
+            return
+
+        if self._started:
+            utils.logd('Time to first audio: {:.3f}s'.format(time.time() -
+                                                             self._started))
+            self._started = None
+
+        if playing['channel']:
+            channel_started(self, playing)
+
+        # Only queued here, `onQueueNextItem` fires for the same track and
+        # would queue its successor twice
+        queue_next(playing)
+
+
+def channel_started(player, playing):
+    aa = addict.AudioAddict.get(PROFILE_DIR, playing['network'])
+
+    if playing['is_live'] and xbmcaddon.Addon().getSettingBool(
+            'addon.seek_offset'):
+        is_live, track = aa.next_channel_track(playing['channel'],
+                                               pop=False, live=True)
+        offset = track.get('content', {}).get('offset', 0)
+
+        if is_live and offset and track.get('id') == playing['track_id']:
+            # Have at least 30 sec. left to prevent the track ending before
+            # the next one has been queued
+            offset = min(track.get('length') - 30, offset)
+
+            utils.logd('Seeking to:', offset)
+            player.seekTime(offset)
+
+    aa.add_listen_history(playing['channel'], playing['track_id'])
+
+
+def queue_next(playing):
+    # Queue another track if it's the last one playing
+    playlist = xbmc.PlayList(xbmc.PLAYLIST_MUSIC)
+    if playlist.getposition() + 2 < playlist.size():
+        return
+
+    network = playing['network']
+    aa = addict.AudioAddict.get(PROFILE_DIR, network)
+
+    utils.logd('Adding another track to the playlist...')
+    if playing['channel']:
+        channel = playing['channel']
+
+        # The plugin advanced the queue when resolving the playing track
+        is_live, track = aa.next_channel_track(channel, tune_in=False,
+                                               pop=False,
+                                               live=not playing['is_live'],
+                                               reload=True)
+        album = '{} / {}'.format(aa.name, aa.get_channel_name(channel))
+        path = utils.build_path('channel', 'track', network, channel,
+                                track.get('id'), is_live=is_live)
+
+    else:
+        playlist_id = playing['playlist_id']
+        playlist_name = playing['playlist_name']
+
+        track = aa.next_playlist_track(playlist_id, pop=False, reload=True)
+        album = '{} / {}'.format(aa.name, playlist_name)
+        path = utils.build_path('playlist', 'track', network, playlist_id,
+                                track.get('id'), playlist_name=playlist_name)
+
+    utils.logd('Queuing track:', track.get('id'))
+    item = utils.build_track_item(track, path, album=album)
+    playlist.add(item.getPath(), item)
+
+
 def monitor_live(skip_shows=None):
+    '''Notifies about and tunes in to the shows which went live. Returns
+    the ids of the live shows which were handled already.'''
     if not skip_shows:
         skip_shows = []
 
-    now = addict.datetime_now()
+    now = time.time()
     addon = xbmcaddon.Addon()
 
+    live = []
     for network in addict.NETWORKS.keys():
         aa = addict.AudioAddict.get(PROFILE_DIR, network)
 
         if not aa.is_active or not aa.network['has_shows']:
             continue
 
-        followed = [s.get('slug') for s in aa.get_shows_followed()]
+        shows = [(end_at, show)
+                 for _, end_at, show in aa.get_schedule().started(now)
+                 if end_at >= now]
+        live.append((network, aa, shows))
 
-        shows = aa.get_live_shows()
-        live_show_ids = [s.get('id') for s in shows]
+    # Remove shows which are not live anymore
+    live_show_ids = [s.get('id') for *_, shows in live for __, s in shows]
+    skip_shows = [i for i in skip_shows if i in live_show_ids]
 
-        # Remove shows which are not live anymore
-        skip_shows = [i for i in skip_shows if i in live_show_ids]
+    for network, aa, shows in live:
+        followed = None
 
-        for show in shows:
+        for end_at, show in shows:
             if show.get('id') in skip_shows:
                 continue
 
-            end_at = addict.parse_datetime(show.get('end_at'))
-            if end_at < now:
-                continue
-
             skip_shows.append(show.get('id'))
 
             _show = show.get('show')
-            if _show.get('slug') in followed and addon.getSettingBool(
-                    'addon.notify_live'):
-                utils.notify('[B]{}[/B] is live!'.format(_show.get('name')))
+            if addon.getSettingBool('addon.notify_live'):
+                if followed is None:
+                    followed = [
+                        s.get('slug') for s in aa.get_shows_followed()
+                    ]
+
+                if _show.get('slug') in followed:
+                    utils.notify('[B]{}[/B] is live!'.format(
+                        _show.get('name')))
 
             if addon.getSettingBool('addon.tune_in_live'):
                 filename = xbmc.getInfoLabel('Player.Filenameandpath')
@@ -85,47 +214,271 @@ def monitor_live(skip_shows=None):
                         'Different network/channel playing, not tuning in.')
                     continue
 
-                if playing['live']:
+                if playing['is_live']:
                     utils.logd('Live stream already playing.')
                     break
 
-                time_left = (end_at - now).seconds
-                if time_left < 2:
+                time_left = int(end_at - now)
+                if time_left < 2 * 60:
                     utils.log('Less than 2 minutes left, not tuning in.')
                     break
 
                 utils.log('Tuning in to live stream...')
                 xbmc.executebuiltin('RunPlugin({})'.format(
-                    utils.build_path('play', network, playing['channel'],
-                                     live=True)))
+                    utils.build_path('play', 'channel', network,
+                                     playing['channel'], live=True)))
 
     return skip_shows
 
 
-def hourly():
-    # Clean up cache
-    for network in addict.NETWORKS.keys():
+class LiveScheduler:
+    '''Runs `monitor_live` right when a show starts or ends instead of
+    polling.
+
+    The next boundary is looked up in the cached schedules (see
+    `addict.ScheduleIndex`), `arm` has to be called again whenever they
+    might have been refreshed. A refreshed schedule (a new version of its
+    cache entry) runs `monitor_live` right away as shows might have gone
+    live in the meantime. Missing schedules are left to the schedule job.
+    '''
+    def __init__(self):
+        # Armed again by the schedule job from a worker thread
+        self._lock = threading.RLock()
+        self._versions = {}
+        self._skip_shows = []
+
+        # Time of the next run, None if nothing is scheduled
+        self.next_run = None
+
+    def arm(self):
+        with self._lock:
+            now = time.time()
+
+            changes = []
+            for network in addict.NETWORKS.keys():
+                aa = addict.AudioAddict.get(PROFILE_DIR, network)
+                if not aa.is_active or not aa.network['has_shows']:
+                    self._versions.pop(network, None)
+                    continue
+
+                schedule = aa.get_schedule()
+                version = aa.cache_version('shows_upcoming')
+                if (version is not None
+                        and self._versions.get(network) != version):
+                    self._versions[network] = version
+                    changes.append(now)
+                changes.append(schedule.next_change(now))
+
+            changes = [c for c in changes if c is not None]
+            self.next_run = min(changes) if changes else None
+
+    def due(self):
+        return self.next_run is not None and self.next_run <= time.time()
+
+    def run(self):
+        with self._lock:
+            self._skip_shows = monitor_live(self._skip_shows)
+            self.arm()
+
+
+def prefetch_tracks():
+    playing = utils.get_playing()
+    if not playing or not playing['channel'] or playing['is_live']:
+        return
+
+    aa = addict.AudioAddict.get(PROFILE_DIR, playing['network'])
+    if aa.refill_channel_tracks(playing['channel'], PREFETCH_MIN_TRACKS,
+                                PREFETCH_URL_MARGIN):
+        utils.logd('Prefetched tracks for', playing['channel'])
+
+
+def for_networks(func, failure):
+    _, errors = addict.map_networks(func)
+    for network, error in errors.items():
+        utils.logw(failure.format(network, error))
+
+    # Fails the job so it's retried with backoff
+    if errors:
+        raise next(iter(errors.values()))
+
+
+def invalidate_caches():
+    def invalidate(network):
         utils.logd('Invalidating cache for {}'.format(network))
-        aa = addict.AudioAddict.get(PROFILE_DIR, network)
-        aa.invalidate_cache()
+        addict.AudioAddict.get(PROFILE_DIR, network).invalidate_cache()
+
+    for_networks(invalidate, 'Invalidating cache for {} failed: {}')
 
+
+def update_session():
     # Update user information (like premium status etc.)
     utils.logd('Updating user information')
     aa = addict.AudioAddict.get(PROFILE_DIR, main.TEST_LOGIN_NETWORK)
     aa.get_member_session()
 
 
-if __name__ == '__main__':
-    monitor = Monitor()
+# Versions of the cache entries the snapshots were last compiled from, by
+# network
+_snapshot_sources = {}
 
-    skip_shows = []
-    while not monitor.abortRequested():
-        now = datetime.utcnow()
 
-        if monitor.waitForAbort(60 - now.second):
+def snapshot_sources(aa):
+    return tuple(aa.cache_version(key) for key in addict.SNAPSHOT_SOURCES)
+
+
+def snapshots_outdated():
+    now = time.time()
+    for network in addict.NETWORKS.keys():
+        aa = addict.AudioAddict.get(PROFILE_DIR, network)
+        if not aa.is_active:
+            continue
+
+        # Expired sources are revalidated by compiling
+        sources = snapshot_sources(aa)
+        if (sources != _snapshot_sources.get(network)
+                or any(s is None or s < now for s in sources)):
+            return True
+    return False
+
+
+def update_snapshots():
+    # Listings are served from the snapshots, compile them again once the
+    # cached catalog or favorites changed
+    def update(network):
+        aa = addict.AudioAddict.get(PROFILE_DIR, network)
+        if not aa.is_active:
+            return
+
+        if aa.update_snapshot():
+            utils.logd('Compiled the catalog snapshot of', network)
+        _snapshot_sources[network] = snapshot_sources(aa)
+
+    for_networks(update, 'Compiling the catalog snapshot of {} failed: {}')
+
+
+def get_stats():
+    return addict.AudioAddict.get(PROFILE_DIR, main.TEST_LOGIN_NETWORK).stats
+
+
+def profiled(name, func):
+    '''``func`` profiled as ``service_<name>`` if profiling is enabled.
+
+    cProfile can't profile threads concurrently, jobs running while another
+    one is profiled aren't.
+    '''
+    @functools.wraps(func)
+    def wrapper():
+        enabled = (profiling.is_enabled()
+                   and _profile_lock.acquire(blocking=False))
+        try:
+            with profiling.profile('service_' + name, enabled):
+                func()
+        finally:
+            if enabled:
+                _profile_lock.release()
+
+    return wrapper
+
+
+_profile_lock = threading.Lock()
+
+
+def is_browsing():
+    return (xbmc.getInfoLabel('Container.FolderPath').startswith(
+        'plugin://{}/'.format(ADDON_ID))
+        and xbmc.getGlobalIdleTime() < BROWSING_IDLE)
+
+
+def create_jobs(live):
+    '''The service's periodic tasks, see `jobs.Job`.'''
+    def job(name, func, interval, **kwargs):
+        return jobs.Job(name, profiled(name, func), interval, **kwargs)
+
+    return [
+        # The playing channel must never run out of tracks, resumed by the
+        # `Player` while a channel plays
+        job('prefetch', prefetch_tracks, 60, priority=0, max_runtime=30,
+            defer=False, paused=True),
+        # Refreshes the expired schedules while arming
+        job('schedule', live.arm, 5 * 60, priority=1, defer=False),
+        job('session', update_session, 60 * 60, priority=2, delay=60 * 60),
+        # Neither wakes the service on its own
+        job('catalog', update_snapshots, 60, priority=3,
+            when=snapshots_outdated, wake=False),
+        job('stats', lambda: get_stats().flush(force=True), 60, priority=5,
+            defer=False, when=lambda: get_stats().pending, wake=False),
+        job('invalidate', invalidate_caches, 60 * 60, priority=8,
+            delay=60 * 60),
+    ]
+
+
+def update_daemon(daemon):
+    '''Starts or stops the daemon plugin invocations are served from
+    according to the settings. Returns the running daemon (if any).'''
+    enabled = xbmcaddon.Addon().getSettingBool('addon.daemon')
+
+    if enabled and not daemon:
+        try:
+            daemon = rpc.Daemon(PROFILE_DIR).start()
+            utils.logd('Daemon started')
+        except OSError as e:
+            utils.logw('Starting the daemon failed: {}'.format(e))
+
+    elif not enabled and daemon:
+        daemon.stop()
+        daemon = None
+        utils.logd('Daemon stopped')
+
+    return daemon
+
+
+def run(monitor):
+    '''The service's main loop, returns once Kodi asks it to stop.'''
+    stats.ApiStats.enabled = xbmcaddon.Addon().getSettingBool('addon.stats')
+    daemon = update_daemon(None)
+
+    live = LiveScheduler()
+    live.arm()
+
+    aa = addict.AudioAddict.get(PROFILE_DIR, main.TEST_LOGIN_NETWORK)
+    scheduler = jobs.Scheduler(aa.backend, create_jobs(live), is_browsing)
+    scheduler.save()
+
+    player = Player(scheduler)
+    player.update_prefetch(utils.get_playing())
+
+    while not monitor.abortRequested():
+        timeouts = [scheduler.due_in()]
+        if live.next_run is not None:
+            timeouts.append(max(0, live.next_run - time.time()))
+        timeouts = [t for t in timeouts if t is not None]
+
+        # Kodi waits without a timeout for a timeout of 0 as well
+        if not timeouts:
+            aborted = monitor.waitForAbort()
+        elif min(timeouts) > 0:
+            aborted = monitor.waitForAbort(min(timeouts))
+        else:
+            aborted = monitor.abortRequested()
+        if aborted:
             break
 
-        skip_shows = monitor_live(skip_shows)
+        # Pick up what plugin invocations wrote in the meantime
+        for backend in cache.CacheBackend.instances():
+            backend.revalidate()
+
+        if live.due():
+            profiled('monitor_live', live.run)()
+
+        scheduler.run_pending()
+        daemon = update_daemon(daemon)
+
+    scheduler.shutdown()
+    if daemon:
+        daemon.stop()
+
+
+if __name__ == '__main__':
+    addict.AudioAddict.call_class = 'background'
 
-        if now.minute == 0:
-            hourly()
+    run(Monitor())